@@ -6,6 +6,8 @@ import hashlib
 import subprocess
 import platform
 import json
+import heapq
+import cv2
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -17,16 +19,40 @@ from rich.rule import Rule
 os.environ["OPENCV_LOG_LEVEL"] = "OFF"
 
 from aegis.handlers.ppt import PPTHandler
+from aegis.handlers.ooxml import OOXMLHandler, DOCXHandler, XLSXHandler
 from aegis.handlers.image import ImageHandler
-from aegis.handlers.pdf import PDFHandler
+from aegis.handlers.pdf import PDFHandler, PAGE_CODECS
 from aegis.core.signature import SignatureManager
 from aegis.core.sniffer import sniff_file_type
 from aegis.core.database import TrackingDB
 from aegis.core.mailer import Mailer
+from aegis.core.search import MIN_MARGIN
+from aegis.core.frequency import PAYLOAD_MODES
+from aegis.core.matching import TemplateStack, is_confident
+from aegis.core.mediacache import MediaCache
+from aegis.core.scramble import CACHE_DIR_ENV
+from aegis.scanner import scan_directory
 
 console = Console()
 sig_mgr = SignatureManager()
 db = TrackingDB()
+# 嗅探类型 -> OOXML 容器处理器；嗅探失败时按扩展名回退
+OOXML_HANDLERS = {'ppt': PPTHandler, 'docx': DOCXHandler, 'xlsx': XLSXHandler, 'ooxml': OOXMLHandler}
+OOXML_EXTS = {'pptx': 'ppt', 'docx': 'docx', 'xlsx': 'xlsx'}
+
+# 嗅探类型 -> 默认输出扩展名 (图片统一输出无损 PNG)
+OUTPUT_EXTS = {'pdf': '.pdf', 'ppt': '.pptx', 'docx': '.docx', 'xlsx': '.xlsx', 'image': '.png'}
+
+def default_protected_path(input_path):
+    """默认输出路径：[输入]_protected + 与文件类型相符的扩展名；无法识别时按输入扩展名判断"""
+    f_type = sniff_file_type(input_path)
+    ext = OUTPUT_EXTS.get(f_type)
+    if ext is None:
+        # 未能识别主文档的 OOXML 容器 / 嗅探失败时沿用原扩展名 (PDF、PPTX、DOCX、XLSX)
+        input_ext = os.path.splitext(input_path)[1].lower()
+        known = f_type == 'ooxml' or input_ext.lstrip('.') in OOXML_EXTS or input_ext == '.pdf'
+        ext = input_ext if known else '.png'
+    return input_path + "_protected" + ext
 
 def open_file(path):
     """跨平台打开文件"""
@@ -219,7 +245,7 @@ def run_embed_wizard():
     input_file = get_input(msg["path_input"], path=True)
     if input_file == ":b" or not input_file: return
     
-    default_out = input_file + "_protected" + (".pdf" if input_file.lower().endswith('.pdf') else ".png")
+    default_out = default_protected_path(input_file)
     output_file = get_input(msg["path_output"], default=default_out)
     if output_file == ":b": return
     
@@ -312,17 +338,23 @@ def run_settings_wizard():
     
     while True:
         choices = []
+        # 菜单项 -> 身份算法 (Ed25519 / ECDSA 生成与签名更快，适合批量分发签署)
         if CURRENT_LANG == "zh": 
-            choices = ["新建身份证书 (RSA)", "配置分发邮箱 (SMTP)", msg["menu_back"]]
+            identity_choices = {"新建身份证书 (RSA)": "rsa", "新建身份证书 (Ed25519)": "ed25519",
+                                "新建身份证书 (ECDSA P-256)": "ecdsa-p256"}
+            choices = [*identity_choices, "配置分发邮箱 (SMTP)", msg["menu_back"]]
         else: 
-            choices = ["Create New Identity (RSA)", "Configure Mailer (SMTP)", msg["menu_back"]]
+            identity_choices = {"Create New Identity (RSA)": "rsa", "Create New Identity (Ed25519)": "ed25519",
+                                "Create New Identity (ECDSA P-256)": "ecdsa-p256"}
+            choices = [*identity_choices, "Configure Mailer (SMTP)", msg["menu_back"]]
         
         sub_action = questionary.select("Settings:", choices=choices, qmark=">").ask()
         
         if sub_action is None or msg["menu_back"] in sub_action:
             break
             
-        if "RSA" in sub_action:
+        if sub_action in identity_choices:
+            algorithm = identity_choices[sub_action]
             # 检查已有身份
             identities = sig_mgr.list_identities()
             new_id = None
@@ -339,40 +371,49 @@ def run_settings_wizard():
             email = get_input(msg["ident_email"])
             if email == ":b": continue
             
-            with console.status("[bold green]Generating RSA-4096 cryptographic identity...[/bold green]"):
-                sig_mgr.create_identity(name, email, ident_id=new_id)
+            label = {"rsa": "RSA-4096", "ed25519": "Ed25519", "ecdsa-p256": "ECDSA P-256"}[algorithm]
+            with console.status(f"[bold green]Generating {label} cryptographic identity...[/bold green]"):
+                sig_mgr.create_identity(name, email, ident_id=new_id, algorithm=algorithm)
             console.print(f"[bold green]{msg['ident_success']}[/bold green]")
             
         else:
             ctx = click.get_current_context()
             ctx.invoke(config)
 
-def run_embed(input, output, text, key, should_sign=False, ident_id=None):
+def run_embed(input, output, text, key, should_sign=False, ident_id=None, tiled=False, memory_budget=None,
+              codec="png", quality=None, media_cache=False):
     """执行嵌入核心逻辑"""
     msg = MESSAGES[CURRENT_LANG]
+    # 分块流式模式仅作用于图片
+    image_opts = {"tiled": tiled}
+    if memory_budget:
+        image_opts["memory_budget"] = memory_budget * 1024 * 1024
+    # 页面图像编码仅作用于 PDF，媒体缓存仅作用于 PPTX / DOCX / XLSX
+    pdf_opts = {"codec": codec, "quality": quality}
+    cache = MediaCache() if media_cache else None
     # 使用嗅探器识别格式
     f_type = sniff_file_type(input)
     
     with console.status(f"[bold green]{msg['processing']}[/bold green]...", spinner="dots"):
         try:
-            if f_type == 'ppt':
-                handler = PPTHandler()
+            if f_type in OOXML_HANDLERS:
+                handler = OOXML_HANDLERS[f_type](media_cache=cache)
                 success = handler.process(input, output, text, key=key)
             elif f_type == 'pdf':
                 handler = PDFHandler()
-                success = handler.process(input, output, text, key=key)
+                success = handler.process(input, output, text, key=key, **pdf_opts)
             elif f_type == 'image':
                 handler = ImageHandler()
-                success = handler.process(input, output, text, key=key)
+                success = handler.process(input, output, text, key=key, **image_opts)
             else:
                 # Fallback 到后缀判断
                 ext = input.lower().split('.')[-1]
-                if ext == 'pptx':
-                    handler = PPTHandler()
+                if ext in OOXML_EXTS:
+                    handler = OOXML_HANDLERS[OOXML_EXTS[ext]](media_cache=cache)
                     success = handler.process(input, output, text, key=key)
-                elif ext in ['png', 'jpg', 'jpeg', 'bmp']:
+                elif ext in ['png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff']:
                     handler = ImageHandler()
-                    success = handler.process(input, output, text, key=key)
+                    success = handler.process(input, output, text, key=key, **image_opts)
                 else:
                     success = False
             
@@ -387,10 +428,11 @@ def run_embed(input, output, text, key, should_sign=False, ident_id=None):
         res_text = Text(f"{msg['success_embed']} ", style="bold green")
         res_text.append(output, style="underline cyan")
         console.print(res_text)
+        console.print(f"Output size: {format_size(os.path.getsize(output))} (source: {format_size(os.path.getsize(input))})")
     else:
         console.print(f"[bold red]{msg['fail_embed']}[/bold red]")
 
-def run_extract(input, output, key):
+def run_extract(input, output, key, tiled=False):
     """执行提取核心逻辑"""
     msg = MESSAGES[CURRENT_LANG]
     # 使用嗅探器识别格式
@@ -404,23 +446,23 @@ def run_extract(input, output, key):
             temp_handler = ImageHandler() 
             sig_status, sig_info = temp_handler.get_signature(input, sig_mgr)
 
-            if f_type == 'ppt':
-                handler = PPTHandler()
-                result = handler.extract(input, key=key)
+            if f_type in OOXML_HANDLERS:
+                handler = OOXML_HANDLERS[f_type]()
+                result = handler.extract(input, output_wm_path=output, key=key)
             elif f_type == 'pdf':
                 handler = PDFHandler()
                 result = handler.extract(input, output_wm_path=output, key=key)
             elif f_type == 'image' or sig_status != "none":
                 handler = ImageHandler()
-                result = handler.extract(input, output_wm_path=output, key=key)
+                result = handler.extract(input, output_wm_path=output, key=key, tiled=tiled)
             else:
                 ext = input.lower().split('.')[-1]
-                if ext == 'pptx':
-                    handler = PPTHandler()
-                    result = handler.extract(input, key=key)
-                elif ext in ['png', 'jpg', 'jpeg', 'bmp']:
-                    handler = ImageHandler()
+                if ext in OOXML_EXTS:
+                    handler = OOXML_HANDLERS[OOXML_EXTS[ext]]()
                     result = handler.extract(input, output_wm_path=output, key=key)
+                elif ext in ['png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff']:
+                    handler = ImageHandler()
+                    result = handler.extract(input, output_wm_path=output, key=key, tiled=tiled)
         except Exception as e:
             console.print(f"[bold red]Error:[/bold red] {e}")
             sig_status = "error"
@@ -434,7 +476,7 @@ def run_extract(input, output, key):
 
         table.add_row(msg["target_file"], os.path.basename(input))
         table.add_row(msg["sniff_report"], f_type.upper() if f_type != 'unknown' else "AUTO")
-        table.add_row(msg["key_fingerprint"], f"SHA256(***{key[-3:] if len(key) >= 3 else key})")
+        table.add_row(msg["key_fingerprint"], mask_key(key))
         
         if sig_status == "valid" and sig_info:
             table.add_row(msg["sig_status"], msg["sig_verified"])
@@ -455,46 +497,119 @@ def run_extract(input, output, key):
     else:
         console.print(Panel(msg["fail_extract"], border_style="red"))
 
+def format_size(n):
+    """字节数 -> 便于阅读的大小"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def mask_key(key):
+    return f"SHA256(***{key[-3:] if len(key) >= 3 else key})"
+
+def run_search(input, output, key, widths=()):
+    """搜索模式：命令行密钥 + 分发数据库中的全部密钥，枚举尺度后给出排名"""
+    msg = MESSAGES[CURRENT_LANG]
+    f_type = sniff_file_type(input)
+    if f_type in OOXML_HANDLERS: handler = OOXML_HANDLERS[f_type]()
+    elif f_type == 'pdf': handler = PDFHandler()
+    else: handler = ImageHandler()
+    keys = [key] + db.distinct_keys()
+
+    with console.status(f"[bold blue]{msg['scanning']}[/bold blue] ({len(keys)} keys)...", spinner="earth"):
+        result, matches = handler.search(input, keys, output_wm_path=output, extra_widths=widths)
+
+    if not (result and matches):
+        console.print(Panel(msg["fail_extract"], border_style="red"))
+        return None
+
+    table = Table(title="Search Ranking", show_header=True, header_style="bold magenta")
+    table.add_column("#")
+    table.add_column("Key")
+    table.add_column("Width")
+    table.add_column("Median")
+    table.add_column("Score")
+    for rank, match in enumerate(matches[:5], 1):
+        table.add_row(str(rank), mask_key(match.key), str(match.width),
+                      "yes" if match.filtered else "no", f"{match.score:.3f}")
+    console.print(table)
+    if matches[0].score < MIN_MARGIN:
+        console.print("[yellow]Best candidate is weak; the evidence may be noise.[/yellow]")
+    console.print(f"[green]{msg['evidence']}:[/green] {result}")
+    open_file(result)
+    return matches[0]
+
 @click.group(invoke_without_command=True)
+@click.option('--cache-dir', type=click.Path(file_okay=False), envvar=CACHE_DIR_ENV,
+              help=f"Persist key-derived scrambling tables here and reuse them across runs (or set {CACHE_DIR_ENV}). Off by default.")
 @click.pass_context
-def main(ctx):
+def main(ctx, cache_dir):
     """Aegis: Blind Watermarking & Digital Signature Tool."""
+    if cache_dir:
+        # 用户显式开启持久化：置乱材料落盘复用 (子进程通过环境变量继承)
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ[CACHE_DIR_ENV] = os.path.abspath(cache_dir)
     if ctx.invoked_subcommand is None:
         interactive_menu()
 
 @main.command()
-@click.option('--input', '-i', required=True, help="Path to the source file (Image/PDF/PPTX).")
-@click.option('--output', '-o', help="Path to save the protected file. (Defaults to [in]_protected.png/pdf)")
+@click.option('--input', '-i', required=True, help="Path to the source file (Image/PDF/PPTX/DOCX/XLSX).")
+@click.option('--output', '-o', help="Path to save the protected file. (Defaults to [in]_protected.png/pdf/pptx/docx/xlsx)")
 @click.option('--text', '-t', required=True, help="Watermark text to embed.")
 @click.option('--key', '-k', default="1", help="Security key for blind watermarking. (Default: 1)")
-def embed(input, output, text, key):
+@click.option('--tiled', is_flag=True, help="Images only: keep full resolution and stream tiles (for very large scans).")
+@click.option('--memory-budget', type=int, default=512, show_default=True, help="Peak memory budget in MB for --tiled mode.")
+@click.option('--codec', type=click.Choice(PAGE_CODECS), default="png", show_default=True,
+              help="PDFs only: encoding of the watermarked page images. Lossy settings are checked on the first page and raised or reverted to png if the watermark would not survive.")
+@click.option('--quality', type=click.IntRange(1, 100), help="PDFs only: quality for --codec jpeg/jp2. (Default: jpeg 90, jp2 10)")
+@click.option('--media-cache', is_flag=True, help="PPTX/DOCX/XLSX only: reuse watermarked media from earlier runs (same image, text and key).")
+def embed(input, output, text, key, tiled, memory_budget, codec, quality, media_cache):
     """Embed invisible watermark and optional digital signature."""
     if not output:
-        output = input + "_protected" + (".pdf" if input.lower().endswith('.pdf') else ".png")
+        output = default_protected_path(input)
     print_banner()
-    run_embed(input, output, text, key)
+    run_embed(input, output, text, key, tiled=tiled, memory_budget=memory_budget, codec=codec, quality=quality,
+              media_cache=media_cache)
 
 @main.command()
 @click.option('--input', '-i', required=True, help="Path to the protected file.")
 @click.option('--output', '-o', help="Path to save the evidence image. (Defaults to [in]_evidence.png)")
 @click.option('--key', '-k', default="1", help="Security key used during embedding.")
-def extract(input, output, key):
+@click.option('--tiled', is_flag=True, help="Images only: extract from a file embedded with --tiled.")
+@click.option('--search', is_flag=True, help="Try several scales and every key in the tracking database (rescaled leaks).")
+@click.option('--width', 'widths', type=int, multiple=True, help="Extra candidate width for --search (repeatable).")
+def extract(input, output, key, tiled, search, widths):
     """Extract and analyze watermark/signature from a file."""
     if not output:
         output = input + "_evidence.png"
     print_banner()
-    run_extract(input, output, key)
+    if search:
+        run_search(input, output, key, widths)
+    else:
+        run_extract(input, output, key, tiled=tiled)
 
 @main.command()
-@click.option('--input', '-i', required=True, help="Original file to distribute (Image/PDF/PPTX).")
+@click.option('--input', '-i', required=True, help="Original file to distribute (Image/PDF/PPTX/DOCX/XLSX).")
 @click.option('--recipients', '-r', required=True, help="A text file containing one email address per line.")
 @click.option('--template', '-t', default="ID: {}", help="Template for watermark. '{}' will be replaced by unique ID.")
 @click.option('--key', '-k', default="1", help="Security key for watermarking.")
 @click.option('--subject', '-s', default="Protected File Delivery", help="Email subject.")
-def distribute(input, recipients, template, key, subject):
+@click.option('--batch', '-b', default=16, show_default=True, type=click.IntRange(min=1), help="Recipients per batch; the source is analysed once per batch.")
+@click.option('--mode', '-m', type=click.Choice(PAYLOAD_MODES), default="text", show_default=True,
+              help="'text' embeds the rendered template; 'payload' embeds the tracking ID as error-corrected bits for unattended tracing.")
+@click.option('--codec', type=click.Choice(PAGE_CODECS), default="png", show_default=True, help="PDFs only: encoding of the watermarked page images (see 'embed --help').")
+@click.option('--quality', type=click.IntRange(1, 100), help="PDFs only: quality for --codec jpeg/jp2.")
+@click.option('--media-cache', is_flag=True, help="PPTX/DOCX/XLSX only: reuse watermarked media from earlier runs (same image, text and key).")
+@click.option('--sign', is_flag=True, help="Digitally sign every recipient's copy (an Ed25519/ECDSA identity signs much faster than RSA).")
+@click.option('--identity', 'ident_id', help="Identity used with --sign. (Default: the default identity)")
+def distribute(input, recipients, template, key, subject, batch, mode, codec, quality, media_cache, sign, ident_id):
     """Batch distribute personalized files with unique tracking IDs."""
     import uuid
     
+    if sign and not sig_mgr.has_identity():
+        console.print("[red]No signing identity found. Create one in the settings menu first.[/red]")
+        return
+    
     cfg_path = os.path.join(os.path.expanduser("~"), ".aegis_identity", "config.json")
     if not os.path.exists(cfg_path):
         console.print("[red]SMTP not configured. Run 'aegis config' first.[/red]")
@@ -519,71 +634,193 @@ def distribute(input, recipients, template, key, subject):
     print_banner()
     console.print(f"[*] Starting Batch Distribution for {len(email_list)} recipients...")
 
-    for email in email_list:
-        dist_id = uuid.uuid4().hex[:8].upper()
-        wm_text = template.replace("{}", dist_id)
-        # 更加规范的临时文件名
-        base, ext = os.path.splitext(os.path.basename(input))
-        temp_output = f"dist_{dist_id}_{base}{ext}"
-        
-        console.print(f"[*] Processing for [cyan]{email}[/cyan] (ID: {dist_id})...")
-        log_id = db.log_distribution(os.path.basename(input), email, dist_id, key)
+    f_type = sniff_file_type(input)
+    if f_type in OOXML_HANDLERS: handler = OOXML_HANDLERS[f_type](media_cache=MediaCache() if media_cache else None)
+    elif f_type == 'pdf': handler = PDFHandler()
+    else: handler = ImageHandler()
+    variant_opts = {"codec": codec, "quality": quality} if f_type == 'pdf' else {}
+    base, ext = os.path.splitext(os.path.basename(input))
+
+    # 按批处理：同一批收件人共享一次解码与频域分析，只重复水印相关的步骤
+    for start in range(0, len(email_list), batch):
+        entries = []
+        for email in email_list[start:start + batch]:
+            dist_id = uuid.uuid4().hex[:8].upper()
+            # 更加规范的临时文件名
+            temp_output = f"dist_{dist_id}_{base}{ext}"
+            log_id = db.log_distribution(os.path.basename(input), email, dist_id, key,
+                                         template=template if mode == "text" else None)
+            entries.append((email, dist_id, temp_output, log_id))
         
-        f_type = sniff_file_type(input)
-        if f_type == 'ppt': handler = PPTHandler()
-        elif f_type == 'pdf': handler = PDFHandler()
-        else: handler = ImageHandler()
+        console.print(f"[*] Embedding batch {start // batch + 1} ({len(entries)} recipients)...")
+        # payload 模式直接嵌入追踪 ID 本身，模板只用于人工辨认的文字水印
+        results = handler.process_variants(input, [(out, dist_id if mode == "payload" else template.replace("{}", dist_id))
+                                                   for _, dist_id, out, _ in entries], key=key, mode=mode, **variant_opts)
         
-        if handler.process(input, temp_output, wm_text, key=key):
-            body = f"Hello,\n\nPlease find the protected document attached.\n\nVerify ID: {dist_id}\n\nRegards,\nAegis System"
-            success = mailer.send_protected_file(email, temp_output, subject, body)
-            if success:
-                db.update_status(log_id, "SUCCESS")
-                console.print(f"  [green]Email sent successfully.[/green]")
+        for (email, dist_id, temp_output, log_id), ok in zip(entries, results):
+            console.print(f"[*] Processing for [cyan]{email}[/cyan] (ID: {dist_id})...")
+            if ok and sign and not handler.attach_signature(temp_output, sig_mgr, ident_id=ident_id):
+                db.update_status(log_id, "SIGN_FAILED")
+            elif ok:
+                console.print(f"  Output size: {format_size(os.path.getsize(temp_output))}")
+                body = f"Hello,\n\nPlease find the protected document attached.\n\nVerify ID: {dist_id}\n\nRegards,\nAegis System"
+                success = mailer.send_protected_file(email, temp_output, subject, body)
+                if success:
+                    db.update_status(log_id, "SUCCESS")
+                    console.print(f"  [green]Email sent successfully.[/green]")
+                else:
+                    db.update_status(log_id, "MAIL_FAILED")
             else:
-                db.update_status(log_id, "MAIL_FAILED")
-        else:
-            db.update_status(log_id, "EMBED_FAILED")
-        
-        if os.path.exists(temp_output): os.remove(temp_output)
+                db.update_status(log_id, "EMBED_FAILED")
+            
+            if os.path.exists(temp_output): os.remove(temp_output)
 
 @main.command()
-@click.option('--input', '-i', required=True, help="Path to the leaked file.")
+@click.option('--input', '-i', help="Path to the leaked file.")
 @click.option('--key', '-k', default="1", help="Security key used during distribution.")
-def trace(input, key):
+@click.option('--search', is_flag=True, help="Try several scales and every key in the tracking database.")
+@click.option('--scan', 'scan_dir', type=click.Path(exists=True, file_okay=False), help="Scan every file under a directory in parallel (payload mode, unattended).")
+@click.option('--jsonl', default="trace_scan.jsonl", show_default=True, help="Where --scan streams one JSON result per file.")
+@click.option('--workers', '-w', type=click.IntRange(min=1), help="Worker processes for --scan. (Default: all cores)")
+def trace(input, key, search, scan_dir, jsonl, workers):
     """Trace a leaked file back to its recipient using the tracking database."""
+    if scan_dir:
+        print_banner()
+        run_scan(scan_dir, key, jsonl, workers=workers)
+        return
+    if not input:
+        raise click.UsageError("Either --input or --scan is required.")
     print_banner()
     base, _ = os.path.splitext(os.path.basename(input))
     temp_wm = f"trace_{base}_evidence.png"
     
     f_type = sniff_file_type(input)
-    if f_type == 'ppt': handler = PPTHandler()
+    if f_type in OOXML_HANDLERS: handler = OOXML_HANDLERS[f_type]()
     elif f_type == 'pdf': handler = PDFHandler()
     else: handler = ImageHandler()
     
-    result_path = handler.extract(input, output_wm_path=temp_wm, key=key)
+    # 优先尝试机读载荷：译码成功即可直接查库，无需人工辨认证据图
+    if not search:
+        dist_id, conf = handler.decode_payload(input, key=key)
+        if dist_id:
+            console.print(f"[green][*] Decoded tracking ID {dist_id} (confidence {conf:.2f})[/green]")
+            show_trace_record(db.find_by_watermark(dist_id))
+            return
+
+    if search:
+        result_path, matches = handler.search(input, [key] + db.distinct_keys(), output_wm_path=temp_wm)
+        if matches:
+            best = matches[0]
+            console.print(f"[*] Best match: key {mask_key(best.key)}, width {best.width}, score {best.score:.3f}")
+    else:
+        result_path = handler.extract(input, output_wm_path=temp_wm, key=key)
     
     if result_path and os.path.exists(result_path):
+        # 与全部已分发的文字水印模板做相关匹配，结果明确时无需人工辨认
+        matches = match_templates(result_path)
+        if matches:
+            show_template_matches(matches)
+        if is_confident(matches):
+            show_trace_record(db.find_by_id(matches[0][0]))
+            return
+
         open_file(result_path)
         console.print(f"[yellow]Watermark extracted to {result_path} (Auto-opened).[/yellow]")
         dist_id = questionary.text("Enter the tracking ID identified in the image:").ask()
         
         if dist_id:
-            record = db.find_by_watermark(dist_id)
-            if record:
-                table = Table(title="Trace Results", header_style="bold magenta")
-                table.add_column("Field")
-                table.add_column("Value")
-                table.add_row("Recipient", f"[bold green]{record[2]}[/bold green]")
-                table.add_row("Original File", record[1])
-                table.add_row("Timestamp", str(record[5]))
-                table.add_row("Status", record[6])
-                console.print(table)
-            else:
-                console.print("[red]No matching distribution record found in database.[/red]")
+            show_trace_record(db.find_by_watermark(dist_id))
     else:
         console.print("[red]Failed to extract watermark signal.[/red]")
 
+def match_templates(wm_path):
+    """同步模板缓存后，将证据图与全部文字水印模板匹配，返回 [(行号, 相关系数), ...]"""
+    wm = cv2.imread(wm_path, cv2.IMREAD_GRAYSCALE)
+    if wm is None: return []
+    stack = TemplateStack()
+    with console.status("[bold blue]Matching against distributed templates...[/bold blue]", spinner="earth"):
+        stack.sync(db)
+        return stack.match(wm)
+
+def show_template_matches(matches):
+    table = Table(title="Template Matches", header_style="bold magenta")
+    table.add_column("#")
+    table.add_column("ID")
+    table.add_column("Recipient")
+    table.add_column("Score")
+    for rank, (row_id, score) in enumerate(matches, 1):
+        record = db.find_by_id(row_id)
+        if record:
+            table.add_row(str(rank), record[3], record[2], f"{score:.3f}")
+    console.print(table)
+
+def run_scan(directory, key, jsonl_path, workers=None, top=20):
+    """
+    批量溯源：并行扫描目录，逐个文件把结果写入 JSONL (边处理边写出)，最后按置信度输出排名。
+    只依赖机读载荷，全程无需人工辨认，也不会打开任何查看器。
+    """
+    keys = list(dict.fromkeys([key] + db.distinct_keys()))
+    stack = TemplateStack()
+    with console.status("[bold blue]Updating template cache...[/bold blue]", spinner="earth"):
+        stack.sync(db)
+    counts = {}
+    ranked = []  # 置信度最高的 top 条命中 (小顶堆)，内存与文件总数无关
+
+    with open(jsonl_path, "w", encoding="utf-8") as out, \
+         console.status(f"[bold blue]{MESSAGES[CURRENT_LANG]['scanning']}[/bold blue]...", spinner="earth") as status:
+        for n, res in enumerate(scan_directory(directory, keys, workers=workers, template_dir=stack.root), 1):
+            key_index = res.pop("key_index")
+            res["key"] = mask_key(keys[key_index]) if key_index is not None else None
+            if res["status"] == "template":
+                record = db.find_by_id(res.pop("row_id"))
+                res["id"] = record[3] if record else None
+            else:
+                record = db.find_by_watermark(res["id"]) if res["id"] else None
+            if res["status"] in ("decoded", "template"):
+                res["status"] = "matched" if record else "unknown_id"
+            if record:
+                res.update(recipient=record[2], original_file=record[1], distributed_at=str(record[5]))
+            out.write(json.dumps(res, ensure_ascii=False) + "\n")
+            out.flush()
+
+            counts[res["status"]] = counts.get(res["status"], 0) + 1
+            if res["id"]:
+                entry = (res["status"] == "matched", res["confidence"], n, res)
+                if len(ranked) < top: heapq.heappush(ranked, entry)
+                else: heapq.heappushpop(ranked, entry)
+            status.update(f"[bold blue]{n} files scanned, {counts.get('matched', 0)} matched[/bold blue]")
+
+    summary = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items()))
+    console.print(f"[*] Scan finished ({summary or 'no files'}). Results: {jsonl_path}")
+    if not ranked:
+        console.print("[red]No decodable tracking ID found.[/red]")
+        return
+
+    table = Table(title="Trace Ranking", header_style="bold magenta")
+    table.add_column("#")
+    table.add_column("File")
+    table.add_column("ID")
+    table.add_column("Recipient")
+    table.add_column("Confidence")
+    for rank, (_, conf, _, res) in enumerate(sorted(ranked, reverse=True), 1):
+        recipient = res.get("recipient") or "[red]not in database[/red]"
+        table.add_row(str(rank), os.path.relpath(res["path"], directory), res["id"], recipient, f"{conf:.2f}")
+    console.print(table)
+
+def show_trace_record(record):
+    """打印分发记录，未找到时给出提示"""
+    if record:
+        table = Table(title="Trace Results", header_style="bold magenta")
+        table.add_column("Field")
+        table.add_column("Value")
+        table.add_row("Recipient", f"[bold green]{record[2]}[/bold green]")
+        table.add_row("Original File", record[1])
+        table.add_row("Timestamp", str(record[5]))
+        table.add_row("Status", record[6])
+        console.print(table)
+    else:
+        console.print("[red]No matching distribution record found in database.[/red]")
+
 @main.command()
 def config():
     """Setup SMTP credentials and test the connection."""
@@ -21,17 +21,24 @@ class TrackingDB:
                 watermark_id TEXT UNIQUE,
                 key_used TEXT,
                 timestamp DATETIME,
-                status TEXT
+                status TEXT,
+                template TEXT
             )
         ''')
+        # 旧库迁移：补充水印模板列。旧记录的模板可由 --template 任意指定且未被保存，无从得知，
+        # 保持 NULL (模板匹配跳过这些记录，仍可按水印 ID 人工核对)
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(distributions)')]
+        if 'template' not in columns:
+            cursor.execute('ALTER TABLE distributions ADD COLUMN template TEXT')
         self.conn.commit()
 
-    def log_distribution(self, filename, recipient, watermark_id, key_used, status="PENDING"):
+    def log_distribution(self, filename, recipient, watermark_id, key_used, status="PENDING", template=None):
+        """template: 文字水印模板 ('{}' 处为 watermark_id)；机读载荷模式不渲染文字，记为 None"""
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT INTO distributions (filename, recipient, watermark_id, key_used, timestamp, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (filename, recipient, watermark_id, key_used, datetime.now(), status))
+            INSERT INTO distributions (filename, recipient, watermark_id, key_used, timestamp, status, template)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (filename, recipient, watermark_id, key_used, datetime.now(), status, template))
         self.conn.commit()
         return cursor.lastrowid
 
@@ -45,3 +52,21 @@ class TrackingDB:
         # 模糊匹配，因为提取出的水印 ID 可能会有轻微噪点干扰
         cursor.execute('SELECT * FROM distributions WHERE watermark_id LIKE ?', (f"%{watermark_id}%",))
         return cursor.fetchone()
+
+    def find_by_id(self, row_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM distributions WHERE id = ?', (row_id,))
+        return cursor.fetchone()
+
+    def iter_templates(self, after_id=0):
+        """按行号顺序返回 (id, watermark_id, template)，只含文字水印记录，供模板缓存增量同步"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, watermark_id, template FROM distributions '
+                       'WHERE id > ? AND template IS NOT NULL ORDER BY id', (after_id,))
+        return cursor
+
+    def distinct_keys(self):
+        """分发记录中使用过的全部密钥 (按首次使用顺序)，供多密钥搜索使用"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT key_used FROM distributions WHERE key_used IS NOT NULL GROUP BY key_used ORDER BY MIN(id)')
+        return [row[0] for row in cursor.fetchall()]
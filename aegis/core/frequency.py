@@ -1,20 +1,28 @@
-import os
 import cv2
 import hashlib
 import numpy as np
 import uuid
-from PIL import Image, ImageDraw, ImageFont
-import blind_watermark
-from blind_watermark import WaterMark
+from aegis.core.engine import BlockEngine
+from aegis.core.render import render_tiled_wm
+from aegis.core.payload import PAYLOAD_SHAPE, encode_payload, decode_payload
 
-blind_watermark.bw_notes.close()
+# 水印载荷模式：text 为渲染文字位图 (人工辨认)，payload 为纠错编码的分发 ID (机器直接译码)
+PAYLOAD_MODES = ("text", "payload")
 
 class FrequencyWatermarker:
-    def __init__(self, key: str = "1"):
+    def __init__(self, key: str = "1", workers=None, mode="text"):
+        """
+        workers: 单张图片使用的线程数，None 为全部核心 (多进程调用方应按进程数分摊)
+        mode: 'text' 嵌入文字位图；'payload' 把 text 视为分发 ID，嵌入 RS 纠错编码后的比特串
+        """
+        if mode not in PAYLOAD_MODES:
+            raise ValueError(f"Unknown watermark mode: {mode}")
+        self.mode = mode
         hash_digest = hashlib.sha256(str(key).encode()).digest()
         seed = int.from_bytes(hash_digest[:8], 'big') % (2**32)
         self.pwd_wm = seed
         self.pwd_img = seed
+        self.engine = BlockEngine(self.pwd_wm, self.pwd_img, workers=workers)
 
     def get_safe_wm_size(self, img_shape):
         h, w = img_shape[:2]
@@ -24,72 +32,138 @@ class FrequencyWatermarker:
         if side < 16: side = 16
         return (side, side)
 
+    def generate_wm_array(self, text, size):
+        """在内存中生成水印位图 (uint8, 0/255, 只读) - 全图平铺，按 (text, size, font) LRU 缓存"""
+        return render_tiled_wm(text, size)
+
+    def wm_bits(self, text, img_shape):
+        """待嵌入的水印比特 (bool 一维数组)：文字位图或 RS 编码后的载荷"""
+        if self.mode == "payload":
+            return encode_payload(text)
+        return self.generate_wm_array(text, self.get_safe_wm_size(img_shape)).flatten() > 128
+
     def pre_generate_wm(self, text, size):
-        """主进程预生成水印图 - 采用全图平铺模式增加冗余度与清晰度"""
-        img = Image.new('1', size, 0)
-        draw = ImageDraw.Draw(img)
-        
-        # 字体大小适配 - 稍微调小一点以容纳更多平铺
-        font_size = int(size[0] * 0.04) 
-        if font_size < 12: font_size = 12
-        
-        try:
-            font = ImageFont.load_default()
-        except:
-            font = None
-        
-        bbox = draw.textbbox((0, 0), text, font=font)
-        tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        
-        # 紧凑平铺绘制
-        step_x = tw + 25
-        step_y = th + 25
-        for y in range(0, size[1], step_y):
-            for x in range(0, size[0], step_x):
-                # 错位平铺，增加鲁棒性
-                shift = (y // step_y % 2) * (step_x // 2)
-                draw.text(((x + shift) % size[0], y), text, font=font, fill=1)
-        
+        """主进程预生成水印图 (落盘版本，供仍需文件路径的调用方使用)"""
         path = f"temp_master_wm_{uuid.uuid4().hex}.png"
-        img.save(path)
+        cv2.imwrite(path, self.generate_wm_array(text, size))
         return path
 
     def embed(self, input_path, output_path, text, intensity=10):
         """标准嵌入流程 - 使用更稳健的强度平衡点"""
-        img = cv2.imread(input_path)
+        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
         if img is None: return False
         
-        wm_size = self.get_safe_wm_size(img.shape)
-        wm_path = self.pre_generate_wm(text, wm_size)
-        
-        success = self.embed_with_precomputed_wm(input_path, output_path, wm_path, intensity)
-        
-        if os.path.exists(wm_path):
-            os.remove(wm_path)
-            
-        return success
+        embedded = self.embed_array(img, text, intensity)
+        if embedded is None: return False
+        return cv2.imwrite(output_path, embedded)
 
     def embed_with_precomputed_wm(self, input_path, output_path, wm_path, intensity=5):
         """子进程专用的轻量化嵌入函数"""
+        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
+        wm = cv2.imread(wm_path, cv2.IMREAD_GRAYSCALE)
+        if img is None or wm is None: return False
+        
+        embedded = self.embed_array_with_wm(img, wm, intensity)
+        if embedded is None: return False
+        return cv2.imwrite(output_path, embedded)
+
+    def embed_array(self, img, text, intensity=10):
+        """内存版嵌入: 输入 BGR/BGRA ndarray，返回嵌入后的 uint8 ndarray，失败返回 None"""
         try:
-            bwm = WaterMark(password_wm=self.pwd_wm, password_img=self.pwd_img, block_shape=(8, 8))
-            if hasattr(bwm, 'd1'): bwm.d1 = intensity
-            if hasattr(bwm, 'd2'): bwm.d2 = intensity
-            
-            bwm.read_img(input_path)
-            bwm.read_wm(wm_path)
-            bwm.embed(output_path)
-            return True
+            bits = self.wm_bits(text, img.shape)
+        except ValueError as e:
+            print(f"[ERROR] Invalid watermark payload: {e}")
+            return None
+        return self.embed_array_with_wm(img, 255 * bits.astype(np.uint8), intensity)
+
+    def embed_array_with_wm(self, img, wm, intensity=5):
+        """
+        内存版嵌入: wm 为灰度水印位图 (>128 视为 1)，全程不落盘。
+        intensity 仅为兼容旧调用保留：旧版从未将其传入 blind_watermark 核心，
+        量化步长一直是 36/20，改动它会让既有文件无法提取。
+        """
+        try:
+            img = self._normalize_host(img)
+            embedded = self.engine.embed(img, np.asarray(wm).flatten() > 128)
+            return self._to_uint8(embedded)
         except Exception as e:
-            print(f"[ERROR] Exception in embed_with_precomputed_wm: {e}")
-            return False
+            print(f"[ERROR] Exception in embed_array_with_wm: {e}")
+            return None
+
+    def _to_uint8(self, embedded):
+        """
+        与 cv2.imwrite 的浮点转 uint8 行为保持一致 (四舍五入 + 饱和)，原地计算避免额外的浮点副本。
+        带半透明 Alpha 的宿主由引擎合并为 uint8 BGRA 返回，无需再转换。
+        """
+        if not np.issubdtype(embedded.dtype, np.floating):
+            return embedded.astype(np.uint8, copy=False)
+        np.rint(embedded, out=embedded)
+        return np.clip(embedded, 0, 255, out=embedded).astype(np.uint8)
+
+    def analyse_array(self, img):
+        """
+        一次性分析宿主图 (解码后的 ndarray)，供 embed_variant 为多个收件人重复使用。
+        失败返回 None。
+        """
+        try:
+            return self.engine.analyse(self._normalize_host(img))
+        except Exception as e:
+            print(f"[ERROR] Exception in analyse_array: {e}")
+            return None
+
+    def embed_variant(self, analysis, text):
+        """基于 analyse_array 的结果嵌入 text，返回 uint8 ndarray，失败返回 None"""
+        try:
+            embedded = self.engine.embed_variant(analysis, self.wm_bits(text, analysis.size))
+            return self._to_uint8(embedded)
+        except Exception as e:
+            print(f"[ERROR] Exception in embed_variant: {e}")
+            return None
 
     def extract(self, input_path, wm_size, output_wm_path=None):
         """增强版提取，支持传入明确的 wm_size"""
         if output_wm_path is None: output_wm_path = input_path + "_wm.png"
+        img = cv2.imread(input_path, cv2.IMREAD_COLOR)
+        if img is None: return ""
+        
+        wm = self.extract_array(img, wm_size)
+        if wm is None or not cv2.imwrite(output_wm_path, wm): return ""
+        return output_wm_path
+
+    def extract_array(self, img, wm_size):
+        """内存版提取: 返回 uint8 水印图 (0-255)，失败返回 None"""
         try:
-            bwm = WaterMark(password_wm=self.pwd_wm, password_img=self.pwd_img, block_shape=(8, 8))
-            bwm.extract(input_path, wm_shape=wm_size, out_wm_name=output_wm_path, mode='img')
-            return output_wm_path
-        except:
-            return ""
\ No newline at end of file
+            img = self._normalize_host(img)[:, :, :3]
+            wm = self.engine.extract(img, (wm_size[0], wm_size[1]))
+            return np.clip(np.rint(255 * wm), 0, 255).astype(np.uint8)
+        except Exception as e:
+            print(f"[ERROR] Exception in extract_array: {e}")
+            return None
+
+    def extract_payload(self, input_path):
+        """payload 模式的提取：直接译码出 (分发 ID, 置信度)，失败返回 (None, 0.0)"""
+        img = cv2.imread(input_path, cv2.IMREAD_COLOR)
+        if img is None: return None, 0.0
+        return self.extract_payload_array(img)
+
+    def extract_payload_array(self, img):
+        """
+        内存版载荷提取：软判决比特经 RS 纠错译码为 (分发 ID, 置信度 0~1)。
+        引擎已在全部分块与三个通道上对每个比特取平均，这里只做纠错。
+        """
+        try:
+            img = self._normalize_host(img)[:, :, :3]
+            if self.engine.capacity(img.shape) < PAYLOAD_SHAPE[0] * PAYLOAD_SHAPE[1]:
+                return None, 0.0
+            return decode_payload(self.engine.extract(img, PAYLOAD_SHAPE))
+        except Exception as e:
+            print(f"[ERROR] Exception in extract_payload_array: {e}")
+            return None, 0.0
+
+    def _normalize_host(self, img):
+        """统一宿主图为 3/4 通道: 灰度转 BGR，全不透明的 Alpha 通道直接丢弃"""
+        if img.ndim == 2:
+            return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        if img.shape[2] == 4 and img[:, :, 3].min() == 255:
+            return img[:, :, :3]
+        return img
@@ -0,0 +1,61 @@
+import numpy as np
+from aegis.core.search import confidence
+
+# 多页 / 多媒体提取：融合结果 (或单个候选) 相对诱饵基线的 margin 达到此值即停止
+EXTRACT_STOP_MARGIN = 0.15
+# 每个估计的最小权重：与诱饵基线拉不开差距的页面 (未嵌入、被替换或严重损坏) 几乎不参与融合，
+# 但全部页面都如此时仍能给出一个结果
+MIN_WEIGHT = 0.01
+
+
+def best_estimate(engine, decoy, candidates, shape):
+    """
+    在同一图像的若干预处理版本 (原图、中值滤波结果等) 上提取 shape 形状的水印，
+    engine / decoy 为目标密钥与诱饵密钥的 BlockEngine。
+    返回 margin 最大者的 (margin, 软判决, 诱饵软判决)。
+    """
+    best = None
+    for candidate in candidates:
+        soft, base = engine.extract(candidate, shape), decoy.extract(candidate, shape)
+        margin = confidence(soft) - confidence(base)
+        if best is None or margin > best[0]:
+            best = (margin, soft, base)
+    return best
+
+
+class EvidenceFusion:
+    """
+    多页 / 多媒体水印估计的加权平均融合。
+    每个估计同时给出目标密钥与诱饵密钥的软判决，以两者置信度之差 (margin) 为权重：
+    正确密钥下各页的估计一致，平均后噪声下降；诱饵估计各页互不相关，平均后趋于 0.5，
+    因此融合结果的 margin 随参与的页数增长，可据此提前停止。
+    形状不同 (页面比例不同导致水印尺寸不同) 的估计分组融合，取总权重最大的一组。
+    """
+    def __init__(self):
+        # 形状 -> [Σw·(soft-0.5), Σw·(decoy-0.5), Σw, 估计数]
+        self._groups = {}
+
+    def __len__(self):
+        return sum(group[3] for group in self._groups.values())
+
+    def add(self, soft, decoy):
+        """加入一个估计，返回它自身的 margin"""
+        soft = np.asarray(soft, dtype=np.float64)
+        margin = confidence(soft) - confidence(decoy)
+        weight = max(margin, MIN_WEIGHT)
+        group = self._groups.get(soft.shape)
+        if group is None:
+            group = self._groups[soft.shape] = [np.zeros(soft.shape), np.zeros(soft.shape), 0.0, 0]
+        group[0] += weight * (soft - 0.5)
+        group[1] += weight * (np.asarray(decoy, dtype=np.float64) - 0.5)
+        group[2] += weight
+        group[3] += 1
+        return margin
+
+    def best(self):
+        """返回 (融合后的软判决, 融合后的 margin, 参与的估计数)；没有估计时返回 (None, 0.0, 0)"""
+        if not self._groups:
+            return None, 0.0, 0
+        acc, decoy, total, count = max(self._groups.values(), key=lambda group: group[2])
+        soft = 0.5 + acc / total
+        return soft, confidence(soft) - confidence(0.5 + decoy / total), count
@@ -0,0 +1,39 @@
+import hashlib
+import mmap
+import os
+
+
+def file_digest(path, end=None):
+    """
+    文件前 end 字节 (默认全文) 的 SHA-256。整段经 mmap 一次性交给 hashlib，
+    不在 Python 层分块复制，大文件也只顺序读一遍。
+    """
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if end > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view, view[:end] as head:
+                    sha256_hash.update(head)
+    return sha256_hash.digest()
+
+
+class HashingWriter:
+    """
+    边写边计算 SHA-256 的文件包装：输出写完即得到全文摘要，签名时不必重新读取文件。
+    只适用于顺序写出的文件 (写入后不再回头 seek 改写)；其余属性与方法转发给底层文件。
+    """
+    def __init__(self, f):
+        self._f = f
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._f.write(data)
+
+    def digest(self):
+        return self._hash.digest()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
@@ -0,0 +1,88 @@
+import os
+import threading
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.backends import default_backend
+
+
+def key_id(cert):
+    """证书指纹 (DER 编码的 SHA-256，十六进制)，作为签名包中的 key ID"""
+    return cert.fingerprint(hashes.SHA256()).hex()
+
+
+class Keyring:
+    """
+    身份目录的密钥环：私钥与证书只在首次使用时读取、解析一次，之后的签名与验证直接复用。
+    本地证书按 key ID 建立索引，签名包携带 kid 时验证只需一次查表，不必逐个尝试全部证书。
+    身份目录被本进程改动 (新建身份) 后应调用 invalidate。
+    """
+    def __init__(self, keys_dir):
+        self.keys_dir = keys_dir
+        self._lock = threading.Lock()
+        # 身份 ID -> (私钥对象, 证书 PEM, kid)
+        self._signers = {}
+        # kid -> 证书对象，首次查找时扫描目录建立
+        self._index = None
+        # 证书 PEM -> 证书对象 (签名包内嵌的证书)
+        self._parsed = {}
+
+    def paths(self, ident_id=None):
+        """身份对应的 (私钥路径, 证书路径)；None / "default" 为默认身份"""
+        suffix = f"_{ident_id}" if ident_id and ident_id != "default" else ""
+        return (os.path.join(self.keys_dir, f"private{suffix}.key"),
+                os.path.join(self.keys_dir, f"identity{suffix}.crt"))
+
+    def signer(self, ident_id=None):
+        """返回 (私钥对象, 证书 PEM, kid)。指定的身份不存在时退回默认身份"""
+        ident_id = ident_id or "default"
+        signer = self._signers.get(ident_id)
+        if signer is not None:
+            return signer
+        priv_path, cert_path = self.paths(ident_id)
+        if not os.path.exists(priv_path):
+            priv_path, cert_path = self.paths()
+        with open(priv_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
+        with open(cert_path, "rb") as f:
+            cert_pem = f.read().decode('utf-8')
+        signer = (private_key, cert_pem, key_id(self.load_cert(cert_pem)))
+        with self._lock:
+            return self._signers.setdefault(ident_id, signer)
+
+    def load_cert(self, cert_pem):
+        """解析 PEM 证书 (按内容缓存)"""
+        cert = self._parsed.get(cert_pem)
+        if cert is None:
+            cert = x509.load_pem_x509_certificate(cert_pem.encode(), default_backend())
+            with self._lock:
+                cert = self._parsed.setdefault(cert_pem, cert)
+        return cert
+
+    def certificates(self):
+        """本地全部证书 {kid: 证书对象}；无法解析的证书文件跳过"""
+        index = self._index
+        if index is not None:
+            return index
+        index = {}
+        names = sorted(os.listdir(self.keys_dir)) if os.path.isdir(self.keys_dir) else []
+        for name in names:
+            if not name.endswith(".crt"):
+                continue
+            try:
+                with open(os.path.join(self.keys_dir, name), "rb") as f:
+                    cert = self.load_cert(f.read().decode('utf-8'))
+            except Exception:
+                continue
+            index.setdefault(key_id(cert), cert)
+        self._index = index
+        return index
+
+    def find(self, kid):
+        """按 key ID 查找本地证书，没有时返回 None"""
+        return self.certificates().get(kid)
+
+    def invalidate(self):
+        """丢弃缓存的身份与证书索引 (下次使用时重新读取)"""
+        with self._lock:
+            self._signers.clear()
+            self._index = None
@@ -0,0 +1,197 @@
+import json
+import os
+import numpy as np
+from aegis.core.render import render_wm_line, TILE_GAP
+
+DEFAULT_TEMPLATE_DIR = os.path.join(os.path.expanduser("~"), ".aegis_identity", "templates")
+# 每次解包、参与矩阵乘法的模板行数 (控制峰值内存)
+CHUNK_ROWS = 8192
+# 同步时每批渲染并追加的记录数
+SYNC_BATCH = 4096
+TOP_K = 5
+# 自动判定所需的最低相关系数，以及与第二名的最小差距
+MIN_SCORE = 0.1
+MIN_GAP = 0.02
+
+
+def _round_up(n, m):
+    return max(m, -(-n // m) * m)
+
+
+def fold_index(shape, bbox, line_shape, cap_w):
+    """
+    平铺水印是单行文字的周期重复 (见 render_tiled_wm)。返回 (valid, lin)：
+    valid 标记平铺严格周期的像素 (排除行尾回绕叠画的区域与未绘制的行)，
+    lin 为这些像素在行位图 (按 cap_w 展开) 中的下标，落在行位图之外 (留白) 的为 -1。
+    """
+    H, W = shape
+    lh, lw = line_shape
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    ox, oy = max(0, -bbox[0]), max(0, -bbox[1])
+    step_x, step_y = tw + TILE_GAP, th + TILE_GAP
+
+    r = np.arange(H) + oy
+    k = r // step_y
+    ly = r - k * step_y
+    row_valid = k * step_y < H
+
+    c = np.arange(W)
+    col_valid, col_lx = [], []
+    for parity in (0, 1):
+        shift = parity * (step_x // 2)
+        u = c + ox - shift
+        j = u // step_x
+        valid = (u >= 0) & (j * step_x < W) & (j * step_x + shift < W)
+        # 错位行末尾回绕到左侧的那一段文字不在周期位置上
+        for x in range(0, W, step_x):
+            if x + shift >= W:
+                x0 = x + shift - W - ox
+                valid[max(0, x0):max(0, x0 + lw)] = False
+        col_valid.append(valid)
+        col_lx.append(u - j * step_x)
+
+    parity = (k % 2).astype(bool)[:, None]
+    valid = row_valid[:, None] & np.where(parity, col_valid[1], col_valid[0])
+    lx = np.where(parity, col_lx[1], col_lx[0])
+    ly = np.broadcast_to(ly[:, None], (H, W))
+    inside = valid & (ly < lh) & (lx < lw)
+    lin = np.where(inside, ly * cap_w + lx, -1)
+    return valid, lin
+
+
+class TemplateStack:
+    """
+    已分发文字水印的模板缓存，按数据库行号增量同步，落盘在 ~/.aegis_identity/templates。
+    每条记录只存一份位打包的行位图 ("ID: {}" 模板约 200 字节)，十万条记录约 20 MB。
+    匹配时把提取出的水印按各模板的平铺几何折叠到行坐标，对整块模板矩阵做矩阵乘法，
+    一次得到与全部模板的归一化相关系数。
+    """
+    def __init__(self, root=None):
+        self.root = root or DEFAULT_TEMPLATE_DIR
+        self._bits_path = os.path.join(self.root, "lines.bin")
+        self._index_path = os.path.join(self.root, "index.npy")
+        self._meta_path = os.path.join(self.root, "meta.json")
+        self._load()
+
+    def _load(self):
+        # index 每行: [数据库行号, bbox x0, y0, x1, y1, 行位图高, 行位图宽]；cap 为行位图的统一容量
+        self.index = np.zeros((0, 7), dtype=np.int32)
+        self.cap = (0, 0)
+        try:
+            with open(self._meta_path) as f:
+                self.cap = tuple(json.load(f)["cap"])
+            self.index = np.load(self._index_path)
+            # 上次同步中断时 lines.bin 可能多出未登记的行，以 index 为准截断
+            if os.path.getsize(self._bits_path) != len(self.index) * self.row_bytes:
+                with open(self._bits_path, "r+b") as f:
+                    f.truncate(len(self.index) * self.row_bytes)
+        except (OSError, ValueError, KeyError):
+            # 缓存缺失或损坏：下次 sync 时从头重建
+            self.index = np.zeros((0, 7), dtype=np.int32)
+            self.cap = (0, 0)
+
+    @property
+    def row_bytes(self):
+        return self.cap[0] * self.cap[1] // 8
+
+    def __len__(self):
+        return len(self.index)
+
+    def _reset(self, cap):
+        os.makedirs(self.root, exist_ok=True)
+        self.cap = cap
+        self.index = np.zeros((0, 7), dtype=np.int32)
+        open(self._bits_path, "wb").close()
+        np.save(self._index_path, self.index)
+        with open(self._meta_path, "w") as f:
+            json.dump({"cap": list(cap)}, f)
+
+    def sync(self, db):
+        """追加数据库中尚未缓存的文字水印记录；行位图超出当前容量时按新容量整体重建"""
+        while True:
+            last = int(self.index[-1, 0]) if len(self.index) else 0
+            if not self.cap[0]:
+                self._reset((8, 32))
+            rows = db.iter_templates(after_id=last)
+            grown = None
+            while grown is None:
+                batch = rows.fetchmany(SYNC_BATCH)
+                if not batch: break
+                grown = self._append(batch)
+            if grown is None:
+                return len(self.index)
+            print(f"[*] Template cache grows to {grown[0]}x{grown[1]}, rebuilding...")
+            self._reset(grown)
+
+    def _append(self, batch):
+        cap_h, cap_w = self.cap
+        packed, entries = [], []
+        for row_id, watermark_id, template in batch:
+            line, bbox = render_wm_line(template.replace("{}", watermark_id))
+            lh, lw = line.shape
+            if lh > cap_h or lw > cap_w:
+                return (max(cap_h, _round_up(lh, 8)), max(cap_w, _round_up(lw, 32)))
+            canvas = np.zeros((cap_h, cap_w), dtype=bool)
+            canvas[:lh, :lw] = line
+            packed.append(np.packbits(canvas))
+            entries.append((row_id,) + tuple(bbox) + (lh, lw))
+        # 先写模板再登记 index，中断时多出的行会在下次加载时截掉
+        with open(self._bits_path, "ab") as f:
+            f.write(np.stack(packed).tobytes())
+        self.index = np.concatenate([self.index, np.asarray(entries, dtype=np.int32)])
+        np.save(self._index_path, self.index)
+        return None
+
+    def match(self, wm, top_k=TOP_K):
+        """
+        wm: 提取出的水印图 (二维，任意数值尺度)。
+        返回按相关系数降序的 [(数据库行号, 相关系数), ...]，至多 top_k 条。
+        """
+        n = len(self.index)
+        if n == 0: return []
+        x = np.asarray(wm, dtype=np.float32)
+        cap_h, cap_w = self.cap
+        cells = cap_h * cap_w
+
+        # 每种平铺几何 (由 bbox 与行位图尺寸决定) 折叠一次：
+        # M 的两列分别为落在行位图各位置的像素和与像素数，stats 为有效像素的数量、和与平方和
+        geoms, group = np.unique(self.index[:, 1:], axis=0, return_inverse=True)
+        group = group.ravel()
+        M = np.zeros((cells, 2 * len(geoms)), dtype=np.float32)
+        stats = np.zeros((len(geoms), 3), dtype=np.float64)
+        for g, geom in enumerate(geoms):
+            valid, lin = fold_index(x.shape, geom[:4], geom[4:], cap_w)
+            xs = x[valid].astype(np.float64)
+            stats[g] = xs.size, xs.sum(), np.square(xs).sum()
+            inside = lin >= 0
+            M[:, 2 * g] = np.bincount(lin[inside], weights=x[inside], minlength=cells)
+            M[:, 2 * g + 1] = np.bincount(lin[inside], minlength=cells)
+
+        bits = np.memmap(self._bits_path, dtype=np.uint8, mode="r", shape=(n, self.row_bytes))
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n)
+            T = np.unpackbits(bits[start:stop], axis=1).astype(np.float32)
+            R = T @ M
+            g = group[start:stop]
+            rows = np.arange(stop - start)
+            dot, tsum = R[rows, 2 * g], R[rows, 2 * g + 1]
+            cnt, sx, sxx = stats[g].T
+            # 模板为 0/1：Σt² = Σt，归一化相关 = 协方差 / (σ_t · σ_x)
+            cov = dot - tsum * sx / cnt
+            var = (tsum - tsum * tsum / cnt) * (sxx - sx * sx / cnt)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores[start:stop] = np.where(var > 0, cov / np.sqrt(var), 0)
+        del bits
+
+        k = min(top_k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.index[i, 0]), float(scores[i])) for i in top]
+
+
+def is_confident(matches):
+    """最佳候选足够强且明显领先第二名时，可不经人工确认直接采用"""
+    if not matches or matches[0][1] < MIN_SCORE:
+        return False
+    return len(matches) == 1 or matches[0][1] - matches[1][1] >= MIN_GAP
@@ -0,0 +1,42 @@
+import hashlib
+import os
+import uuid
+from aegis.core.scramble import CACHE_DIR_ENV
+
+
+def default_media_cache_dir():
+    base = os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".aegis_identity", "cache")
+    return os.path.join(base, "media")
+
+
+class MediaCache:
+    """
+    已加水印媒体图的持久缓存，键为 (原图内容 SHA-256, 水印文本, 密钥, 模式)，值为编码后的 PNG 字节。
+    反复分发内容相近的文档 (同一模板、同一批 Logo / 背景图) 时，命中的图像不再重新嵌入。
+    文件名为键的哈希，不含密钥与水印文本明文；不做自动淘汰，可随时整体删除目录。
+    """
+    def __init__(self, root=None):
+        self.root = root or default_media_cache_dir()
+
+    def _path_for(self, digest, text, key, mode):
+        name = hashlib.sha256(repr((digest, text, str(key), mode)).encode()).hexdigest()
+        return os.path.join(self.root, name[:2], f"{name}.png")
+
+    def get(self, digest, text, key, mode):
+        try:
+            with open(self._path_for(digest, text, key, mode), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, digest, text, key, mode, data):
+        """先写临时文件再原子替换，避免并发进程读到半截文件"""
+        path = self._path_for(digest, text, key, mode)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[Debug] Failed to persist media cache: {e}")
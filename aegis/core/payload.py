@@ -0,0 +1,222 @@
+import numpy as np
+
+# 机读载荷：分发 ID (ASCII，右侧补 \0) + Reed-Solomon 校验字节。
+# 引擎会把 128 比特循环重复到全部分块并在三个通道间平均，相当于 RS 外层 + 重复码内层。
+PAYLOAD_ID_BYTES = 8
+PAYLOAD_PARITY_BYTES = 8
+PAYLOAD_BITS = 8 * (PAYLOAD_ID_BYTES + PAYLOAD_PARITY_BYTES)
+PAYLOAD_SHAPE = (1, PAYLOAD_BITS)
+# 按软判决把最不可靠的字节标为擦除后重试，擦除数上限 (越大越容易把噪声误译成合法 ID)
+MAX_ERASURES = PAYLOAD_PARITY_BYTES // 2
+
+_PRIMITIVE = 0x11d
+
+
+def _build_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= _PRIMITIVE
+    exp[255:510] = exp[:255]
+    return exp.tolist(), log.tolist()
+
+
+_EXP, _LOG = _build_tables()
+
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _div(a, b):
+    if b == 0:
+        raise ZeroDivisionError()
+    if a == 0:
+        return 0
+    return _EXP[(_LOG[a] - _LOG[b]) % 255]
+
+
+def _pow(a, n):
+    return _EXP[(_LOG[a] * n) % 255]
+
+
+def _inverse(a):
+    return _EXP[255 - _LOG[a]]
+
+
+def _poly_scale(p, x):
+    return [_mul(c, x) for c in p]
+
+
+def _poly_add(p, q):
+    out = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        out[i + len(out) - len(p)] = c
+    for i, c in enumerate(q):
+        out[i + len(out) - len(q)] ^= c
+    return out
+
+
+def _poly_mul(p, q):
+    out = [0] * (len(p) + len(q) - 1)
+    for j, b in enumerate(q):
+        for i, a in enumerate(p):
+            out[i + j] ^= _mul(a, b)
+    return out
+
+
+def _poly_eval(p, x):
+    y = p[0]
+    for c in p[1:]:
+        y = _mul(y, x) ^ c
+    return y
+
+
+def _generator(nsym):
+    g = [1]
+    for i in range(nsym):
+        g = _poly_mul(g, [1, _pow(2, i)])
+    return g
+
+
+class ReedSolomon:
+    """
+    GF(2^8) 上的系统 Reed-Solomon 编解码 (多项式系数按高次在前)。
+    decode 支持错误与擦除联合纠正：2·错误数 + 擦除数 <= nsym。
+    """
+    def __init__(self, nsym):
+        self.nsym = nsym
+        self._gen = _generator(nsym)
+
+    def encode(self, msg):
+        msg = list(msg)
+        out = msg + [0] * self.nsym
+        for i in range(len(msg)):
+            coef = out[i]
+            if coef:
+                for j in range(1, len(self._gen)):
+                    out[i + j] ^= _mul(self._gen[j], coef)
+        return bytes(msg + out[len(msg):])
+
+    def _syndromes(self, codeword):
+        return [_poly_eval(codeword, _pow(2, i)) for i in range(self.nsym)]
+
+    def decode(self, codeword, erase_pos=()):
+        """返回 (纠正后的消息, 纠正的符号数)；无法纠正时抛出 ValueError"""
+        codeword = list(codeword)
+        n = len(codeword)
+        erase_pos = list(erase_pos)
+        if len(erase_pos) > self.nsym:
+            raise ValueError("Too many erasures")
+        for pos in erase_pos:
+            codeword[pos] = 0
+
+        synd = self._syndromes(codeword)
+        if max(synd) == 0:
+            return bytes(codeword[:n - self.nsym]), len(erase_pos)
+
+        # 用擦除位置修正伴随式 (Forney syndromes)，使 BM 只需求解未知错误
+        fsynd = list(synd)
+        for pos in erase_pos:
+            x = _pow(2, n - 1 - pos)
+            for j in range(len(fsynd) - 1):
+                fsynd[j] = _mul(fsynd[j], x) ^ fsynd[j + 1]
+        fsynd = fsynd[:len(fsynd) - len(erase_pos)]
+
+        # Berlekamp-Massey 求错误位置多项式
+        err_loc, old_loc = [1], [1]
+        for i in range(len(fsynd)):
+            delta = fsynd[i]
+            for j in range(1, len(err_loc)):
+                delta ^= _mul(err_loc[-(j + 1)], fsynd[i - j])
+            old_loc = old_loc + [0]
+            if delta:
+                if len(old_loc) > len(err_loc):
+                    new_loc = _poly_scale(old_loc, delta)
+                    old_loc = _poly_scale(err_loc, _inverse(delta))
+                    err_loc = new_loc
+                err_loc = _poly_add(err_loc, _poly_scale(old_loc, delta))
+        while len(err_loc) > 1 and err_loc[0] == 0:
+            err_loc = err_loc[1:]
+        errs = len(err_loc) - 1
+        if 2 * errs + len(erase_pos) > self.nsym:
+            raise ValueError("Too many errors")
+
+        # Chien 搜索
+        err_pos = [n - 1 - i for i in range(n) if _poly_eval(err_loc[::-1], _pow(2, i)) == 0]
+        if len(err_pos) != errs:
+            raise ValueError("Could not locate errors")
+
+        # Forney 算法求错误值
+        positions = sorted(set(err_pos) | set(erase_pos))
+        coef_pos = [n - 1 - p for p in positions]
+        loc = [1]
+        for i in coef_pos:
+            loc = _poly_mul(loc, _poly_add([1], [_pow(2, i), 0]))
+        # 伴随式前补 0 对应首个根为 2^0 (fcr=0) 的生成多项式
+        omega = _poly_mul(([0] + synd)[::-1], loc)
+        omega = omega[len(omega) - len(loc):]
+        x_values = [_pow(2, i) for i in coef_pos]
+        for i, xi in enumerate(x_values):
+            xi_inv = _inverse(xi)
+            denom = 1
+            for j, xj in enumerate(x_values):
+                if j != i:
+                    denom = _mul(denom, 1 ^ _mul(xi_inv, xj))
+            y = _mul(_poly_eval(omega, xi_inv), xi)
+            codeword[positions[i]] ^= _div(y, denom)
+
+        if max(self._syndromes(codeword)) != 0:
+            raise ValueError("Could not correct message")
+        return bytes(codeword[:n - self.nsym]), len(positions)
+
+
+_codec = ReedSolomon(PAYLOAD_PARITY_BYTES)
+
+
+def encode_payload(payload_id):
+    """分发 ID -> 128 个水印比特 (bool)；ID 须为不超过 8 字节的可打印 ASCII"""
+    raw = str(payload_id).encode('ascii')
+    if len(raw) > PAYLOAD_ID_BYTES or not all(0x20 <= b < 0x7f for b in raw):
+        raise ValueError(f"Payload ID must be at most {PAYLOAD_ID_BYTES} printable ASCII characters")
+    codeword = _codec.encode(raw.ljust(PAYLOAD_ID_BYTES, b'\0'))
+    return np.unpackbits(np.frombuffer(codeword, dtype=np.uint8)).astype(bool)
+
+
+def _valid_id(msg):
+    body = msg.rstrip(b'\0')
+    return len(body) > 0 and b'\0' not in body and all(0x20 <= b < 0x7f for b in body)
+
+
+def decode_payload(soft):
+    """
+    软判决比特 (0~1，长度 PAYLOAD_BITS) -> (ID, 置信度)。无法译码时返回 (None, 0.0)。
+    先按硬判决纠错；失败后把最不可靠的字节逐步标为擦除重试。
+    置信度为软判决与纠正后码字的一致程度 (0~1)。
+    """
+    soft = np.nan_to_num(np.asarray(soft, dtype=np.float64).ravel(), nan=0.5)
+    if soft.size != PAYLOAD_BITS:
+        return None, 0.0
+    hard = np.packbits(soft > 0.5).tolist()
+    # 每字节的可靠度取其中最不确定的比特
+    reliability = np.abs(2 * soft - 1).reshape(-1, 8).min(axis=1)
+    order = np.argsort(reliability, kind='stable')
+
+    for erasures in range(0, MAX_ERASURES + 1, 2):
+        try:
+            msg, _ = _codec.decode(hard, erase_pos=sorted(order[:erasures].tolist()))
+        except (ValueError, ZeroDivisionError):
+            continue
+        if not _valid_id(msg):
+            continue
+        codeword = np.unpackbits(np.frombuffer(_codec.encode(msg), dtype=np.uint8))
+        agreement = float(np.mean((2 * soft - 1) * (2.0 * codeword - 1)))
+        return msg.rstrip(b'\0').decode('ascii'), max(0.0, agreement)
+    return None, 0.0
@@ -0,0 +1,80 @@
+import os
+from aegis.core.hashing import HashingWriter
+
+PDF_HEADER = b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n'
+
+
+class PDFStreamWriter:
+    """
+    PDF 流式写入器：每页一幅铺满页面的图像，页面对象写出后即落盘，内存不随页数增长。
+    图像流按调用方给出的过滤器原样写入 (FlateDecode + Predictor 15 的 PNG IDAT、
+    DCTDecode 的 JPEG、JPXDecode 的 JPEG 2000)，不做任何解码或重新压缩。
+    对象 1、2 预留给目录与页树，在 close 时最后写出，之后是交叉引用表。
+    """
+    def __init__(self, path):
+        self._f = HashingWriter(open(path, 'wb'))
+        self._offsets = {}
+        self._next = 3
+        self._pages = []
+        self._f.write(PDF_HEADER)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _begin(self, num=None):
+        if num is None:
+            num, self._next = self._next, self._next + 1
+        self._offsets[num] = self._f.tell()
+        self._f.write(f"{num} 0 obj\n".encode())
+        return num
+
+    def _object(self, body, num=None):
+        num = self._begin(num)
+        self._f.write(body.encode() + b'\nendobj\n')
+        return num
+
+    def _stream(self, entries, data):
+        num = self._begin()
+        self._f.write(f"<< {entries} /Length {len(data)} >>\nstream\n".encode())
+        self._f.write(data)
+        self._f.write(b'\nendstream\nendobj\n')
+        return num
+
+    def add_image_page(self, width, height, stream, keys, page_size):
+        """
+        追加一页。width/height 为图像像素尺寸，stream 为已压缩的图像数据，
+        keys 为图像字典的其余键 (如 {"Filter": "/DCTDecode", ...})，page_size 为页面尺寸 (pt)。
+        """
+        pw, ph = page_size
+        extra = " ".join(f"/{name} {value}" for name, value in keys.items())
+        image = self._stream(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} {extra}", stream)
+        content = self._stream("", f"q {pw:g} 0 0 {ph:g} 0 0 cm /Im0 Do Q".encode())
+        self._pages.append(self._object(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {pw:g} {ph:g}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {content} 0 R >>"))
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            kids = " ".join(f"{num} 0 R" for num in self._pages)
+            self._object(f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>", num=2)
+            self._object("<< /Type /Catalog /Pages 2 0 R >>", num=1)
+            xref = self._f.tell()
+            size = self._next
+            lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+            lines += [f"{self._offsets[num]:010d} 00000 n \n" for num in range(1, size)]
+            lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+            self._f.write("".join(lines).encode())
+        finally:
+            self._f.close()
+
+    def digest(self):
+        """输出全文的 SHA-256 (close 之后调用)"""
+        return self._f.digest()
+
+    def abort(self):
+        """放弃写入并删除不完整的输出文件"""
+        self._f.close()
+        if os.path.exists(self._f.name):
+            os.remove(self._f.name)
@@ -0,0 +1,128 @@
+import threading
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from aegis.core.cache import LRUCache
+
+# 当前仅使用 PIL 内置字体，缓存键中以此标识字体
+DEFAULT_FONT_ID = "default"
+
+
+class GlyphAtlas:
+    """
+    字形图集：每个字符只光栅化一次，行位图由缓存的字形按步进拼接而成。
+    适用于 "ID: {}" 这类模板 —— 收件人之间只有 ID 字形不同，无需再调用 PIL 排版整行。
+    """
+    PAD = 4
+
+    def __init__(self, font):
+        self.font = font
+        self._glyphs = {}
+        self._lock = threading.Lock()
+
+    def _glyph(self, ch):
+        glyph = self._glyphs.get(ch)
+        if glyph is None:
+            advance = int(self.font.getlength(ch, mode='1'))
+            x0, y0, x1, y1 = self.font.getbbox(ch, mode='1')
+            w = max(x1, advance) + 2 * self.PAD
+            h = max(y1, 0) + 2 * self.PAD
+            img = Image.new('1', (w, h), 0)
+            ImageDraw.Draw(img).text((self.PAD, self.PAD), ch, font=self.font, fill=1)
+            glyph = (np.array(img, dtype=bool), advance, x0 >= 0)
+            with self._lock:
+                self._glyphs[ch] = glyph
+        return glyph
+
+    def compose(self, text, bbox):
+        """
+        按 bbox 拼接整行位图。存在字距调整 (kerning) 或负左侧支承的字形 (如 'x') 时，
+        PIL 的整行排版与逐字拼接不一致，此时返回 None 交由 PIL 渲染。
+        """
+        glyphs = [self._glyph(ch) for ch in text]
+        if not all(composable for _, _, composable in glyphs):
+            return None
+        if sum(adv for _, adv, _ in glyphs) != int(self.font.getlength(text, mode='1')):
+            return None
+
+        ox, oy = max(0, -bbox[0]), max(0, -bbox[1])
+        line = np.zeros((bbox[3] + oy, bbox[2] + ox), dtype=bool)
+        pen = 0
+        for bitmap, advance, _ in glyphs:
+            _or_clipped(line, bitmap, oy - self.PAD, pen + ox - self.PAD)
+            pen += advance
+        return line
+
+
+def _or_clipped(canvas, patch, top, left):
+    """将 patch 以 (top, left) 为左上角按位或进 canvas，超出边界的部分裁掉"""
+    H, W = canvas.shape
+    h, w = patch.shape
+    y0, x0 = max(top, 0), max(left, 0)
+    y1, x1 = min(top + h, H), min(left + w, W)
+    if y0 >= y1 or x0 >= x1:
+        return
+    canvas[y0:y1, x0:x1] |= patch[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
+def _load_font():
+    try:
+        return ImageFont.load_default()
+    except:
+        return None
+
+
+_font = _load_font()
+_atlas = GlyphAtlas(_font) if isinstance(_font, ImageFont.FreeTypeFont) else None
+# 按 (text, size, font) 缓存的只读水印位图；同一进程内的 PDF 页面、PPTX 媒体与分发任务共享
+wm_cache = LRUCache()
+
+
+def _render_line(text, bbox):
+    """PIL 回退路径：整行渲染一次"""
+    ox, oy = max(0, -bbox[0]), max(0, -bbox[1])
+    img = Image.new('1', (max(bbox[2] + ox, 1), max(bbox[3] + oy, 1)), 0)
+    ImageDraw.Draw(img).text((ox, oy), text, font=_font, fill=1)
+    return np.array(img, dtype=bool)
+
+
+# 平铺间距：相邻两行文字 (及同一行相邻两段文字) 之间的留白
+TILE_GAP = 25
+
+
+def render_wm_line(text):
+    """渲染单行水印文字，返回 (行位图 bool, bbox)；平铺与模板匹配共用"""
+    if _font is not None:
+        bbox = _font.getbbox(text, mode='1')
+    else:
+        bbox = ImageDraw.Draw(Image.new('1', (1, 1))).textbbox((0, 0), text)
+    line = _atlas.compose(text, bbox) if _atlas is not None and text else None
+    if line is None:
+        line = _render_line(text, bbox)
+    return line, bbox
+
+
+def render_tiled_wm(text, size):
+    """
+    渲染全图平铺的水印位图 (uint8, 0/255)，结果按 (text, size, font) 缓存。
+    行位图只生成一次，平铺由 NumPy 切片完成，输出与逐格调用 draw.text 完全一致。
+    """
+    size = (int(size[0]), int(size[1]))
+    key = (text, size, DEFAULT_FONT_ID)
+    cached = wm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    line, bbox = render_wm_line(text)
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    ox, oy = max(0, -bbox[0]), max(0, -bbox[1])
+
+    # 紧凑错位平铺，与原先的逐格绘制保持相同的坐标序列
+    canvas = np.zeros((size[1], size[0]), dtype=bool)
+    step_x = tw + TILE_GAP
+    step_y = th + TILE_GAP
+    for y in range(0, size[1], step_y):
+        shift = (y // step_y % 2) * (step_x // 2)
+        for x in range(0, size[0], step_x):
+            _or_clipped(canvas, line, y - oy, (x + shift) % size[0] - ox)
+
+    return wm_cache.put(key, canvas.astype(np.uint8) * 255)
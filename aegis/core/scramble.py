@@ -0,0 +1,85 @@
+import hashlib
+import os
+import uuid
+import numpy as np
+from aegis.core.cache import LRUCache
+
+# 设置该环境变量后，置乱材料会持久化到此目录，跨进程 / 跨任务复用 (子进程同样继承)
+CACHE_DIR_ENV = "AEGIS_CACHE_DIR"
+
+
+class ScrambleCache:
+    """
+    密钥派生的置乱材料缓存。
+    - 分块系数置乱表：由 (pwd_img, 分块数) 决定；
+    - 水印比特索引表：由 (pwd_wm, 分块数, 水印长度) 决定。
+    生产环境中少量密钥 × 少量页面尺寸反复出现，生成一次后在进程内复用，
+    并可选落盘 (文件名为键的哈希，不含密钥明文)。
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, persist_dir=None):
+        self._memory = LRUCache(max_bytes=max_bytes)
+        self._persist_dir = persist_dir
+
+    @property
+    def persist_dir(self):
+        return self._persist_dir or os.environ.get(CACHE_DIR_ENV) or None
+
+    def block_shuffle(self, pwd_img, block_num, cells):
+        """每个分块内 DCT 系数的置乱顺序 (与 blind_watermark.random_strategy1 相同)，uint8 存储"""
+        def build():
+            order = np.random.RandomState(pwd_img).random(size=(block_num, cells)).argsort(axis=1)
+            return order.astype(np.uint8)
+        return self._get_or_build(("shuffle", pwd_img, block_num, cells), build)
+
+    def bit_index(self, pwd_wm, block_num, wm_size):
+        """
+        第 i 个分块承载的原始水印比特下标。
+        嵌入时 wm_bits[index]；提取时按 index 对分块结果求平均即完成解置乱。
+        """
+        def build():
+            perm = np.arange(wm_size)
+            np.random.RandomState(pwd_wm).shuffle(perm)
+            return perm[np.arange(block_num) % wm_size].astype(np.int32)
+        return self._get_or_build(("index", pwd_wm, block_num, wm_size), build)
+
+    def clear(self):
+        self._memory.clear()
+
+    def _get_or_build(self, key, build):
+        arr = self._memory.get(key)
+        if arr is not None:
+            return arr
+
+        path = self._path_for(key)
+        if path and os.path.exists(path):
+            try:
+                arr = np.load(path, mmap_mode='r')
+            except Exception:
+                arr = None
+
+        if arr is None:
+            arr = build()
+            if path:
+                self._save(path, arr)
+        return self._memory.put(key, arr)
+
+    def _path_for(self, key):
+        base = self.persist_dir
+        if not base:
+            return None
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(base, "scramble", f"{digest}.npy")
+
+    def _save(self, path, arr):
+        """先写临时文件再原子替换，避免并发进程读到半截文件"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[Debug] Failed to persist scramble cache: {e}")
+
+
+scramble_cache = ScrambleCache()
@@ -0,0 +1,167 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import cv2
+import numpy as np
+from aegis.core.engine import default_workers
+from aegis.core.frequency import FrequencyWatermarker
+
+# 图片 / PDF 嵌入时统一使用的画布宽度
+BASE_WIDTH = 2000
+# 原分辨率嵌入 (PPTX 媒体、分块模式) 的常见图片宽度。分块网格要求宽度几乎精确还原
+# (偏差 2px 即失效)，因此按常见宽度枚举，而不是按等比阶梯逼近
+COMMON_WIDTHS = (640, 800, 1024, 1080, 1200, 1280, 1366, 1440, 1600, 1920, 2048, 2400, 2560, 3000, 3840, 4096)
+# 只尝试泄露图宽度 0.5~2 倍范围内的尺度，过度缩放后信号已不可恢复
+SCALE_RANGE = (0.5, 2.0)
+# 预筛时读取的分块行数，按覆盖水印比特的次数计
+PROBE_REPEATS = 2
+# 预筛置信度至少比诱饵密钥高出此值才进入完整提取
+MIN_MARGIN = 0.02
+# 预筛分数超过此值即视为命中，尚未开始的预筛直接取消
+STRONG_MARGIN = 0.1
+# 没有候选达到阈值时，仍保留预筛分数最高的若干个做完整提取
+KEEP_AT_LEAST = 3
+# 诱饵密钥：与任何真实密钥都不相关，作为同一金字塔层上的噪声基线
+DECOY_KEY = "\x00aegis-decoy"
+
+Match = namedtuple("Match", ["key", "width", "filtered", "score", "wm"])
+
+
+def confidence(soft):
+    """软判决偏离 0.5 的平均程度 (0~1)，密钥与尺度都正确时接近 1"""
+    return float(np.abs(2.0 * np.asarray(soft) - 1.0).mean())
+
+
+class Pyramid:
+    """
+    一次解码、按需缩放的图像金字塔，所有密钥共享。
+    每个尺度同时保留原图与中值滤波结果：滤波能压制压缩噪声，
+    但对未经压缩的泄露图会削弱嵌入信号，两者都作为候选。
+    """
+    def __init__(self, img):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        self.img = np.ascontiguousarray(img[:, :, :3])
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, width, filtered):
+        key = (width, filtered)
+        with self._lock:
+            cached = self._levels.get(key)
+        if cached is not None:
+            return cached
+
+        h, w = self.img.shape[:2]
+        if width == w:
+            lvl = self.img
+        else:
+            interp = cv2.INTER_AREA if width < w else cv2.INTER_CUBIC
+            lvl = cv2.resize(self.img, (width, max(1, int(h * width / w))), interpolation=interp)
+        if filtered:
+            lvl = cv2.medianBlur(lvl, 3)
+        with self._lock:
+            return self._levels.setdefault(key, lvl)
+
+
+def candidate_widths(img_width, extra_widths=()):
+    """
+    候选宽度：画布宽度 (缩放过的泄露图还原到 2000px 即可对齐)、泄露图自身宽度、
+    调用方指定的宽度，以及范围内的常见宽度。去重保序，越靠前越可能命中。
+    """
+    lo, hi = SCALE_RANGE[0] * img_width, SCALE_RANGE[1] * img_width
+    widths = [BASE_WIDTH, img_width] + [int(w) for w in extra_widths]
+    widths += [w for w in COMMON_WIDTHS if lo <= w <= hi]
+    return list(dict.fromkeys(w for w in widths if w >= 64))
+
+
+class _Evaluator:
+    """带密钥引擎与诱饵基线缓存的候选评估器 (线程安全)"""
+    def __init__(self, pyramid, keys):
+        self.pyramid = pyramid
+        # 候选之间已经并行，单个引擎串行执行避免线程过度订阅
+        self.engines = {key: FrequencyWatermarker(key=key, workers=1) for key in keys}
+        self.decoy = FrequencyWatermarker(key=DECOY_KEY, workers=1)
+        self._baselines = {}
+        self._lock = threading.Lock()
+
+    def _region(self, engine, width, filtered, probe):
+        lvl = self.pyramid.level(width, filtered)
+        wm_size = engine.get_safe_wm_size(lvl.shape)
+        if probe:
+            # 分块按行优先编号，比特下标与整图一致，截取顶部若干行即可完成预筛
+            bh, bw = engine.engine.block_shape
+            gw = max(1, (lvl.shape[1] + 1) // 2 // bw)
+            rows = -(-PROBE_REPEATS * wm_size[0] * wm_size[1] // gw) * bh * 2
+            lvl = lvl[:rows]
+        return lvl, wm_size
+
+    def _confidence(self, engine, width, filtered, probe):
+        lvl, wm_size = self._region(engine, width, filtered, probe)
+        if engine.engine.capacity(lvl.shape) <= wm_size[0] * wm_size[1]:
+            return None, None
+        soft = engine.engine.extract(lvl, wm_size)
+        return confidence(soft), soft
+
+    def _baseline(self, width, filtered, probe):
+        key = (width, filtered, probe)
+        with self._lock:
+            if key in self._baselines:
+                return self._baselines[key]
+        value, _ = self._confidence(self.decoy, width, filtered, probe)
+        with self._lock:
+            return self._baselines.setdefault(key, value)
+
+    def evaluate(self, key, width, filtered, probe):
+        """返回 (相对诱饵基线的置信度差, 软判决水印)；尺寸过小时返回 (None, None)"""
+        try:
+            conf, soft = self._confidence(self.engines[key], width, filtered, probe)
+            if conf is None:
+                return None, None
+            return conf - self._baseline(width, filtered, probe), soft
+        except Exception as e:
+            print(f"[Debug] Search candidate failed (width={width}): {e}")
+            return None, None
+
+
+def search_watermark(img, keys, extra_widths=(), workers=None):
+    """
+    在 (密钥 × 尺度 × 是否滤波) 的候选空间中搜索水印，返回按分数降序的 Match 列表。
+    先用图像顶部约 PROBE_REPEATS 轮水印的分块做廉价预筛，只有明显高于诱饵基线的候选
+    (或分数最高的 KEEP_AT_LEAST 个) 才做整图提取。所有候选在线程池中并行评估。
+    """
+    keys = list(dict.fromkeys(str(k) for k in keys))
+    if not keys:
+        return []
+    pyramid = Pyramid(img)
+    widths = candidate_widths(pyramid.img.shape[1], extra_widths)
+    evaluator = _Evaluator(pyramid, keys)
+    candidates = [(key, width, filtered) for width in widths for filtered in (False, True) for key in keys]
+
+    with ThreadPoolExecutor(max_workers=workers or default_workers()) as pool:
+        futures = {pool.submit(evaluator.evaluate, *c, probe=True): c for c in candidates}
+        scored = []
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            margin, _ = future.result()
+            if margin is None:
+                continue
+            scored.append((margin, futures[future]))
+            if margin >= STRONG_MARGIN:
+                # 候选按命中可能性排序提交，出现强命中后其余预筛不再需要
+                for pending in futures:
+                    pending.cancel()
+        scored.sort(key=lambda item: -item[0])
+        survivors = [c for margin, c in scored if margin >= MIN_MARGIN] or [c for _, c in scored[:KEEP_AT_LEAST]]
+
+        finals = list(pool.map(lambda c: evaluator.evaluate(*c, probe=False), survivors))
+
+    matches = []
+    for (margin, soft), (key, width, filtered) in zip(finals, survivors):
+        if margin is None:
+            continue
+        wm = np.clip(np.rint(255 * soft), 0, 255).astype(np.uint8)
+        matches.append(Match(key, width, filtered, margin, wm))
+    matches.sort(key=lambda m: -m.score)
+    return matches
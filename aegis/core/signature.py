@@ -3,17 +3,77 @@ import datetime
 import hashlib
 import json
 import base64
+import mmap
+import struct
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ec, ed25519
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidSignature
+from aegis.core.hashing import file_digest
+from aegis.core.keyring import Keyring
+
+# 身份算法：RSA-4096 (默认，兼容已有身份)；Ed25519 与 ECDSA P-256 的密钥生成和签名快得多，适合批量分发
+IDENTITY_ALGORITHMS = ("rsa", "ed25519", "ecdsa-p256")
+# 身份算法 -> 签名包中的 "alg" 字段
+SIG_ALGORITHMS = {"rsa": "rsa-pss-sha256", "ed25519": "ed25519", "ecdsa-p256": "ecdsa-p256-sha256"}
+
+
+def key_algorithm(key):
+    """私钥 / 公钥对象对应的身份算法；不支持的密钥类型抛出 ValueError"""
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return "rsa"
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return "ed25519"
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and key.curve.name == "secp256r1":
+        return "ecdsa-p256"
+    raise ValueError(f"Unsupported key type: {type(key).__name__}")
+
+
+def _sign(private_key, data):
+    algorithm = key_algorithm(private_key)
+    if algorithm == "ed25519":
+        return private_key.sign(data)
+    if algorithm == "ecdsa-p256":
+        return private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+    return private_key.sign(
+        data,
+        padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=padding.PSS.MAX_LENGTH
+        ),
+        hashes.SHA256()
+    )
+
+
+def _verify(public_key, signature, data):
+    """验签失败时抛出 InvalidSignature"""
+    algorithm = key_algorithm(public_key)
+    if algorithm == "ed25519":
+        public_key.verify(signature, data)
+    elif algorithm == "ecdsa-p256":
+        public_key.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+    else:
+        public_key.verify(
+            signature,
+            data,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
 
 class SignatureManager:
     """
-    数字签名管理器：负责 RSA 密钥对、自签名证书的生成、签署与验证。
+    数字签名管理器：负责 RSA / Ed25519 / ECDSA P-256 密钥对、自签名证书的生成、签署与验证。
     """
     SIG_BOUNDARY = b"\x00--AEGIS-SIGNATURE-DATA--"
+    # 定长尾部: [边界符偏移][签名包长度][魔数]，验证时从文件末尾直接定位签名包，无需读取全文
+    SIG_TRAILER = struct.Struct("<QQ16s")
+    SIG_TRAILER_MAGIC = b"AEGIS-SIG-TAIL-2"
 
     def __init__(self, keys_dir=".aegis_identity"):
         # 默认存储身份信息的目录（建议放在用户家目录，这里暂设在项目内）
@@ -23,6 +83,8 @@ class SignatureManager:
         
         if not os.path.exists(self.keys_dir):
             os.makedirs(self.keys_dir)
+        # 已解析的私钥与证书缓存在密钥环中，签名与验证不再重复读取、解析
+        self.keyring = Keyring(self.keys_dir)
 
     def has_identity(self):
         """检查是否存在至少一个身份"""
@@ -41,11 +103,14 @@ class SignatureManager:
                 identities.append(ident_id)
         return sorted(identities)
 
-    def create_identity(self, name, email, ident_id=None):
+    def create_identity(self, name, email, ident_id=None, algorithm="rsa"):
         """
-        创建 RSA 4096 位密钥及自签名 X.509 证书。
+        创建密钥及自签名 X.509 证书。algorithm 见 IDENTITY_ALGORITHMS：
+        'rsa' 为 RSA 4096 位，'ed25519' / 'ecdsa-p256' 生成只需毫秒级。
         支持多身份ID，不覆盖默认身份。
         """
+        if algorithm not in IDENTITY_ALGORITHMS:
+            raise ValueError(f"Unsupported identity algorithm: {algorithm}")
         suffix = f"_{ident_id}" if ident_id else ""
         priv_name = f"private{suffix}.key"
         cert_name = f"identity{suffix}.crt"
@@ -54,11 +119,16 @@ class SignatureManager:
         cert_path = os.path.join(self.keys_dir, cert_name)
 
         # 1. 生成私钥
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=4096,
-            backend=default_backend()
-        )
+        if algorithm == "ed25519":
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        elif algorithm == "ecdsa-p256":
+            private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+        else:
+            private_key = rsa.generate_private_key(
+                public_exponent=65537,
+                key_size=4096,
+                backend=default_backend()
+            )
 
         # 2. 生成证书
         subject = issuer = x509.Name([
@@ -79,138 +149,123 @@ class SignatureManager:
             datetime.datetime.utcnow()
         ).not_valid_after(
             datetime.datetime.utcnow() + datetime.timedelta(days=365*20)
-        ).sign(private_key, hashes.SHA256(), default_backend())
+        ).sign(private_key, None if algorithm == "ed25519" else hashes.SHA256(), default_backend())
 
         # 3. 保存到本地
         with open(priv_path, "wb") as f:
             f.write(private_key.private_bytes(
                 encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
+                # Ed25519 没有传统 OpenSSL 格式，新算法统一使用 PKCS8
+                format=serialization.PrivateFormat.TraditionalOpenSSL if algorithm == "rsa"
+                else serialization.PrivateFormat.PKCS8,
                 encryption_algorithm=serialization.NoEncryption()
             ))
         
         with open(cert_path, "wb") as f:
             f.write(cert.public_bytes(serialization.Encoding.PEM))
-            
+
+        self.keyring.invalidate()
         return cert_path
 
     def sign_file(self, file_path, ident_id=None):
         """
         对文件进行数字签署。
         """
-        if not self.has_identity():
-            raise Exception("No identity found.")
-
-        suffix = f"_{ident_id}" if ident_id and ident_id != "default" else ""
-        priv_path = os.path.join(self.keys_dir, f"private{suffix}.key")
-        cert_path = os.path.join(self.keys_dir, f"identity{suffix}.crt")
-        
-        if not os.path.exists(priv_path):
-            # Fallback to default if specified ID not found
-            priv_path = self.priv_path
-            cert_path = self.cert_path
-
-        # 读取私钥
-        with open(priv_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(
-                f.read(), password=None, backend=default_backend()
-            )
+        return self.sign_digest(file_digest(file_path), ident_id=ident_id)
 
-        # 读取证书
-        with open(cert_path, "rb") as f:
-            cert_pem = f.read().decode('utf-8')
+    def sign_digest(self, file_hash, ident_id=None):
+        """
+        对已计算好的文件 SHA-256 摘要进行签署 (如写出文件时顺带计算的摘要)，返回 (签名 base64, 证书 PEM)。
+        """
+        sig_bundle = self.sign_bundle(file_hash, ident_id=ident_id)
+        return sig_bundle["sig"], sig_bundle["cert"]
 
-        # 计算文件哈希 (SHA-256)
-        file_hash = self._calculate_hash(file_path)
+    def sign_bundle(self, file_hash, ident_id=None):
+        """
+        签署摘要并返回签名包 {"sig", "cert", "kid", "alg"}。私钥与证书由密钥环缓存，
+        批量分发时同一身份只解析一次私钥。kid 为证书指纹，验证时可直接查找对应的本地证书；
+        alg 为签名算法 (见 SIG_ALGORITHMS)，由身份的密钥类型决定。
+        """
+        try:
+            private_key, cert_pem, kid = self.keyring.signer(ident_id)
+        except FileNotFoundError:
+            raise Exception("No identity found.")
 
         # 进行签名
-        signature = private_key.sign(
-            file_hash,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
+        signature = _sign(private_key, file_hash)
 
         sig_b64 = base64.b64encode(signature).decode('utf-8')
-        return sig_b64, cert_pem
+        return {"sig": sig_b64, "cert": cert_pem, "kid": kid, "alg": SIG_ALGORITHMS[key_algorithm(private_key)]}
 
     def verify_signature(self, file_bytes_without_sig, sig_b64, cert_pem=None):
         """
         验证签名。如果 cert_pem 为空，则轮询本地所有证书。
         """
+        return self.verify_digest(hashlib.sha256(file_bytes_without_sig).digest(), sig_b64, cert_pem)
+
+    def verify_digest(self, file_hash, sig_b64, cert_pem=None, kid=None, alg=None):
+        """
+        按签名数据的 SHA-256 摘要验证签名，返回 (是否通过, 签名者信息)。
+        优先使用签名包内嵌的证书 (自包含模式)；没有证书时按 kid 查找本地证书，
+        都没有时 (旧签名包) 轮询本地全部证书。
+        验签算法由证书的密钥类型决定；给出 alg 时密钥类型必须与之相符 (旧签名包没有 alg，均为 RSA)。
+        """
         try:
-            public_key = None
-            info = None
-            
-            # 策略 A: 使用传入的证书 (自包含模式)
+            signature = base64.b64decode(sig_b64)
             if cert_pem:
-                cert = x509.load_pem_x509_certificate(cert_pem.encode(), default_backend())
+                candidates = [self.keyring.load_cert(cert_pem)]
+            elif kid:
+                cert = self.keyring.find(kid)
+                candidates = [cert] if cert is not None else []
+            else:
+                candidates = list(self.keyring.certificates().values())
+
+            for cert in candidates:
                 public_key = cert.public_key()
+                try:
+                    if alg and SIG_ALGORITHMS[key_algorithm(public_key)] != alg:
+                        continue
+                    _verify(public_key, signature, file_hash)
+                except (InvalidSignature, ValueError):
+                    continue
+                # 验证通过，提取信息
                 subject = cert.subject
-                info = {
+                return True, {
                     "name": subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value,
                     "email": subject.get_attributes_for_oid(NameOID.EMAIL_ADDRESS)[0].value,
                     "expiry": cert.not_valid_after.strftime("%Y-%m-%d")
                 }
-            
-            # 策略 B: 轮询本地证书 (如果文件里没带证书，或者为了强校验)
-            else:
-                for ident_id in self.list_identities():
-                    suffix = f"_{ident_id}" if ident_id != "default" else ""
-                    c_path = os.path.join(self.keys_dir, f"identity{suffix}.crt")
-                    try:
-                        with open(c_path, "rb") as f:
-                            cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-                            # 尝试验证
-                            signature = base64.b64decode(sig_b64)
-                            file_hash = hashlib.sha256(file_bytes_without_sig).digest()
-                            cert.public_key().verify(
-                                signature,
-                                file_hash,
-                                padding.PSS(
-                                    mgf=padding.MGF1(hashes.SHA256()),
-                                    salt_length=padding.PSS.MAX_LENGTH
-                                ),
-                                hashes.SHA256()
-                            )
-                            # 验证通过，提取信息
-                            public_key = cert.public_key()
-                            subject = cert.subject
-                            info = {
-                                "name": subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value,
-                                "email": subject.get_attributes_for_oid(NameOID.EMAIL_ADDRESS)[0].value,
-                                "expiry": cert.not_valid_after.strftime("%Y-%m-%d")
-                            }
-                            break
-                    except:
-                        continue
-            
-            if not public_key: return False, None
-
-            # 二次确认 (如果是策略 A，这里才真正验签)
-            if cert_pem:
-                file_hash = hashlib.sha256(file_bytes_without_sig).digest()
-                signature = base64.b64decode(sig_b64)
-                public_key.verify(
-                    signature,
-                    file_hash,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH
-                    ),
-                    hashes.SHA256()
-                )
-            
-            return True, info
+            return False, None
         except Exception as e:
             # print(f"[Debug] Verify Failed: {e}")
             return False, None
 
-    def _calculate_hash(self, file_path):
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.digest()
+    def pack_signature(self, offset, sig_bundle):
+        """
+        生成追加到文件末尾的签名数据: [边界符] + [签名 JSON] + [定长尾部]。
+        offset 为追加位置 (即被签署数据的长度)，sig_bundle 为 sign_bundle 的结果。
+        """
+        sig_data = json.dumps(sig_bundle).encode('utf-8')
+        return self.SIG_BOUNDARY + sig_data + self.SIG_TRAILER.pack(offset, len(sig_data), self.SIG_TRAILER_MAGIC)
+
+    def read_signature(self, f):
+        """
+        从以二进制打开的文件中定位签名包，返回 (被签署数据的长度, 签名包)；没有签名时返回 None。
+        新格式读取定长尾部后直接 seek；没有尾部的旧格式在 mmap 上反向查找最后一个边界符。
+        """
+        size = os.fstat(f.fileno()).st_size
+        if size >= self.SIG_TRAILER.size:
+            f.seek(size - self.SIG_TRAILER.size)
+            offset, length, magic = self.SIG_TRAILER.unpack(f.read(self.SIG_TRAILER.size))
+            if (magic == self.SIG_TRAILER_MAGIC
+                    and offset + len(self.SIG_BOUNDARY) + length + self.SIG_TRAILER.size == size):
+                f.seek(offset)
+                if f.read(len(self.SIG_BOUNDARY)) == self.SIG_BOUNDARY:
+                    return offset, json.loads(f.read(length).decode('utf-8'))
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = mm.rfind(self.SIG_BOUNDARY)
+            if offset < 0:
+                return None
+            return offset, json.loads(mm[offset + len(self.SIG_BOUNDARY):].decode('utf-8'))
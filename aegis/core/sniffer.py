@@ -1,9 +1,45 @@
 import os
+import re
+import zipfile
+
+# OOXML 主文档部件的内容类型前缀 -> 容器类型 (含启用宏、模板等变体)
+OOXML_MAIN_TYPES = (
+    ('application/vnd.openxmlformats-officedocument.presentationml.', 'ppt'),
+    ('application/vnd.ms-powerpoint.', 'ppt'),
+    ('application/vnd.openxmlformats-officedocument.wordprocessingml.', 'docx'),
+    ('application/vnd.ms-word.', 'docx'),
+    ('application/vnd.openxmlformats-officedocument.spreadsheetml.', 'xlsx'),
+    ('application/vnd.ms-excel.', 'xlsx'),
+)
+# [Content_Types].xml 只读取这么多字节 (主部件的声明通常在最前面几 KB)
+CONTENT_TYPES_LIMIT = 1024 * 1024
+_MAIN_TYPE = re.compile(rb'ContentType\s*=\s*["\']([^"\']+\.main\+xml)["\']')
+
+
+def sniff_zip_type(file_path):
+    """
+    区分 ZIP 容器：只经中央目录定位并读取 [Content_Types].xml，按主文档部件
+    (内容类型以 .main+xml 结尾的 Override) 判断。返回 'ppt' / 'docx' / 'xlsx'；
+    有 [Content_Types].xml 但无法识别主部件时返回 'ooxml'，普通 ZIP 返回 'unknown'。
+    """
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            with zip_ref.open('[Content_Types].xml') as f:
+                content_types = f.read(CONTENT_TYPES_LIMIT)
+    except (KeyError, zipfile.BadZipFile, OSError):
+        return 'unknown'
+    for main_type in _MAIN_TYPE.findall(content_types):
+        main_type = main_type.decode('ascii', 'ignore')
+        for prefix, f_type in OOXML_MAIN_TYPES:
+            if main_type.startswith(prefix):
+                return f_type
+    return 'ooxml'
+
 
 def sniff_file_type(file_path):
     """
     通过读取文件头 Magic Number 识别文件真实类型。
-    返回: 'image', 'ppt', 'unknown'
+    返回: 'image', 'pdf', 'ppt', 'docx', 'xlsx', 'ooxml', 'unknown'
     """
     if not os.path.exists(file_path):
         return 'unknown'
@@ -17,11 +53,14 @@ def sniff_file_type(file_path):
         # JPEG: FF D8 FF
         if header.startswith(b'\x89PNG') or header.startswith(b'\xff\xd8\xff'):
             return 'image'
+        # TIFF: II*\0 / MM\0* ，BMP: BM (大幅面扫描件常见格式)
+        if header[:4] in (b'II*\x00', b'MM\x00*') or header.startswith(b'BM'):
+            return 'image'
             
-        # 2. 检查 ZIP 特征 (PPTX 本质是 ZIP)
+        # 2. 检查 ZIP 特征 (PPTX / DOCX / XLSX 本质是 ZIP)，再按内容类型区分
         # PK.. : 50 4B 03 04
         if header.startswith(b'PK\x03\x04'):
-            return 'ppt'
+            return sniff_zip_type(file_path)
             
         # 3. 检查 PDF 特征
         # %PDF- : 25 50 44 46 2D
@@ -0,0 +1,481 @@
+import os
+import struct
+import uuid
+import zlib
+import cv2
+import numpy as np
+from PIL import Image
+from aegis.core.fusion import EXTRACT_STOP_MARGIN, EvidenceFusion, best_estimate
+from aegis.core.search import DECOY_KEY
+from aegis.core.workers import get_engine
+
+# 分块边长阶梯：嵌入时按内存预算从大到小选取，提取时逐级尝试，无需记录嵌入参数
+TILE_SIZES = (2048, 1024, 512, 256)
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+# 提取时每种分块边长参与融合的分块数上限 (在网格上均匀抽取，首尾行列必选)
+EXTRACT_TILES = 16
+# 单个分块嵌入 (embed_array) 的峰值工作集，字节/像素 (实测约 65，含分块副本留出余量)
+ENGINE_BYTES_PER_PIXEL = 72
+# 读写器内部每次解码 / 编码的行数 (临时缓冲只与此行数成正比)
+CHUNK_ROWS = 64
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG 颜色类型 -> (通道数, PIL 模式)
+_PNG_COLOR_TYPES = {0: (1, 'L'), 2: (3, 'RGB'), 4: (2, 'LA'), 6: (4, 'RGBA')}
+# PIL raw 解码器的 rawmode -> (每像素字节数, 转 BGR(A) 的 cv2 转换码)
+_RAW_MODES = {
+    'L': (1, cv2.COLOR_GRAY2BGR),
+    'RGB': (3, cv2.COLOR_RGB2BGR),
+    'BGR': (3, None),
+    'RGBX': (4, cv2.COLOR_RGBA2BGR),
+    'BGRX': (4, cv2.COLOR_BGRA2BGR),
+    'RGBA': (4, cv2.COLOR_RGBA2BGRA),
+    'BGRA': (4, None),
+}
+
+
+def split_extent(total, tile):
+    """将长度 total 均分为若干段 (除最后一段外均为 8 的倍数)，避免末尾出现过窄的分块"""
+    n = max(1, -(-total // tile))
+    size = min(total, (-(-total // n) + 7) // 8 * 8)
+    starts = list(range(0, total, size))
+    return [(s, min(s + size, total)) for s in starts]
+
+
+def _spread(n, k):
+    """在 [0, n) 中均匀抽取至多 k 个下标 (含首尾)"""
+    if n <= k:
+        return list(range(n))
+    if k == 1:
+        return [0]
+    return sorted({round(i * (n - 1) / (k - 1)) for i in range(k)})
+
+
+def tile_grid(width, height, tile):
+    """返回 (行区间列表, 列区间列表)；嵌入与提取共用，保证分块几何一致"""
+    return split_extent(height, tile), split_extent(width, tile)
+
+
+def plan_tile_size(width, channels=3, tile_size=TILE_SIZES[0], memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    在内存预算内选取最大的分块边长。
+    峰值 ≈ 引擎工作集 (T²) + 整行条带缓冲 (W × T) + 读写器的行块缓冲。
+    """
+    candidates = [t for t in TILE_SIZES if t <= tile_size] or [TILE_SIZES[-1]]
+    for tile in candidates:
+        need = (ENGINE_BYTES_PER_PIXEL * tile * tile
+                + width * tile * channels
+                + 4 * width * CHUNK_ROWS * channels)
+        if need <= memory_budget:
+            return tile
+    print(f"[*] Memory budget {memory_budget >> 20} MB is below the minimum for width {width}, using {candidates[-1]}px tiles.")
+    return candidates[-1]
+
+
+class _BombCheckDisabled:
+    """仅读取文件头与分块布局，不做整图解码，因此临时关闭 PIL 的超大图保护"""
+    def __enter__(self):
+        self._saved = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+
+    def __exit__(self, *exc):
+        Image.MAX_IMAGE_PIXELS = self._saved
+
+
+class RawBandReader:
+    """
+    未压缩栅格 (无压缩 TIFF 条带/瓦片、BMP、PPM/PGM) 的按行读取器：
+    按 PIL 解析出的 raw 分块偏移直接 seek 读取，内存只与所读行数成正比。
+    """
+    def __init__(self, path, size, rawmode, tiles):
+        self.width, self.height = size
+        self.bpp, self._code = _RAW_MODES[rawmode]
+        self.channels = 4 if rawmode in ('RGBA', 'BGRA') else 3
+        self._tiles = tiles
+        self._f = open(path, 'rb')
+
+    @classmethod
+    def open(cls, path):
+        """文件可按行直接读取时返回读取器，否则返回 None"""
+        try:
+            with _BombCheckDisabled():
+                im = Image.open(path)
+            with im:
+                tiles = []
+                rawmode = None
+                for tile in im.tile:
+                    args = tile.args if isinstance(tile.args, tuple) else (tile.args, 0, 1)
+                    mode, stride, orientation = (tuple(args) + (0, 1))[:3]
+                    if tile.codec_name != 'raw' or mode not in _RAW_MODES or rawmode not in (None, mode):
+                        return None
+                    if orientation not in (1, -1):
+                        return None
+                    rawmode = mode
+                    tiles.append((tile.extents, tile.offset, stride, orientation))
+                if not tiles:
+                    return None
+                return cls(path, im.size, rawmode, tiles)
+        except Exception:
+            return None
+
+    def read(self, y0, y1):
+        out = np.zeros((y1 - y0, self.width, self.bpp), dtype=np.uint8)
+        for (tx0, ty0, tx1, ty1), offset, stride, orientation in self._tiles:
+            r0, r1 = max(y0, ty0), min(y1, ty1, self.height)
+            c1 = min(tx1, self.width)
+            if r0 >= r1 or tx0 >= c1:
+                continue
+            row_bytes = (tx1 - tx0) * self.bpp
+            stride = stride or row_bytes
+            if orientation == 1 and stride == row_bytes and (tx0, c1) == (0, self.width):
+                # 整行连续存储 (常见的无压缩 TIFF / PPM)：直接读入目标缓冲
+                self._f.seek(offset + (r0 - ty0) * stride)
+                self._f.readinto(memoryview(out[r0 - y0:r1 - y0]).cast('B'))
+                continue
+            for c0 in range(r0, r1, CHUNK_ROWS):
+                c_end = min(c0 + CHUNK_ROWS, r1)
+                # 自底向上存储 (BMP)：按镜像行号定位，读入后翻转
+                first = c0 - ty0 if orientation == 1 else ty1 - c_end
+                self._f.seek(offset + first * stride)
+                buf = np.frombuffer(self._f.read((c_end - c0) * stride), dtype=np.uint8)
+                rows = buf.reshape(c_end - c0, stride)[:, :row_bytes].reshape(c_end - c0, tx1 - tx0, self.bpp)
+                if orientation == -1:
+                    rows = rows[::-1]
+                out[c0 - y0:c_end - y0, tx0:c1] = rows[:, :c1 - tx0]
+        if self._code is None:
+            return out
+        if self.bpp == 1:
+            return cv2.cvtColor(out[:, :, 0], self._code)
+        if self._code in (cv2.COLOR_RGB2BGR, cv2.COLOR_RGBA2BGRA):
+            # 通道数不变的转换原地完成，不再额外复制整条带
+            return cv2.cvtColor(out, self._code, dst=out)
+        return cv2.cvtColor(out, self._code)
+
+    def close(self):
+        self._f.close()
+
+
+class PNGBandReader:
+    """
+    PNG 流式读取器 (8 bit、非隔行)：IDAT 增量解压，按行块交给 PIL 的 zip 解码器反滤波。
+    行块前补上一块的最后一行 (滤波类型 0)，使 Up/Average/Paeth 滤波可以跨块正确还原。
+    """
+    def __init__(self, path, width, height, color_type):
+        self.width, self.height = width, height
+        self._src_channels, self._mode = _PNG_COLOR_TYPES[color_type]
+        self.channels = 4 if color_type in (4, 6) else 3
+        self._stride = 1 + width * self._src_channels
+        self._f = open(path, 'rb')
+        self._f.seek(len(PNG_SIGNATURE))
+        self._inflate = zlib.decompressobj()
+        self._pending = b''
+        self._idat_left = 0
+        self._row = 0
+        self._prev = None
+
+    @classmethod
+    def open(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(len(PNG_SIGNATURE) + 8 + 13)
+            if not head.startswith(PNG_SIGNATURE) or head[12:16] != b'IHDR':
+                return None
+            w, h, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', head[16:29])
+            if depth != 8 or interlace or color_type not in _PNG_COLOR_TYPES:
+                return None
+            return cls(path, w, h, color_type)
+        except OSError:
+            return None
+
+    def _next_idat(self):
+        """返回下一段 IDAT 数据 (最多 1MB)，读完返回 b''"""
+        while self._idat_left == 0:
+            header = self._f.read(8)
+            if len(header) < 8:
+                return b''
+            length, ctype = struct.unpack('>I4s', header)
+            if ctype == b'IEND':
+                return b''
+            if ctype == b'IDAT':
+                self._idat_left = length
+            else:
+                self._f.seek(length + 4, os.SEEK_CUR)
+        data = self._f.read(min(self._idat_left, 1 << 20))
+        self._idat_left -= len(data)
+        if self._idat_left == 0:
+            # 跳过 CRC
+            self._f.seek(4, os.SEEK_CUR)
+        return data
+
+    def _filtered_rows(self, n):
+        need = n * self._stride
+        parts, have = [self._pending], len(self._pending)
+        while have < need:
+            data = self._inflate.unconsumed_tail or self._next_idat()
+            if not data:
+                raise ValueError("Truncated PNG stream")
+            out = self._inflate.decompress(data, need - have)
+            parts.append(out)
+            have += len(out)
+        raw = b''.join(parts)
+        self._pending = raw[need:]
+        return raw[:need]
+
+    def _decode_chunk(self, n):
+        rows = self._filtered_rows(n)
+        prefix = b'\x00' + self._prev if self._prev is not None else b''
+        count = n + (1 if prefix else 0)
+        im = Image.frombytes(self._mode, (self.width, count), zlib.compress(prefix + rows, 0), 'zip', self._mode)
+        arr = np.asarray(im)
+        if prefix:
+            arr = arr[1:]
+        self._prev = arr[-1].tobytes()
+        if self._mode == 'L':
+            return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+        if self._mode == 'LA':
+            gray = np.ascontiguousarray(arr[:, :, 0])
+            return np.dstack([cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), arr[:, :, 1]])
+        if self._mode == 'RGB':
+            return arr[:, :, ::-1]
+        return arr[:, :, [2, 1, 0, 3]]
+
+    def read(self, y0, y1):
+        """只支持自上而下顺序读取"""
+        if y0 != self._row:
+            raise ValueError("PNG bands must be read sequentially")
+        out = np.empty((y1 - y0, self.width, self.channels), dtype=np.uint8)
+        for r in range(y0, y1, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, y1 - r)
+            out[r - y0:r - y0 + n] = self._decode_chunk(n)
+        self._row = y1
+        return out
+
+    def close(self):
+        self._f.close()
+
+
+class DecodedBandReader:
+    """回退路径：其余格式 (JPEG、压缩 TIFF 等) 由 OpenCV 整图解码，内存不受预算约束"""
+    def __init__(self, img):
+        self._img = img
+        self.height, self.width = img.shape[:2]
+        self.channels = 3
+
+    @classmethod
+    def open(cls, path):
+        img = cv2.imread(path)
+        return cls(img) if img is not None else None
+
+    def read(self, y0, y1):
+        return self._img[y0:y1].copy()
+
+    def close(self):
+        self._img = None
+
+
+def open_band_reader(path):
+    """按格式选择按行读取器，无法读取时返回 None"""
+    reader = PNGBandReader.open(path) or RawBandReader.open(path)
+    if reader is None:
+        print(f"[*] {os.path.basename(path)} is not stream-decodable, falling back to a full decode.")
+        reader = DecodedBandReader.open(path)
+    return reader
+
+
+class PNGStreamWriter:
+    """
+    PNG 流式写入器：逐行块滤波压缩后直接写出 IDAT，内存只与行块大小有关。
+    每行按 libpng 的启发式 (绝对差之和最小) 在 None / Sub / Up 中选择滤波类型。
+    """
+    def __init__(self, path, width, height, channels, level=1):
+        self.width, self.height, self.channels = width, height, channels
+        self._f = open(path, 'wb')
+        self._deflate = zlib.compressobj(level)
+        self._prev = np.zeros(width * channels, dtype=np.uint8)
+        self._rows = 0
+        color_type = 6 if channels == 4 else 2
+        self._f.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, ctype, data):
+        self._f.write(struct.pack('>I', len(data)))
+        self._f.write(ctype)
+        self._f.write(data)
+        self._f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(ctype))))
+
+    def _filter(self, rows):
+        bpp = self.channels
+        prev = np.vstack([self._prev[None], rows[:-1]])
+        sub = rows.copy()
+        sub[:, bpp:] -= rows[:, :-bpp]
+        up = rows - prev
+        out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        out[:, 0] = 0
+        out[:, 1:] = rows
+        # 以有符号字节的绝对值之和为代价：min(x, 256 - x)，全程在 uint8 上计算
+        best = np.minimum(rows, 0 - rows).sum(axis=1, dtype=np.uint64)
+        for ftype, cand in ((1, sub), (2, up)):
+            cost = np.minimum(cand, 0 - cand).sum(axis=1, dtype=np.uint64)
+            better = cost < best
+            best[better] = cost[better]
+            out[better, 0] = ftype
+            out[better, 1:] = cand[better]
+        return out
+
+    def write(self, band):
+        """写入若干行 BGR(A) 像素"""
+        if band.ndim == 2:
+            band = cv2.cvtColor(band, cv2.COLOR_GRAY2BGR)
+        order = [2, 1, 0, 3] if self.channels == 4 else [2, 1, 0]
+        for r in range(0, band.shape[0], CHUNK_ROWS):
+            rows = np.ascontiguousarray(band[r:r + CHUNK_ROWS, :, order]).reshape(-1, self.width * self.channels)
+            data = self._deflate.compress(self._filter(rows).tobytes())
+            if data:
+                self._chunk(b'IDAT', data)
+            self._prev = rows[-1]
+            self._rows += rows.shape[0]
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            self._chunk(b'IDAT', self._deflate.flush())
+            self._chunk(b'IEND', b'')
+        finally:
+            self._f.close()
+        if self._rows != self.height:
+            raise ValueError(f"PNG row count mismatch: {self._rows} != {self.height}")
+
+    def abort(self):
+        """放弃写入并删除不完整的输出文件"""
+        self._f.close()
+        if os.path.exists(self._f.name):
+            os.remove(self._f.name)
+
+
+class MemmapWriter:
+    """其余输出格式：写入磁盘映射画布，结束时交给 cv2.imwrite 编码，驻留内存可被系统回收"""
+    def __init__(self, path, width, height, channels):
+        self.path = path
+        self._tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._canvas = np.memmap(self._tmp, dtype=np.uint8, mode='w+', shape=(height, width, channels))
+        self._row = 0
+
+    def write(self, band):
+        if band.ndim == 2:
+            band = cv2.cvtColor(band, cv2.COLOR_GRAY2BGR)
+        self._canvas[self._row:self._row + band.shape[0]] = band
+        self._row += band.shape[0]
+
+    def close(self):
+        try:
+            if self._canvas is not None and not cv2.imwrite(self.path, self._canvas):
+                raise ValueError(f"cv2.imwrite failed for {self.path}")
+        finally:
+            self._canvas = None
+            if os.path.exists(self._tmp):
+                os.remove(self._tmp)
+
+    def abort(self):
+        self._canvas = None
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+def open_band_writer(path, width, height, channels):
+    if path.lower().endswith('.png'):
+        return PNGStreamWriter(path, width, height, channels)
+    return MemmapWriter(path, width, height, channels)
+
+
+class TiledEmbedder:
+    """
+    分块流式嵌入：按整行条带读取 -> 条带内逐块嵌入 -> 立即写出。
+    每个分块独立嵌入一份完整的平铺水印，任一分块均可单独提取。
+    """
+    def __init__(self, watermarker, tile_size=TILE_SIZES[0], memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.watermarker = watermarker
+        self.tile_size = tile_size
+        self.memory_budget = memory_budget
+
+    def embed_file(self, input_path, output_path, text):
+        reader = open_band_reader(input_path)
+        if reader is None:
+            return False
+        writer, ok = None, False
+        try:
+            tile = plan_tile_size(reader.width, reader.channels, self.tile_size, self.memory_budget)
+            rows, cols = tile_grid(reader.width, reader.height, tile)
+            print(f"[*] Tiled mode: {reader.width}x{reader.height}, {len(rows) * len(cols)} tiles of ~{tile}px")
+            writer = open_band_writer(output_path, reader.width, reader.height, reader.channels)
+            for y0, y1 in rows:
+                band = reader.read(y0, y1)
+                for x0, x1 in cols:
+                    embedded = self.watermarker.embed_array(np.ascontiguousarray(band[:, x0:x1]), text)
+                    if embedded is None:
+                        return False
+                    # 全不透明的 Alpha 会在嵌入时被丢弃，只回写颜色通道
+                    band[:, x0:x1, :embedded.shape[2]] = embedded
+                writer.write(band)
+            writer.close()
+            ok = True
+            return True
+        except Exception as e:
+            print(f"[ERROR] Tiled embedding failed: {e}")
+            return False
+        finally:
+            reader.close()
+            if writer is not None and not ok:
+                writer.abort()
+
+    def extract_file(self, input_path):
+        """
+        提取分块水印。分块边长未知，按 TILE_SIZES 逐级尝试：每种边长在分块网格上均匀抽取
+        至多 EXTRACT_TILES 个分块，各分块的估计 (含诱饵密钥基线) 经 EvidenceFusion 加权融合，
+        被涂抹、损坏的分块几乎不参与。融合后的 margin 达到 EXTRACT_STOP_MARGIN 即停止，
+        否则取 margin 最高的边长。返回 uint8 水印图或 None。
+        """
+        engine = self.watermarker.engine
+        decoy = get_engine(DECOY_KEY, None, "text").engine
+        best, best_margin = None, None
+        for size in TILE_SIZES:
+            reader = open_band_reader(input_path)
+            if reader is None:
+                return None
+            try:
+                soft, margin = self._fuse_tiles(reader, size, engine, decoy)
+            finally:
+                reader.close()
+            if soft is not None and (best_margin is None or margin > best_margin):
+                best, best_margin = soft, margin
+            if best_margin is not None and best_margin >= EXTRACT_STOP_MARGIN:
+                break
+        if best is None:
+            return None
+        return np.clip(np.rint(255 * best), 0, 255).astype(np.uint8)
+
+    def _fuse_tiles(self, reader, size, engine, decoy):
+        """按边长 size 的网格抽取分块并融合，返回 (融合软判决, margin)；没有可用分块时为 (None, 0.0)"""
+        rows, cols = tile_grid(reader.width, reader.height, size)
+        row_picks = _spread(len(rows), int(np.ceil(np.sqrt(EXTRACT_TILES))))
+        col_picks = _spread(len(cols), max(1, EXTRACT_TILES // len(row_picks)))
+        # PNG 只能自上而下顺序读取，未抽中的条带也要读过；其余读取器可直接跳过
+        sequential = isinstance(reader, PNGBandReader)
+        fusion = EvidenceFusion()
+        for r in range(row_picks[-1] + 1):
+            if r not in row_picks:
+                if sequential:
+                    reader.read(*rows[r])
+                continue
+            band = reader.read(*rows[r])
+            for c in col_picks:
+                x0, x1 = cols[c]
+                tile_img = np.ascontiguousarray(band[:, x0:x1, :3])
+                shape = self.watermarker.get_safe_wm_size(tile_img.shape)
+                if engine.capacity(tile_img.shape) < shape[0] * shape[1]:
+                    continue
+                # 原分辨率的小分块经中值滤波后信号损失明显，原图与去噪图都尝试
+                _, soft, base = best_estimate(engine, decoy, (tile_img, cv2.medianBlur(tile_img, 3)), shape)
+                fusion.add(soft, base)
+        soft, margin, _ = fusion.best()
+        return soft, margin
@@ -0,0 +1,116 @@
+import atexit
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aegis.core.engine import default_workers
+from aegis.core.frequency import FrequencyWatermarker
+
+# 每个工作进程分到的任务块数：块越多负载越均衡，块越少每块的固定开销 (打开文档等) 越少
+CHUNKS_PER_WORKER = 4
+# 每个工作进程最多积压的任务数：结果按序产出，已完成但未轮到的结果至多积压这么多
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_worker = False
+# 工作进程内缓存的引擎 (密钥派生的置乱材料随之复用)
+_engines = {}
+
+
+def init_worker():
+    # 工作进程只初始化一次：之后的任务复用已导入的模块、已打开的文档与密钥派生材料。
+    # 其他进程池 (如目录扫描) 的工作进程也应调用，使处理器在其中串行执行而不再嵌套建池
+    global _in_worker
+    _in_worker = True
+    os.environ["OPENCV_LOG_LEVEL"] = "OFF"
+
+
+def in_worker():
+    return _in_worker
+
+
+def get_engine(key, threads, mode):
+    """按 (密钥, 线程数, 模式) 缓存的 FrequencyWatermarker，供池内任务复用"""
+    engine = _engines.get((key, threads, mode))
+    if engine is None:
+        engine = _engines.setdefault((key, threads, mode), FrequencyWatermarker(key=key, workers=threads, mode=mode))
+    return engine
+
+
+def get_pool():
+    """
+    所有处理器共享的常驻进程池，首次使用时创建，进程退出时关闭。
+    在池内的工作进程中返回 None (避免嵌套建池)，调用方应改为串行执行。
+    """
+    global _pool
+    if _in_worker:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=default_workers(), initializer=init_worker)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_pool)
+
+
+def map_tasks(fn, tasks, window=None):
+    """
+    在共享进程池中执行 fn(task)，按 tasks 的顺序逐个产出结果 (先完成的不必等待全部完成)。
+    tasks 可为惰性迭代器：在途任务至多 window 个 (默认为工作进程数 × TASKS_IN_FLIGHT_PER_WORKER)，
+    队首结果被取走后才提交下一个，内存只与窗口大小有关，与任务总数无关。
+    池不可用时在当前进程串行执行；工作进程异常退出后丢弃该池，下次调用重新创建。
+    """
+    pool = get_pool()
+    if pool is None:
+        yield from map(fn, tasks)
+        return
+    window = window or default_workers() * TASKS_IN_FLIGHT_PER_WORKER
+    tasks = iter(tasks)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                task = next(tasks, None)
+                if task is None: break
+                pending.append(pool.submit(fn, task))
+            if not pending: break
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        global _pool
+        with _pool_lock:
+            if _pool is pool: _pool = None
+        raise
+    finally:
+        # 调用方提前停止迭代 (或出错) 时取消尚未开始的任务
+        for future in pending:
+            future.cancel()
+
+
+def split_ranges(total, parts=None, max_len=None):
+    """
+    把 [0, total) 切成至多 parts 个连续区间 (默认为工作进程数 × CHUNKS_PER_WORKER)；
+    给出 max_len 时每个区间不超过 max_len (区间数随之增加)
+    """
+    parts = parts or default_workers() * CHUNKS_PER_WORKER
+    if max_len:
+        parts = max(parts, -(-total // max_len))
+    parts = max(1, min(total, parts))
+    bounds = [total * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+
+def threads_per_task(n_tasks):
+    """任务数少于核心数时 (如单页 PDF)，空闲核心分给每个任务内的引擎线程"""
+    cores = default_workers()
+    return max(1, cores // max(1, min(n_tasks, cores)))
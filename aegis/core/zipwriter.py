@@ -0,0 +1,145 @@
+import os
+import struct
+import time
+import zlib
+import zipfile
+from aegis.core.hashing import HashingWriter
+
+# 大于 4 GB 的条目 / 偏移，或超过 65535 个条目时改用 ZIP64 字段
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# 复制原始压缩数据时每次读写的字节数
+COPY_BUFFER = 1024 * 1024
+# 通用标志位：bit 3 为数据描述符 (写入时尺寸已知，不再需要)，bit 11 为 UTF-8 文件名
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    year = min(max(year, 1980), 2107)
+    return (hour << 11 | minute << 5 | second // 2), ((year - 1980) << 9 | month << 5 | day)
+
+
+class _Entry:
+    """写出的条目：写中央目录所需的字段"""
+    __slots__ = ("name", "flags", "method", "dos_time", "dos_date", "crc", "csize", "usize",
+                 "offset", "version", "create_version", "create_system", "external_attr", "comment")
+
+
+class ZipStreamWriter:
+    """
+    ZIP 流式写入器：未改动的条目从源 ZIP 原样复制压缩数据 (不解压、不重新压缩)，
+    只有新内容需要压缩。条目写出即落盘，最后写中央目录。
+    源条目的扩展字段 (时间戳等) 不保留，ZIP64 字段按需重新生成。
+    """
+    def __init__(self, path):
+        self._f = HashingWriter(open(path, 'wb'))
+        self._entries = []
+
+    def _local_header(self, entry):
+        zip64 = entry.csize >= ZIP64_LIMIT or entry.usize >= ZIP64_LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, entry.usize, entry.csize) if zip64 else b''
+        csize, usize = (ZIP64_LIMIT, ZIP64_LIMIT) if zip64 else (entry.csize, entry.usize)
+        version = max(entry.version, 45) if zip64 else entry.version
+        self._f.write(struct.pack('<4sHHHHHIIIHH', b'PK\x03\x04', version, entry.flags, entry.method,
+                                  entry.dos_time, entry.dos_date, entry.crc, csize, usize,
+                                  len(entry.name), len(extra)))
+        self._f.write(entry.name)
+        self._f.write(extra)
+
+    def _entry(self, name, date_time, method, crc, csize, usize, flags=0, version=20,
+               create_version=20, create_system=0, external_attr=0, comment=b''):
+        entry = _Entry()
+        try:
+            entry.name = name.encode('ascii')
+        except UnicodeEncodeError:
+            entry.name = name.encode('utf-8')
+            flags |= _FLAG_UTF8
+        entry.flags = flags & ~_FLAG_DATA_DESCRIPTOR
+        entry.method = method
+        entry.dos_time, entry.dos_date = _dos_datetime(date_time)
+        entry.crc, entry.csize, entry.usize = crc, csize, usize
+        entry.offset = self._f.tell()
+        entry.version, entry.create_version, entry.create_system = version, create_version, create_system
+        entry.external_attr, entry.comment = external_attr, comment
+        return entry
+
+    def copy_entry(self, src, info):
+        """
+        src 为以二进制打开的源 ZIP 文件，info 为其 ZipInfo：按本地文件头定位压缩数据并原样复制。
+        """
+        entry = self._entry(info.filename, info.date_time, info.compress_type, info.CRC,
+                            info.compress_size, info.file_size, info.flag_bits & ~_FLAG_UTF8,
+                            info.extract_version, info.create_version, info.create_system,
+                            info.external_attr, info.comment)
+        src.seek(info.header_offset)
+        header = src.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f"Bad local file header: {info.filename}")
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        src.seek(info.header_offset + 30 + name_len + extra_len)
+        self._local_header(entry)
+        remaining = info.compress_size
+        while remaining:
+            chunk = src.read(min(COPY_BUFFER, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated entry: {info.filename}")
+            self._f.write(chunk)
+            remaining -= len(chunk)
+        self._entries.append(entry)
+
+    def write(self, name, data, compress_type=zipfile.ZIP_DEFLATED, date_time=None):
+        """写入新条目 (内存中的完整内容)"""
+        if compress_type == zipfile.ZIP_DEFLATED:
+            deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            payload = deflate.compress(data) + deflate.flush()
+        else:
+            compress_type, payload = zipfile.ZIP_STORED, data
+        entry = self._entry(name, date_time or time.localtime()[:6], compress_type, zlib.crc32(data),
+                            len(payload), len(data), version=20 if compress_type == zipfile.ZIP_DEFLATED else 10,
+                            external_attr=0o600 << 16)
+        self._local_header(entry)
+        self._f.write(payload)
+        self._entries.append(entry)
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            start = self._f.tell()
+            for entry in self._entries:
+                fields = [entry.usize, entry.csize, entry.offset]
+                limits = [f >= ZIP64_LIMIT for f in fields]
+                extra = struct.pack('<' + 'Q' * sum(limits), *[f for f, big in zip(fields, limits) if big])
+                extra = struct.pack('<HH', 1, len(extra)) + extra if extra else b''
+                usize, csize, offset = [ZIP64_LIMIT if big else f for f, big in zip(fields, limits)]
+                version = max(entry.version, 45) if extra else entry.version
+                self._f.write(struct.pack('<4sBBHHHHHIIIHHHHHII', b'PK\x01\x02', entry.create_version,
+                                          entry.create_system, version, entry.flags, entry.method,
+                                          entry.dos_time, entry.dos_date, entry.crc, csize, usize,
+                                          len(entry.name), len(extra), len(entry.comment), 0, 0,
+                                          entry.external_attr, offset))
+                self._f.write(entry.name)
+                self._f.write(extra)
+                self._f.write(entry.comment)
+            end = self._f.tell()
+            count, size = len(self._entries), end - start
+            if count >= ZIP64_COUNT_LIMIT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+                self._f.write(struct.pack('<4sQHHIIQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                                          count, count, size, start))
+                self._f.write(struct.pack('<4sIQI', b'PK\x06\x07', 0, end, 1))
+                count, size, start = min(count, ZIP64_COUNT_LIMIT), min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT)
+            self._f.write(struct.pack('<4sHHHHIIH', b'PK\x05\x06', 0, 0, count, count, size, start, 0))
+        finally:
+            self._f.close()
+
+    def digest(self):
+        """输出全文的 SHA-256 (close 之后调用)"""
+        return self._f.digest()
+
+    def abort(self):
+        """放弃写入并删除不完整的输出文件"""
+        self._f.close()
+        if os.path.exists(self._f.name):
+            os.remove(self._f.name)
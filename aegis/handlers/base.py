@@ -1,56 +1,113 @@
-import json
 import os
+import cv2
+from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.hashing import file_digest
+from aegis.core.search import search_watermark
 
 class BaseHandler:
     """
     所有文件处理器的基类，提供通用的数字签名附加与提取功能。
     """
-    def attach_signature(self, file_path, sig_mgr):
-        """将数字签名追加到文件物理末尾"""
-        try:
-            # 1. 读取当前文件内容（签署的是当前状态）
-            with open(file_path, "rb") as f:
-                original_content = f.read()
+    # 输出文件路径 -> (文件大小, SHA-256)，由 _remember_digest 记录
+    _digests = None
+
+    def process_variants(self, input_path, jobs, key="1", mode="text"):
+        """
+        为多个收件人生成不同水印的副本。jobs 为 [(output_path, watermark_text), ...]，
+        返回与 jobs 等长的成功标记列表。默认逐个调用 process；
+        支持一次分析、多次嵌入的处理器会覆盖此方法。
+        mode='payload' 时 watermark_text 为分发 ID，以纠错编码比特嵌入。
+        """
+        return [self.process(input_path, output_path, text, key=key, mode=mode) for output_path, text in jobs]
+
+    def decode_payload(self, input_path, key="1"):
+        """
+        读取 payload 模式嵌入的分发 ID，返回 (ID, 置信度)；未发现可译码的载荷返回 (None, 0.0)。
+        不支持的格式直接返回 (None, 0.0)，调用方可退回人工辨认的文字水印流程。
+        """
+        return None, 0.0
+
+    def _decode_payload_array(self, img, key):
+        """依次尝试原图与中值滤波结果 (滤波压制压缩噪声，但会削弱未压缩图的信号)"""
+        engine = FrequencyWatermarker(key=key, mode="payload")
+        payload_id, conf = engine.extract_payload_array(img)
+        if payload_id is None:
+            payload_id, conf = engine.extract_payload_array(cv2.medianBlur(img, 3))
+        return payload_id, conf
+
+    def search(self, input_path, keys, output_wm_path=None, extra_widths=()):
+        """
+        多尺度、多密钥搜索提取。返回 (证据图路径, 按分数降序的 Match 列表)；
+        不支持的格式返回 ("", [])。
+        """
+        print(f"[*] Search mode is not supported for {os.path.basename(input_path)}")
+        return "", []
 
-            # 2. 生成签名包
-            sig_b64, cert_pem = sig_mgr.sign_file(file_path)
-            sig_bundle = {
-                "sig": sig_b64,
-                "cert": cert_pem
-            }
-            sig_data = json.dumps(sig_bundle).encode('utf-8')
+    def _search_array(self, img, input_path, keys, output_wm_path, extra_widths):
+        """对已解码的图像执行搜索，并将最佳候选写为证据图"""
+        matches = search_watermark(img, keys, extra_widths=extra_widths)
+        if not matches: return "", []
+        if output_wm_path is None: output_wm_path = input_path + "_wm.png"
+        if not cv2.imwrite(output_wm_path, matches[0].wm): return "", matches
+        return output_wm_path, matches
 
-            # 3. 追加到文件末尾: [原始数据] + [边界符] + [签名JSON]
+    def _file_state(self, path):
+        """判断文件是否被改写的依据：(大小, 修改时间 ns, inode)"""
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def _remember_digest(self, path, digest):
+        """记录刚写出的输出文件的 SHA-256 (写出时顺带计算)，供 attach_signature 复用"""
+        if self._digests is None:
+            self._digests = {}
+        self._digests[os.path.abspath(path)] = (self._file_state(path), digest)
+
+    def output_digest(self, path, consume=False):
+        """
+        返回处理器写出 path 时记录的摘要；未记录，或文件的大小、修改时间、inode 任一已变化
+        (写出后被改写或替换) 时返回 None。consume=True 时取出后即删除该记录 (摘要只用于一次签名)。
+        """
+        if not self._digests:
+            return None
+        key = os.path.abspath(path)
+        state, digest = (self._digests.pop(key, (None, None)) if consume
+                         else self._digests.get(key, (None, None)))
+        try:
+            return digest if state == self._file_state(path) else None
+        except OSError:
+            return None
+
+    def attach_signature(self, file_path, sig_mgr, ident_id=None, digest=None):
+        """
+        将数字签名追加到文件物理末尾: [原始数据] + [边界符] + [签名JSON] + [定长尾部]。
+        digest 为文件当前内容的 SHA-256；未给出时复用写出该文件时记录的摘要 (文件此后未被改动)，
+        否则经 mmap 顺序读一遍文件重新计算。记录的摘要用过即丢弃。
+        """
+        try:
+            digest = digest or self.output_digest(file_path, consume=True) or file_digest(file_path)
+            sig_bundle = sig_mgr.sign_bundle(digest, ident_id=ident_id)
+            offset = os.path.getsize(file_path)
             with open(file_path, "ab") as f:
-                f.write(sig_mgr.SIG_BOUNDARY)
-                f.write(sig_data)
+                f.write(sig_mgr.pack_signature(offset, sig_bundle))
             return True
         except Exception as e:
             print(f"[Debug] Failed to attach signature: {e}")
             return False
 
     def get_signature(self, file_path, sig_mgr):
-        """从文件末尾提取并验证签名"""
+        """从文件末尾定位并验证签名 (只读取尾部与一遍哈希，不整文件载入内存)"""
         try:
             with open(file_path, "rb") as f:
-                content = f.read()
-            
-            # 1. 寻找边界符
-            if sig_mgr.SIG_BOUNDARY not in content:
+                located = sig_mgr.read_signature(f)
+            if located is None:
                 return "none", None
 
-            # 2. 切分数据
-            parts = content.split(sig_mgr.SIG_BOUNDARY)
-            # 取最后一个边界符之后的数据作为签名包，边界符之前的所有数据作为原始载体
-            # 这样即使文件本身包含类似边界符的字节（极罕见），也能保证逻辑健壮
-            sig_json_bytes = parts[-1]
-            original_bytes = sig_mgr.SIG_BOUNDARY.join(parts[:-1])
-            
-            # 3. 解析并验证
-            sig_bundle = json.loads(sig_json_bytes.decode('utf-8'))
-            valid, info = sig_mgr.verify_signature(original_bytes, sig_bundle["sig"], sig_bundle["cert"])
+            offset, sig_bundle = located
+            valid, info = sig_mgr.verify_digest(file_digest(file_path, offset), sig_bundle["sig"],
+                                                sig_bundle.get("cert"), kid=sig_bundle.get("kid"),
+                                                alg=sig_bundle.get("alg"))
             return ("valid" if valid else "invalid"), info
-            
+
         except Exception as e:
             print(f"[Debug] Verify error: {e}")
             return "none", None
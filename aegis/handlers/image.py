@@ -1,51 +1,94 @@
-import os
 import cv2
 from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.tiling import TiledEmbedder, TILE_SIZES, DEFAULT_MEMORY_BUDGET
 from aegis.handlers.base import BaseHandler
 
 class ImageHandler(BaseHandler):
-    def process(self, input_path, output_path, watermark_text, key="1"):
-        """处理单张图片 - 引入 2K 标准化缩放提升平铺容量"""
+    def process(self, input_path, output_path, watermark_text, key="1", mode="text",
+                tiled=False, tile_size=TILE_SIZES[0], memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        处理单张图片 - 引入 2K 标准化缩放提升平铺容量。
+        tiled=True 时保持原始分辨率，按条带流式读写、逐块嵌入，峰值内存受 memory_budget 约束。
+        """
+        if tiled:
+            print(f"[*] Processing Image (Tiled Mode): {input_path}")
+            embedder = TiledEmbedder(FrequencyWatermarker(key=key, mode=mode), tile_size, memory_budget)
+            return embedder.embed_file(input_path, output_path, watermark_text)
+
         print(f"[*] Processing Image (High-Res Mode): {input_path}")
-        img = cv2.imread(input_path)
-        if img is None: return False
-        
-        # 统一缩放到 2000px 宽度以获得一致的平铺密度
-        target_w = 2000
-        target_h = int(img.shape[0] * (target_w / img.shape[1]))
-        img_resized = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+        img_resized = self._load_resized(input_path)
+        if img_resized is None: return False
         
-        # 临时保存缩放后的图进行嵌入
-        temp_input = f"temp_in_{os.path.basename(input_path)}"
-        cv2.imwrite(temp_input, img_resized)
+        engine = FrequencyWatermarker(key=key, mode=mode)
+        # 使用 12 的平衡强度，全程在内存中完成
+        embedded = engine.embed_array(img_resized, watermark_text, intensity=12)
+        if embedded is None: return False
         
-        engine = FrequencyWatermarker(key=key)
-        # 使用 12 的平衡强度
-        success = engine.embed(temp_input, output_path, watermark_text, intensity=12)
-        
-        if os.path.exists(temp_input): os.remove(temp_input)
-        return success
+        return cv2.imwrite(output_path, embedded)
 
-    def extract(self, input_path, output_wm_path=None, key="1"):
-        """从单张图片提取 - 同样执行 2K 采样与中值去噪"""
-        print(f"[*] Extracting from Image (High-Res Mode): {input_path}")
+    def process_variants(self, input_path, jobs, key="1", mode="text"):
+        """一次解码、缩放与频域分析，为每个 (output_path, text) 只执行水印相关的步骤"""
+        print(f"[*] Processing Image Variants (High-Res Mode): {input_path} x {len(jobs)}")
+        img_resized = self._load_resized(input_path)
+        if img_resized is None: return [False] * len(jobs)
+
+        engine = FrequencyWatermarker(key=key, mode=mode)
+        analysis = engine.analyse_array(img_resized)
+        if analysis is None: return [False] * len(jobs)
+
+        results = []
+        for output_path, text in jobs:
+            embedded = engine.embed_variant(analysis, text)
+            results.append(embedded is not None and cv2.imwrite(output_path, embedded))
+        return results
+
+    def search(self, input_path, keys, output_wm_path=None, extra_widths=()):
+        """搜索模式：不假定 2000px 画布与单一密钥，在原始解码图上枚举尺度与密钥"""
+        print(f"[*] Searching Image (Multi-Scale/Multi-Key): {input_path}")
+        img = cv2.imread(input_path, cv2.IMREAD_COLOR)
+        if img is None: return "", []
+        return self._search_array(img, input_path, keys, output_wm_path, extra_widths)
+
+    def decode_payload(self, input_path, key="1"):
+        """从 2000px 画布上直接译码 payload 模式嵌入的分发 ID"""
+        img = self._load_resized(input_path)
+        if img is None: return None, 0.0
+        return self._decode_payload_array(img, key)
+
+    def _load_resized(self, input_path):
         img = cv2.imread(input_path)
         if img is None: return None
-        
-        # 必须缩放到嵌入时相同的 2000px 宽度
+        # 统一缩放到 2000px 宽度以获得一致的平铺密度
         target_w = 2000
         target_h = int(img.shape[0] * (target_w / img.shape[1]))
-        img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+        return cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+
+    def extract(self, input_path, output_wm_path=None, key="1", tiled=False):
+        """
+        从单张图片提取 - 同样执行 2K 采样与中值去噪。
+        tiled=True 时在原分辨率的分块网格上均匀抽取至多 EXTRACT_TILES 个分块，按诱饵密钥 margin 加权融合提取
+        """
+        if tiled:
+            print(f"[*] Extracting from Image (Tiled Mode): {input_path}")
+            wm = TiledEmbedder(FrequencyWatermarker(key=key)).extract_file(input_path)
+            if wm is None: return ""
+            if output_wm_path is None: output_wm_path = input_path + "_wm.png"
+            if not cv2.imwrite(output_wm_path, wm): return ""
+            return output_wm_path
+
+        print(f"[*] Extracting from Image (High-Res Mode): {input_path}")
+        # 必须缩放到嵌入时相同的 2000px 宽度
+        img = self._load_resized(input_path)
+        if img is None: return None
         
         # 中值滤波去噪，消除图片压缩产生的椒盐噪声
         img = cv2.medianBlur(img, 3)
         
-        temp_extract_img = "temp_for_extract_img.png"
-        cv2.imwrite(temp_extract_img, img)
-        
         engine = FrequencyWatermarker(key=key)
         wm_size = engine.get_safe_wm_size(img.shape)
-        result = engine.extract(temp_extract_img, wm_size, output_wm_path=output_wm_path)
+        wm = engine.extract_array(img, wm_size)
+        if wm is None: return ""
         
-        if os.path.exists(temp_extract_img): os.remove(temp_extract_img)
-        return result
+        if output_wm_path is None: output_wm_path = input_path + "_wm.png"
+        if not cv2.imwrite(output_wm_path, wm): return ""
+        return output_wm_path
@@ -0,0 +1,297 @@
+import hashlib
+import os
+import zipfile
+import cv2
+import numpy as np
+from PIL import Image
+from aegis.core.fusion import EXTRACT_STOP_MARGIN, EvidenceFusion, best_estimate
+from aegis.core.payload import PAYLOAD_SHAPE, decode_payload as decode_bits
+from aegis.core.search import DECOY_KEY
+from aegis.core.workers import get_engine, map_tasks, threads_per_task
+from aegis.core.zipwriter import ZipStreamWriter
+from aegis.handlers.base import BaseHandler
+
+def process_media(task):
+    """
+    共享进程池的任务：为一张媒体图嵌入水印 (工作进程直接从 ZIP 读取该条目，不经主进程传递原图)。
+    单份输出直接嵌入；多收件人时只分析一次再逐个嵌入。返回 [PNG 字节 或 None, ...] (每段水印文本一个)。
+    """
+    input_path, name, texts, key, threads, mode = task
+    try:
+        with zipfile.ZipFile(input_path, 'r') as zip_ref:
+            data = zip_ref.read(name)
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None: return [None] * len(texts)
+        engine = get_engine(key, threads, mode)
+        if len(texts) == 1:
+            embedded = [engine.embed_array(img, texts[0])]
+        else:
+            analysis = engine.analyse_array(img)
+            if analysis is None: return [None] * len(texts)
+            embedded = [engine.embed_variant(analysis, text) for text in texts]
+        results = []
+        for page in embedded:
+            ok, buf = cv2.imencode(".png", page) if page is not None else (False, None)
+            results.append(buf.tobytes() if ok else None)
+        return results
+    except Exception as e:
+        print(f"[ERROR] Media processing exception {name}: {e}")
+        return [None] * len(texts)
+
+def extract_media(task):
+    """
+    共享进程池的任务：在内存中解码一张媒体图并提取水印估计 (含同一图像上的诱饵密钥基线)，
+    原图与中值滤波结果中取 margin 较大者。返回 (条目名, margin, 软判决, 诱饵软判决)，失败时后三项为 None。
+    """
+    input_path, name, key, threads, mode = task
+    try:
+        with zipfile.ZipFile(input_path, 'r') as zip_ref:
+            data = zip_ref.read(name)
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None: return name, None, None, None
+        watermarker = get_engine(key, threads, "text")
+        engine, decoy = watermarker.engine, get_engine(DECOY_KEY, threads, "text").engine
+        # 媒体图按原分辨率嵌入，文字水印尺寸与嵌入时一致
+        shape = PAYLOAD_SHAPE if mode == "payload" else watermarker.get_safe_wm_size(img.shape)
+        if engine.capacity(img.shape) < shape[0] * shape[1]:
+            return name, None, None, None
+        return (name,) + best_estimate(engine, decoy, (img, cv2.medianBlur(img, 3)), shape)
+    except Exception as e:
+        print(f"[ERROR] Media extraction exception {name}: {e}")
+        return name, None, None, None
+
+class OOXMLHandler(BaseHandler):
+    """
+    OOXML 容器 (PPTX / DOCX / XLSX) 的通用处理器：以 ZIP 流式读取 MEDIA_DIRS 下的媒体图，
+    嵌入时只替换这些条目，其余条目的压缩数据原样复制；提取时直接在内存中读取，不解压整个容器。
+    各格式的子类只需给出媒体目录与日志中的格式名。
+    """
+    MEDIA_DIRS = ('ppt/media/', 'word/media/', 'xl/media/')
+    LABEL = "OOXML"
+
+    def __init__(self, media_cache=None):
+        # 忽略小图标、缩略图，避免破坏UI (单位: 字节)
+        self.min_file_size = 50 * 1024  # 50KB
+        # 可选的持久缓存 (MediaCache)：跨次运行复用已加水印的媒体图
+        self.media_cache = media_cache
+
+    def process(self, input_path, output_path, watermark_text, key="1", mode="text"):
+        """
+        给容器内的媒体图打水印：候选媒体图分发到共享进程池并行嵌入，结果按条目顺序取回并流式改写，
+        其余条目 (XML、字体、视频等) 的压缩数据原样复制
+        """
+        print(f"[*] Processing {self.LABEL}: {input_path}")
+        return self._process(input_path, [(output_path, watermark_text)], key, mode)[0]
+
+    def process_variants(self, input_path, jobs, key="1", mode="text"):
+        """
+        多收件人版本：每张媒体图只解码、分析一次，生成全部收件人的替换图，
+        所有输出文件在同一遍改写中同步写出，替换图写出后即释放，不必整批驻留内存。
+        """
+        print(f"[*] Processing {self.LABEL} Variants: {input_path} x {len(jobs)}")
+        return self._process(input_path, jobs, key, mode)
+
+    def _process(self, input_path, jobs, key, mode):
+        texts = [text for _, text in jobs]
+        try:
+            with zipfile.ZipFile(input_path, 'r') as zip_ref:
+                digests = {info.filename: self._digest(zip_ref, info)
+                           for info in zip_ref.infolist() if self._is_target_entry(info)}
+        except zipfile.BadZipFile:
+            print(f"[Error] Not a valid {self.LABEL}/Zip file: {input_path}")
+            return [False] * len(jobs)
+        if not digests:
+            # 与原有行为一致：没有可嵌入的媒体图时原样复制，仍视为成功
+            print(f"[*] No embeddable media (>50KB) in {self.LABEL}, copying unchanged: {input_path}")
+        results = self._media_results(input_path, digests, texts, key, mode)
+        try:
+            counts = self._rewrite(input_path, [output_path for output_path, _ in jobs], results,
+                                   require_media=bool(digests))
+        except zipfile.BadZipFile:
+            print(f"[Error] Not a valid {self.LABEL}/Zip file: {input_path}")
+            return [False] * len(jobs)
+        finally:
+            results.close()
+        # 有候选媒体图却一张都没有嵌入成功的输出不含水印，视为失败 (输出文件已删除)
+        for (output_path, _), count in zip(jobs, counts):
+            if count or not digests:
+                print(f"[SUCCESS] Output saved: {output_path} ({count} media watermarked)")
+            else:
+                print(f"[ERROR] No media could be watermarked for: {output_path}")
+        return [count > 0 or not digests for count in counts]
+
+    def _digest(self, zip_ref, info):
+        """条目内容的 SHA-256 (分块读取，不整张载入内存)"""
+        h = hashlib.sha256()
+        with zip_ref.open(info) as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _media_results(self, input_path, digests, texts, key, mode):
+        """
+        按条目顺序产出每个候选媒体图的替换内容 [各水印文本的 PNG 字节 或 None, ...]。
+        内容相同的条目 (同一 Logo / 背景图以不同名称重复出现) 只嵌入一次：按首次出现的条目分发任务，
+        结果保留到该内容最后一次出现为止。启用持久缓存时，全部文本都命中的图像不再提交任务。
+        """
+        remaining = {}
+        first = {}
+        for name, digest in digests.items():
+            remaining[digest] = remaining.get(digest, 0) + 1
+            first.setdefault(digest, name)
+        done = {}
+        if self.media_cache:
+            for digest in first:
+                cached = [self.media_cache.get(digest, text, key, mode) for text in texts]
+                if all(data is not None for data in cached):
+                    done[digest] = cached
+        pending = [digest for digest in first if digest not in done]
+        print(f"    -> {len(digests)} media, {len(first)} unique, {len(first) - len(pending)} cached")
+
+        threads = threads_per_task(len(pending))
+        results = map_tasks(process_media, ((input_path, first[digest], texts, key, threads, mode) for digest in pending))
+        try:
+            for name, digest in digests.items():
+                if digest not in done:
+                    # 任务按内容首次出现的顺序提交，此处需要的必然是下一个结果
+                    done[digest] = next(results)
+                    if self.media_cache:
+                        for text, data in zip(texts, done[digest]):
+                            if data is not None:
+                                self.media_cache.put(digest, text, key, mode, data)
+                remaining[digest] -= 1
+                yield done[digest] if remaining[digest] else done.pop(digest)
+        finally:
+            results.close()
+
+    def _ranked_candidates(self, zip_ref):
+        """
+        按可能性排序的候选媒体图：内容为 PNG 却沿用 .jpg 等扩展名的条目 (本工具写回的替换图) 最先，
+        其余按像素数、文件大小从大到小 (分块越多，水印重复次数越多、信号越强)。
+        尺寸只解析图像文件头，不解码像素。
+        """
+        ranked = []
+        for info in zip_ref.infolist():
+            if not self._is_target_entry(info):
+                continue
+            try:
+                with zip_ref.open(info) as f, Image.open(f) as img:
+                    fmt, (w, h) = img.format, img.size
+            except Exception:
+                continue
+            rewritten = fmt == "PNG" and not info.filename.lower().endswith(".png")
+            ranked.append((not rewritten, -w * h, -info.file_size, info.filename))
+        return [name for *_, name in sorted(ranked)]
+
+    def _candidate_estimates(self, input_path, key, mode):
+        """
+        按排序并行提取候选媒体图，按排序逐个产出 (条目名, margin, 软判决, 诱饵软判决)。
+        调用方停止迭代即取消其余候选；文件无效或没有候选时不产出任何结果。
+        """
+        try:
+            with zipfile.ZipFile(input_path, 'r') as zip_ref:
+                names = self._ranked_candidates(zip_ref)
+        except zipfile.BadZipFile:
+            print(f"[Error] Not a valid {self.LABEL}/Zip file: {input_path}")
+            return
+        print(f"    -> Found {len(names)} candidate images (>50KB)")
+        threads = threads_per_task(len(names))
+        results = map_tasks(extract_media, ((input_path, name, key, threads, mode) for name in names))
+        try:
+            for result in results:
+                if result[1] is not None:
+                    yield result
+        finally:
+            results.close()
+
+    def extract(self, input_path, output_wm_path=None, key="1"):
+        """
+        从容器中提取水印：直接在内存中读取媒体目录下的条目，按可能性排序后并行提取，
+        某个候选相对诱饵基线的 margin 达到 EXTRACT_STOP_MARGIN 即停止；否则采用 margin 最大的候选。
+        """
+        print(f"[*] Extracting from {self.LABEL}: {input_path}")
+        best = None
+        for name, margin, soft, _ in self._candidate_estimates(input_path, key, "text"):
+            if best is None or margin > best[0]:
+                best = (margin, name, soft)
+            if margin >= EXTRACT_STOP_MARGIN:
+                break
+        if best is None:
+            print("    -> No watermark candidate found")
+            return ""
+
+        margin, name, soft = best
+        wm = np.clip(np.rint(255 * soft), 0, 255).astype(np.uint8)
+        output_wm_path = output_wm_path or os.path.basename(input_path) + "_extracted_wm.png"
+        if not cv2.imwrite(output_wm_path, wm): return ""
+        print(f"    -> Found trace in {os.path.basename(name)} (margin {margin:.3f}). Saved to: {output_wm_path}")
+        return output_wm_path
+
+    def decode_payload(self, input_path, key="1"):
+        """
+        按可能性排序并行提取候选媒体图的软判决比特，逐个加权融合后纠错译码，
+        译码成功即停止 (单张图信号不足时，多张图的证据可以合并)
+        """
+        fusion = EvidenceFusion()
+        payload_id, conf = None, 0.0
+        for _, _, soft, decoy in self._candidate_estimates(input_path, key, "payload"):
+            fusion.add(soft, decoy)
+            payload_id, conf = decode_bits(fusion.best()[0])
+            if payload_id is not None:
+                break
+        return payload_id, conf
+
+    def _is_target_image(self, filename):
+        ext = filename.lower().split('.')[-1]
+        return ext in ['png', 'jpg', 'jpeg', 'bmp', 'tiff']
+
+    def _is_target_entry(self, info):
+        """媒体目录下足够大的图片 (忽略小图标、缩略图)"""
+        return (info.filename.startswith(self.MEDIA_DIRS) and self._is_target_image(info.filename)
+                and info.file_size > self.min_file_size)
+
+    def _rewrite(self, input_path, output_paths, replacements, require_media=True):
+        """
+        流式改写 ZIP 到一个或多个输出。replacements 按条目顺序为每个候选媒体图产出
+        [各输出的新内容 (PNG 字节) 或 None, ...]，None 表示该输出保留原条目；
+        其余条目的压缩数据原样复制。替换内容本身已是压缩过的图像，以 STORED 方式写入。
+        返回每个输出替换的条目数；require_media 时一个条目都没有替换的输出不保留 (写入器 abort)。
+        """
+        with zipfile.ZipFile(input_path, 'r') as zip_ref, open(input_path, 'rb') as src:
+            writers = []
+            counts = [0] * len(output_paths)
+            try:
+                writers = [ZipStreamWriter(path) for path in output_paths]
+                for info in zip_ref.infolist():
+                    contents = next(replacements) if self._is_target_entry(info) else [None] * len(writers)
+                    if any(data is not None for data in contents):
+                        print(f"    -> Watermarking inner image: {os.path.basename(info.filename)}")
+                    for j, (writer, data) in enumerate(zip(writers, contents)):
+                        if data is None:
+                            writer.copy_entry(src, info)
+                        else:
+                            writer.write(info.filename, data, zipfile.ZIP_STORED, date_time=info.date_time)
+                            counts[j] += 1
+                for path, writer, count in zip(output_paths, writers, counts):
+                    if count or not require_media:
+                        writer.close()
+                        self._remember_digest(path, writer.digest())
+                    else:
+                        writer.abort()
+            except BaseException:
+                for writer in writers:
+                    writer.abort()
+                raise
+        return counts
+
+
+class DOCXHandler(OOXMLHandler):
+    """Word 文档：处理 word/media 下的图片"""
+    MEDIA_DIRS = ('word/media/',)
+    LABEL = "DOCX"
+
+
+class XLSXHandler(OOXMLHandler):
+    """Excel 工作簿：处理 xl/media 下的图片"""
+    MEDIA_DIRS = ('xl/media/',)
+    LABEL = "XLSX"
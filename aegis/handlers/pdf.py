@@ -1,119 +1,449 @@
 import fitz  # PyMuPDF
+import io
 import os
+import struct
 import cv2
 import numpy as np
-import uuid
-from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from PIL import Image
 from aegis.handlers.base import BaseHandler
-from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.fusion import EXTRACT_STOP_MARGIN, EvidenceFusion, best_estimate
+from aegis.core.payload import PAYLOAD_SHAPE, decode_payload as decode_bits
+from aegis.core.pdfwriter import PDFStreamWriter
+from aegis.core.search import DECOY_KEY
+from aegis.core.tiling import PNG_SIGNATURE
+from aegis.core.workers import get_engine, map_tasks, split_ranges, threads_per_task
 
-def process_single_page(page_data):
+def _pixmap_to_bgr(pix):
+    """pixmap -> 2000px 宽的 BGR 图"""
+    # 直接包装 pixmap 缓冲区，不复制样本；先缩放再换通道序 (逐通道独立，结果相同，数据量更小)
+    img = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
+    
+    target_w = 2000
+    if img.shape[1] != target_w:
+        target_h = int(img.shape[0] * (target_w / img.shape[1]))
+        img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+def _render_page(doc, page_index):
+    """渲染页面并统一缩放到 2000px 宽度 (BGR)"""
+    page = doc[page_index]
+    # 提高 DPI 以获得超采样效果
+    return _pixmap_to_bgr(page.get_pixmap(matrix=fitz.Matrix(3, 3)))
+
+def _full_page_image(page):
+    """
+    页面仅由一幅正向铺满整页的图像构成 (受保护 PDF 的版式) 时返回其 xref，否则返回 None。
+    页面上另有文字、矢量图形、旋转或蒙版时视为外来 / 重新打印的 PDF。
+    """
+    images = page.get_images(full=True)
+    if len(images) != 1 or page.rotation or images[0][1]:
+        return None
+    xref = images[0][0]
+    rects = page.get_image_rects(xref, transform=True)
+    if len(rects) != 1:
+        return None
+    rect, matrix = rects[0]
+    if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    if max(abs(a - b) for a, b in zip(rect, page.rect)) > 1:
+        return None
+    if page.get_text("text").strip() or page.get_drawings():
+        return None
+    return xref
+
+def _page_image(doc, page_index):
+    """
+    提取用的页面图 (2000px 宽, BGR)：受保护 PDF 的页面直接解码内嵌图像的原始像素，
+    省去 3 倍超采样渲染与插值；其他页面退回 _render_page
+    """
+    xref = _full_page_image(doc[page_index])
+    if xref is None:
+        return _render_page(doc, page_index)
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha or pix.n != 3:
+        # 调色板 / 灰度 / CMYK 图像统一转为 RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix, 0)
+    return _pixmap_to_bgr(pix)
+
+# 页面图像的编码方式：png 无损；jpeg / jp2 有损 (quality 1-100)；palette 为 256 色调色板 + Flate
+PAGE_CODECS = ("png", "jpeg", "jp2", "palette")
+DEFAULT_QUALITY = {"jpeg": 90, "jp2": 10}
+# JPEG 质量下限：低于此值块效应会吞掉中频系数上的水印
+JPEG_QUALITY_FLOOR = 75
+# 首页校验不达标时依次尝试的更高质量
+RETRY_QUALITIES = (85, 90, 95)
+# 首页校验的通过标准：文字水印的比特一致率，payload 模式的译码置信度
+MIN_BIT_AGREEMENT = 0.95
+MIN_PAYLOAD_CONFIDENCE = 0.5
+
+def _split_png(png):
+    """PNG 文件字节 -> (宽, 高, 位深, 颜色类型, 调色板, 拼接后的 IDAT 数据)"""
+    width, height, depth, color_type = struct.unpack('>IIBB', png[16:26])
+    plte, idat, pos = b'', [], len(PNG_SIGNATURE)
+    while pos < len(png):
+        length, ctype = struct.unpack('>I4s', png[pos:pos + 8])
+        if ctype == b'IDAT':
+            idat.append(png[pos + 8:pos + 8 + length])
+        elif ctype == b'PLTE':
+            plte = png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return width, height, depth, color_type, plte, b''.join(idat)
+
+def _compress(embedded, codec="png", quality=None):
+    """嵌入后的页面图 -> 图像文件字节 (png / jpg / jp2；palette 为调色板 PNG)，失败返回 None"""
+    if codec == "palette":
+        img = Image.fromarray(cv2.cvtColor(embedded, cv2.COLOR_BGR2RGB)).quantize(256)
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        return buf.getvalue()
+    if codec == "jpeg":
+        ok, buf = cv2.imencode(".jpg", embedded, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    elif codec == "jp2":
+        ok, buf = cv2.imencode(".jp2", embedded, [cv2.IMWRITE_JPEG2000_COMPRESSION_X1000, quality * 10])
+    else:
+        ok, buf = cv2.imencode(".png", embedded)
+    return buf.tobytes() if ok else None
+
+def _to_pdf_image(data, codec="png"):
+    """
+    图像文件字节 -> (宽, 高, 压缩图像流, 图像字典的其余键)，无法直接嵌入时返回 None。
+    JPEG / JPEG 2000 文件本身即为 DCTDecode / JPXDecode 流；PNG 取出 IDAT 数据
+    (zlib + PNG 行滤波)，作为 FlateDecode + Predictor 15 的流。主进程均无需再解码或重新压缩。
+    """
+    if codec in ("jpeg", "jp2"):
+        # 只解析文件头取尺寸
+        width, height = Image.open(io.BytesIO(data)).size
+        if codec == "jpeg":
+            return width, height, data, {"Filter": "/DCTDecode", "ColorSpace": "/DeviceRGB", "BitsPerComponent": "8"}
+        # 色彩空间与位深由 JPEG 2000 码流自身给出
+        return width, height, data, {"Filter": "/JPXDecode"}
+    width, height, depth, color_type, plte, idat = _split_png(data)
+    if color_type == 2 and depth == 8:
+        colors, colorspace = 3, "/DeviceRGB"
+    elif color_type == 3 and plte:
+        colors, colorspace = 1, f"[/Indexed /DeviceRGB {len(plte) // 3 - 1} <{plte.hex()}>]"
+    else:
+        return None
+    return width, height, idat, {
+        "Filter": "/FlateDecode", "ColorSpace": colorspace, "BitsPerComponent": str(depth),
+        "DecodeParms": f"<< /Predictor 15 /Colors {colors} /BitsPerComponent {depth} /Columns {width} >>"}
+
+def _encode_page(embedded, codec="png", quality=None):
+    """嵌入后的页面图 -> 可直接写入 PDF 的 (宽, 高, 流, 字典键)，失败返回 None"""
+    if embedded is None: return None
+    data = _compress(embedded, codec, quality)
+    return _to_pdf_image(data, codec) if data else None
+
+def _quality_ladder(codec, quality):
+    """首页校验依次尝试的质量：请求的质量 (JPEG 不低于下限)，再逐级提高"""
+    if codec not in DEFAULT_QUALITY:
+        return [None]
+    quality = quality or DEFAULT_QUALITY[codec]
+    if codec == "jpeg" and quality < JPEG_QUALITY_FLOOR:
+        print(f"[*] JPEG quality {quality} is below the floor, using {JPEG_QUALITY_FLOOR}")
+        quality = JPEG_QUALITY_FLOOR
+    return [quality] + [q for q in RETRY_QUALITIES if q > quality]
+
+def _survives(engine, embedded, text, data):
+    """把编码结果解码回来，检查水印是否仍可提取"""
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None: return False
+    if engine.mode == "payload":
+        payload_id, conf = engine.extract_payload_array(decoded)
+        return payload_id == text and conf >= MIN_PAYLOAD_CONFIDENCE
+    wm = engine.extract_array(decoded, engine.get_safe_wm_size(embedded.shape))
+    if wm is None: return False
+    return ((wm.flatten() > 128) == engine.wm_bits(text, embedded.shape)).mean() >= MIN_BIT_AGREEMENT
+
+# 输出页面按 96 DPI 换算图像尺寸 (与原先 convert_to_pdf 的页面一致)，
+# 提取时 3 倍渲染得到的像素多于 2000px 画布，水印不因页面过小而在渲染中丢失
+PAGE_DPI = 96
+
+# 每个任务的最大页数：结果按序写出，未轮到的已完成页段至多积压 map_tasks 的窗口大小，
+# 峰值内存约为 窗口 × PAGES_PER_TASK 页编码后的图像，与文档总页数无关
+PAGES_PER_TASK = 2
+
+def _write_page(writer, encoded):
+    """把 _encode_page 的图像流原样作为铺满整页的图像写出"""
+    width, height, stream, keys = encoded
+    writer.add_image_page(width, height, stream, keys, (width * 72 / PAGE_DPI, height * 72 / PAGE_DPI))
+
+def _page_count(path):
+    doc = fitz.open(path)
+    count = len(doc)
+    doc.close()
+    return count
+
+# 工作进程内缓存的已打开文档：同一输入的后续页段直接复用，不再逐页重新打开
+MAX_OPEN_DOCUMENTS = 4
+_documents = OrderedDict()
+
+def _open_document(path):
+    """按 (路径, 修改时间, 大小) 缓存 fitz 文档，文件被改写后自动重新打开"""
+    st = os.stat(path)
+    cache_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    doc = _documents.pop(cache_key, None)
+    if doc is None:
+        doc = fitz.open(path)
+    _documents[cache_key] = doc
+    while len(_documents) > MAX_OPEN_DOCUMENTS:
+        _documents.popitem(last=False)[1].close()
+    return doc
+
+def _embed_page(engine, img, texts, variants):
+    """单份输出直接嵌入；多收件人时只分析一次，再为每段水印文本生成页面"""
+    if not variants:
+        return [engine.embed_array(img, texts[0], intensity=12)]
+    analysis = engine.analyse_array(img)
+    if analysis is None:
+        return [None] * len(texts)
+    return [engine.embed_variant(analysis, text) for text in texts]
+
+def process_page_range(task):
+    """
+    共享进程池的任务：处理连续页段 [start, stop)。threads 为每个任务内引擎可用的线程数。
+    返回 [(page_index, 编码后的页面图像 或 None), ...]。
+    """
+    start, stop, pdf_path, watermark_text, key, threads, mode, codec, quality = task
+    doc = _open_document(pdf_path)
+    engine = get_engine(key, threads, mode)
+    results = []
+    for page_index in range(start, stop):
+        try:
+            # 使用平衡强度，页面全程在内存中完成嵌入
+            embedded = engine.embed_array(_render_page(doc, page_index), watermark_text, intensity=12)
+            results.append((page_index, _encode_page(embedded, codec, quality)))
+        except Exception as e:
+            print(f"[ERROR] Page processing exception {page_index}: {e}")
+            results.append((page_index, None))
+    return results
+
+def process_range_variants(task):
+    """
+    多收件人版本：页段内每页只渲染、分析一次，再为每段水印文本编码页面图像。
+    返回 [(page_index, [编码后的页面图像 或 None, ...]), ...]。
+    """
+    start, stop, pdf_path, texts, key, threads, mode, codec, quality = task
+    doc = _open_document(pdf_path)
+    engine = get_engine(key, threads, mode)
+    results = []
+    for page_index in range(start, stop):
+        try:
+            pages = _embed_page(engine, _render_page(doc, page_index), texts, True)
+            results.append((page_index, [_encode_page(page, codec, quality) for page in pages]))
+        except Exception as e:
+            print(f"[ERROR] Page variant exception {page_index}: {e}")
+            results.append((page_index, [None] * len(texts)))
+    return results
+
+def choose_page_codec(task):
+    """
+    共享进程池的任务：在首页上确定页面图像的编码。按 codec/quality 编码后解码回来，
+    检查 (第一个) 水印仍可提取；不达标时逐级提高质量，最终退回无损 PNG。
+    返回 (codec, quality, [首页各版本编码后的页面图像 或 None, ...])。
+    """
+    pdf_path, texts, key, threads, mode, codec, quality, variants = task
+    doc = _open_document(pdf_path)
+    engine = get_engine(key, threads, mode)
+    pages = _embed_page(engine, _render_page(doc, 0), texts, variants)
+    if pages[0] is not None:
+        for q in _quality_ladder(codec, quality):
+            data = _compress(pages[0], codec, q)
+            if data and _survives(engine, pages[0], texts[0], data):
+                first = _to_pdf_image(data, codec)
+                return codec, q, [first] + [_encode_page(page, codec, q) for page in pages[1:]]
+            print(f"[*] {codec}" + (f" (quality {q})" if q else "") + " does not preserve the watermark")
+        print("[*] Falling back to lossless PNG pages")
+    return "png", None, [_encode_page(page) for page in pages]
+
+def _plan_pages(input_path, texts, key, mode, codec, quality, variants):
     """
-    独立函数，用于多进程并行调用。
+    校验编码并切分页段。png 无需校验；其余编码先在首页上校验，首页结果随之返回，
+    其余页面按校验后的设置分发。返回 (codec, quality, 首页结果 或 None, 页段列表, 线程数)。
     """
-    page_index, pdf_path, watermark_text, key = page_data
+    if codec not in PAGE_CODECS:
+        raise ValueError(f"Unknown page codec: {codec}")
+    count = _page_count(input_path)
+    first, offset = None, 0
+    if codec != "png" and count:
+        task = (input_path, texts, key, threads_per_task(1), mode, codec, quality, variants)
+        codec, quality, first = next(map_tasks(choose_page_codec, [task]))
+        offset = 1
+        print(f"[*] Page codec: {codec}" + (f" (quality {quality})" if quality else ""))
+    ranges = [(start + offset, stop + offset) for start, stop in split_ranges(count - offset, max_len=PAGES_PER_TASK)]
+    return codec, quality, first, ranges, threads_per_task(len(ranges))
+
+def extract_page_range(task):
+    """
+    共享进程池的任务：提取页段 [start, stop) 每页的水印估计 (含同一图像上的诱饵密钥基线)。
+    文字水印从中值滤波后的页面提取；payload 模式的比特数固定，原图与滤波结果中取 margin 较大者。
+    返回 [(page_index, 软判决 或 None, 诱饵软判决 或 None), ...]。
+    """
+    start, stop, pdf_path, key, threads, mode = task
+    doc = _open_document(pdf_path)
+    watermarker = get_engine(key, threads, "text")
+    engine, decoy = watermarker.engine, get_engine(DECOY_KEY, threads, "text").engine
+    results = []
+    for page_index in range(start, stop):
+        try:
+            img = _page_image(doc, page_index)
+            filtered = cv2.medianBlur(img, 3)
+            if mode == "payload":
+                candidates, shape = (img, filtered), PAYLOAD_SHAPE
+            else:
+                candidates, shape = (filtered,), watermarker.get_safe_wm_size(img.shape)
+            if engine.capacity(img.shape) < shape[0] * shape[1]:
+                results.append((page_index, None, None))
+                continue
+            _, soft, base = best_estimate(engine, decoy, candidates, shape)
+            results.append((page_index, soft, base))
+        except Exception as e:
+            print(f"[ERROR] Page extraction exception {page_index}: {e}")
+            results.append((page_index, None, None))
+    return results
+
+def _fused_estimates(input_path, key, mode):
+    """
+    按页序并行提取各页的水印估计，每取回一个页段就产出累积的 EvidenceFusion。
+    调用方对结果满意时停止迭代即可，尚未开始的页段随之取消。
+    """
+    fusion = EvidenceFusion()
+    ranges = split_ranges(_page_count(input_path), max_len=PAGES_PER_TASK)
+    threads = threads_per_task(len(ranges))
+    results = map_tasks(extract_page_range, ((start, stop, input_path, key, threads, mode) for start, stop in ranges))
     try:
-        doc = fitz.open(pdf_path)
-        page = doc[page_index]
-        # 提高 DPI 以获得超采样效果
-        pix = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-        
-        img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-        
-        # 统一缩放到 2000px 宽度
-        target_w = 2000
-        target_h = int(img.shape[0] * (target_w / img.shape[1]))
-        img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
-        
-        unique_id = uuid.uuid4().hex
-        temp_page_img = f"temp_page_{page_index}_{unique_id}.png"
-        temp_protected_img = f"temp_prot_{page_index}_{unique_id}.png"
-        cv2.imwrite(temp_page_img, img)
-        
-        engine = FrequencyWatermarker(key=key)
-        # 使用平衡强度
-        success = engine.embed(temp_page_img, temp_protected_img, watermark_text, intensity=12)
-        
-        pdf_bytes = None
-        if success:
-            img_doc = fitz.open(temp_protected_img)
-            pdf_bytes = img_doc.convert_to_pdf()
-            img_doc.close()
-            
-        if os.path.exists(temp_page_img): os.remove(temp_page_img)
-        if os.path.exists(temp_protected_img): os.remove(temp_protected_img)
-        doc.close()
-        
-        return page_index, pdf_bytes
-    except Exception as e:
-        print(f"[ERROR] Page processing exception {page_index}: {e}")
-        return page_index, None
+        for chunk in results:
+            for _, soft, decoy in chunk:
+                if soft is not None:
+                    fusion.add(soft, decoy)
+            if len(fusion):
+                yield fusion
+    finally:
+        results.close()
 
 class PDFHandler(BaseHandler):
-    def process(self, input_path, output_path, watermark_text, key="1"):
+    def process(self, input_path, output_path, watermark_text, key="1", mode="text", codec="png", quality=None):
         """
-        并行处理 PDF: 利用多进程加速页面渲染与水印嵌入
+        并行处理 PDF: 页面按连续页段分发到共享的常驻进程池，加速页面渲染与水印嵌入。
+        页段按页序取回后立即流式写入输出文件，内存不随页数增长。
+        codec 为页面图像的编码 (见 PAGE_CODECS)，quality 为有损编码的质量 (1-100)，
+        有损编码先在首页上校验水印仍可提取，不达标时自动提高质量或退回 PNG。
         """
         print(f"[*] Processing PDF (High-Res Mode): {input_path}")
+        writer = None
         try:
-            doc = fitz.open(input_path)
-            num_pages = len(doc)
-            doc.close()
-            
-            tasks = [(i, input_path, watermark_text, key) for i in range(num_pages)]
-            
-            results = []
-            with ProcessPoolExecutor() as executor:
-                results = list(executor.map(process_single_page, tasks))
-            
-            results.sort(key=lambda x: x[0])
+            codec, quality, first, ranges, threads = _plan_pages(
+                input_path, [watermark_text], key, mode, codec, quality, False)
+            tasks = ((start, stop, input_path, watermark_text, key, threads, mode, codec, quality)
+                     for start, stop in ranges)
             
-            output_doc = fitz.open()
-            for _, pdf_bytes in results:
-                if pdf_bytes:
-                    img_pdf = fitz.open("pdf", pdf_bytes)
-                    output_doc.insert_pdf(img_pdf)
-                    img_pdf.close()
+            writer = PDFStreamWriter(output_path)
+            if first and first[0]:
+                _write_page(writer, first[0])
+            for chunk in map_tasks(process_page_range, tasks):
+                for _, encoded in chunk:
+                    if encoded:
+                        _write_page(writer, encoded)
             
-            output_doc.save(output_path)
-            output_doc.close()
+            if not len(writer):
+                raise ValueError("no page could be processed")
+            writer.close()
+            self._remember_digest(output_path, writer.digest())
             return True
         except Exception as e:
             print(f"[ERROR] PDF processing exception: {e}")
+            if writer: writer.abort()
             return False
 
-    def extract(self, input_path, output_wm_path=None, key="1"):
+    def process_variants(self, input_path, jobs, key="1", mode="text", codec="png", quality=None):
         """
-        从 PDF 提取: 2000px 采样 + 中值滤波去噪
+        多收件人并行处理：按页分发，每页分析一次后生成全部收件人的页面，
+        结果按页序流式写入各自的输出文件。codec / quality 同 process，以第一个收件人的首页校验。
         """
-        print(f"[*] Extracting from PDF (High-Res Mode): {input_path}")
+        print(f"[*] Processing PDF Variants (High-Res Mode): {input_path} x {len(jobs)}")
+        texts = [text for _, text in jobs]
+        writers = []
+        ok = [True] * len(jobs)
+        
+        def write(pages):
+            for j, encoded in enumerate(pages):
+                if encoded is None:
+                    ok[j] = False
+                elif ok[j]:
+                    _write_page(writers[j], encoded)
+        
         try:
-            doc = fitz.open(input_path)
-            if len(doc) == 0: return None
+            codec, quality, first, ranges, threads = _plan_pages(
+                input_path, texts, key, mode, codec, quality, True)
+            tasks = ((start, stop, input_path, texts, key, threads, mode, codec, quality) for start, stop in ranges)
             
-            page = doc[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-            img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+            writers = [PDFStreamWriter(output_path) for output_path, _ in jobs]
+            if first: write(first)
+            for chunk in map_tasks(process_range_variants, tasks):
+                for _, pages in chunk:
+                    write(pages)
             
-            target_w = 2000
-            target_h = int(img.shape[0] * (target_w / img.shape[1]))
-            img = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_AREA)
-            
-            # 使用中值滤波去除 DCT 带来的块状噪声 (椒盐噪声)
-            img = cv2.medianBlur(img, 3)
-            
-            temp_extract_img = "temp_for_extract.png"
-            cv2.imwrite(temp_extract_img, img)
-            
-            engine = FrequencyWatermarker(key=key)
-            wm_size = engine.get_safe_wm_size(img.shape)
-            result = engine.extract(temp_extract_img, wm_size, output_wm_path=output_wm_path)
-            
-            if os.path.exists(temp_extract_img): os.remove(temp_extract_img)
+            for j, writer in enumerate(writers):
+                if ok[j] and len(writer):
+                    writer.close()
+                    self._remember_digest(jobs[j][0], writer.digest())
+                else:
+                    ok[j] = False
+                    writer.abort()
+            return ok
+        except Exception as e:
+            print(f"[ERROR] PDF variant processing exception: {e}")
+            for writer in writers: writer.abort()
+            return [False] * len(jobs)
+
+    def search(self, input_path, keys, output_wm_path=None, extra_widths=()):
+        """搜索模式：对首页渲染图枚举尺度与密钥"""
+        print(f"[*] Searching PDF (Multi-Scale/Multi-Key): {input_path}")
+        try:
+            doc = fitz.open(input_path)
+            if len(doc) == 0: return "", []
+            img = _page_image(doc, 0)
             doc.close()
-            return result
+        except Exception as e:
+            print(f"[ERROR] PDF search exception: {e}")
+            return "", []
+        return self._search_array(img, input_path, keys, output_wm_path, extra_widths)
+
+    def decode_payload(self, input_path, key="1"):
+        """
+        译码 payload 模式嵌入的分发 ID：并行提取各页的软判决比特，加权平均后纠错译码，
+        融合结果译码成功即停止。首页缺失、被替换或损坏时由其余页面补足。
+        """
+        payload_id, conf = None, 0.0
+        try:
+            for fusion in _fused_estimates(input_path, key, "payload"):
+                payload_id, conf = decode_bits(fusion.best()[0])
+                if payload_id is not None:
+                    break
+        except Exception as e:
+            print(f"[ERROR] PDF payload decoding exception: {e}")
+            return None, 0.0
+        return payload_id, conf
+
+    def extract(self, input_path, output_wm_path=None, key="1"):
+        """
+        从 PDF 提取: 各页 2000px 采样 + 中值滤波去噪后并行提取，按与诱饵基线的差距加权平均融合，
+        融合结果足够明确 (EXTRACT_STOP_MARGIN) 即停止，不必处理全部页面
+        """
+        print(f"[*] Extracting from PDF (High-Res Mode): {input_path}")
+        try:
+            soft, margin, count = None, 0.0, 0
+            for fusion in _fused_estimates(input_path, key, "text"):
+                soft, margin, count = fusion.best()
+                if margin >= EXTRACT_STOP_MARGIN:
+                    break
+            if soft is None: return None
+            print(f"[*] Fused {count} page(s), margin {margin:.3f}")
+            
+            wm = np.clip(np.rint(255 * soft), 0, 255).astype(np.uint8)
+            if output_wm_path is None: output_wm_path = input_path + "_wm.png"
+            return output_wm_path if cv2.imwrite(output_wm_path, wm) else ""
         except Exception as e:
             print(f"[ERROR] PDF extraction exception: {e}")
             return None
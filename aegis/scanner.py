@@ -0,0 +1,119 @@
+import os
+import sys
+import tempfile
+import cv2
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from aegis.core.engine import THREADS_ENV, default_workers
+from aegis.core.matching import TemplateStack, is_confident
+from aegis.core.sniffer import sniff_file_type
+from aegis.core.workers import init_worker
+from aegis.handlers.image import ImageHandler
+from aegis.handlers.pdf import PDFHandler
+from aegis.handlers.ooxml import OOXMLHandler, DOCXHandler, XLSXHandler
+from aegis.handlers.ppt import PPTHandler
+
+HANDLERS = {'image': ImageHandler, 'pdf': PDFHandler, 'ppt': PPTHandler,
+            'docx': DOCXHandler, 'xlsx': XLSXHandler, 'ooxml': OOXMLHandler}
+# 每个工作进程最多积压的任务数：发现与处理同步推进，内存不随文件总数增长
+PENDING_PER_WORKER = 2
+
+
+def iter_files(root):
+    """递归遍历目录 (边遍历边产出，不预先列出全部文件)；跳过隐藏文件与符号链接目录"""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            print(f"[Debug] Cannot scan directory: {e}")
+
+
+_stack = None
+
+
+def _init_worker(template_dir=None):
+    # 文件之间已经并行，进程内引擎单线程，避免过度订阅；处理器的逐文件日志不再输出
+    global _stack
+    init_worker()
+    os.environ[THREADS_ENV] = "1"
+    sys.stdout = open(os.devnull, 'w')
+    # 模板缓存由主进程同步，工作进程只读 (memmap 共享页缓存)
+    if template_dir:
+        _stack = TemplateStack(template_dir)
+
+
+def _match_text(handler, path, keys, result):
+    """没有机读载荷时提取文字水印，与模板缓存做相关匹配，采用最明确的一个结果"""
+    fd, wm_path = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        for index, key in enumerate(keys):
+            out = handler.extract(path, output_wm_path=wm_path, key=key)
+            wm = cv2.imread(wm_path, cv2.IMREAD_GRAYSCALE) if out else None
+            if wm is None: continue
+            matches = _stack.match(wm, top_k=2)
+            if is_confident(matches) and matches[0][1] > result["confidence"]:
+                result.update(status="template", method="template", row_id=matches[0][0],
+                              key_index=index, confidence=matches[0][1])
+    finally:
+        os.remove(wm_path)
+
+
+def scan_file(task):
+    """
+    工作进程：嗅探格式并按顺序用每个密钥尝试译码机读载荷；均失败时退回文字水印的模板匹配。
+    返回 {path, type, status, method, id, key_index, confidence[, row_id, error]}，status 为
+    'decoded' (载荷) / 'template' (模板匹配，row_id 为数据库行号) / 'no_payload' / 'skipped' / 'error'。
+    """
+    path, keys = task
+    result = {"path": path, "type": sniff_file_type(path), "status": "skipped", "method": None,
+              "id": None, "key_index": None, "confidence": 0.0}
+    handler_cls = HANDLERS.get(result["type"])
+    if handler_cls is None:
+        return result
+    try:
+        handler = handler_cls()
+        result["status"] = "no_payload"
+        for index, key in enumerate(keys):
+            payload_id, conf = handler.decode_payload(path, key=key)
+            if payload_id:
+                result.update(status="decoded", method="payload", id=payload_id, key_index=index, confidence=conf)
+                break
+        if result["status"] == "no_payload" and _stack is not None and len(_stack):
+            _match_text(handler, path, keys, result)
+    except Exception as e:
+        result.update(status="error", error=str(e))
+    return result
+
+
+def scan_directory(root, keys, workers=None, template_dir=None):
+    """
+    并行扫描目录下的全部文件，按完成顺序逐个产出 scan_file 的结果。
+    在途任务数受 PENDING_PER_WORKER 限制，遍历器只在有空位时才继续发现文件。
+    template_dir 为已同步的模板缓存目录，为 None 时不做文字水印匹配。
+    """
+    keys = list(dict.fromkeys(str(k) for k in keys))
+    workers = workers or default_workers()
+    files = iter_files(root)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template_dir,)) as pool:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < workers * PENDING_PER_WORKER:
+                path = next(files, None)
+                if path is None:
+                    exhausted = True
+                else:
+                    pending.add(pool.submit(scan_file, (path, keys)))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
@@ -14,7 +14,6 @@ setup(
     url='https://github.com/LING71671/Aegis-Watermark',
     packages=find_packages(),
     install_requires=[
-        'blind-watermark',
         'opencv-python',
         'numpy<2.0.0',
         'click',
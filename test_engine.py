@@ -0,0 +1,111 @@
+import unittest
+import cv2
+import numpy as np
+from aegis.core.engine import BlockEngine
+from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.search import search_watermark
+
+try:
+    import blind_watermark
+    from blind_watermark import WaterMark
+    blind_watermark.bw_notes.close()
+except ImportError:
+    WaterMark = None
+
+
+def make_host(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur((rng.random((h, w, 3)) * 255).astype(np.uint8), (5, 5), 0)
+
+
+class TestBlockEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = FrequencyWatermarker(key="unit-test")
+        self.img = make_host(360, 480)
+        self.wm_size = self.engine.get_safe_wm_size(self.img.shape)
+        self.wm = self.engine.generate_wm_array("ID: 1234ABCD", self.wm_size)
+
+    def test_round_trip(self):
+        embedded = self.engine.embed_array_with_wm(self.img, self.wm)
+        extracted = self.engine.extract_array(embedded, self.wm_size)
+        accuracy = ((extracted > 128) == (self.wm > 128)).mean()
+        self.assertGreater(accuracy, 0.99)
+
+    @unittest.skipIf(WaterMark is None, "blind_watermark not installed")
+    def test_compatible_with_blind_watermark(self):
+        bits = self.wm.flatten() > 128
+        # 旧版产出的文件可被新引擎提取
+        bwm = WaterMark(password_wm=self.engine.pwd_wm, password_img=self.engine.pwd_img, block_shape=(8, 8))
+        bwm.read_img(img=self.img)
+        bwm.read_wm(bits, mode='bit')
+        legacy = np.clip(np.rint(bwm.embed()), 0, 255).astype(np.uint8)
+        legacy_wm = self.engine.extract_array(legacy, self.wm_size)
+        self.assertGreater(((legacy_wm > 128) == (self.wm > 128)).mean(), 0.99)
+
+        # 新引擎产出的文件可被旧版提取
+        embedded = self.engine.embed_array_with_wm(self.img, self.wm)
+        bwm = WaterMark(password_wm=self.engine.pwd_wm, password_img=self.engine.pwd_img)
+        bwm.wm_size = int(np.prod(self.wm_size))
+        wm_avg = bwm.extract_decrypt(bwm.bwm_core.extract(img=embedded, wm_shape=self.wm_size))
+        self.assertGreater(((wm_avg > 0.5) == bits).mean(), 0.99)
+
+    def test_threaded_matches_serial(self):
+        bits = self.wm.flatten() > 128
+        serial = BlockEngine(self.engine.pwd_wm, self.engine.pwd_img, workers=1)
+        threaded = BlockEngine(self.engine.pwd_wm, self.engine.pwd_img, workers=4)
+        embedded = serial.embed(self.img, bits)
+        self.assertTrue((threaded.embed(self.img, bits) == embedded).all())
+        self.assertTrue((threaded.extract(embedded, self.wm_size) == serial.extract(embedded, self.wm_size)).all())
+
+    def test_variants_match_embed(self):
+        # 不透明宿主与半透明 Alpha 宿主 (BGRA) 都应与逐个嵌入的结果一致
+        translucent = cv2.merge([self.img, np.full(self.img.shape[:2], 128, dtype=np.uint8)])
+        for host in (self.img, translucent):
+            analysis = self.engine.analyse_array(host)
+            for text in ("ID: 1234ABCD", "ID: 5678EFGH"):
+                wm = self.engine.generate_wm_array(text, self.wm_size)
+                variant = self.engine.embed_variant(analysis, text)
+                direct = self.engine.embed_array_with_wm(host, wm)
+                self.assertEqual(variant.shape, host.shape)
+                self.assertLessEqual(np.abs(variant.astype(int) - direct).max(), 1)
+                extracted = self.engine.extract_array(variant[:, :, :3], self.wm_size)
+                self.assertGreater(((extracted > 128) == (wm > 128)).mean(), 0.99)
+
+    def test_search_finds_key_and_scale(self):
+        # 原分辨率 (480px 宽) 嵌入后被缩小的泄露图
+        embedded = self.engine.embed_array_with_wm(self.img, self.wm)
+        leak = cv2.resize(embedded, (400, 300), interpolation=cv2.INTER_AREA)
+        matches = search_watermark(leak, ["other", "unit-test"], extra_widths=[480])
+        best = matches[0]
+        self.assertEqual((best.key, best.width), ("unit-test", 480))
+        self.assertGreater(((best.wm > 128) == (self.wm > 128)).mean(), 0.9)
+
+    def test_payload_round_trip(self):
+        engine = FrequencyWatermarker(key="unit-test", mode="payload")
+        embedded = engine.embed_array(self.img, "1234ABCD")
+        ok, buf = cv2.imencode(".jpg", embedded, [cv2.IMWRITE_JPEG_QUALITY, 75])
+        leak = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        payload_id, conf = engine.extract_payload_array(leak)
+        self.assertEqual(payload_id, "1234ABCD")
+        self.assertGreater(conf, 0.2)
+        # 错误密钥得到的是噪声，不应被译成任何 ID
+        self.assertIsNone(FrequencyWatermarker(key="other", mode="payload").extract_payload_array(leak)[0])
+
+    def test_translucent_alpha_host(self):
+        # 半透明 Alpha (PPTX 中的 Logo 等) 原样保留，颜色通道照常嵌入
+        host = cv2.merge([self.img, np.full(self.img.shape[:2], 128, dtype=np.uint8)])
+        embedded = self.engine.embed_array_with_wm(host, self.wm)
+        self.assertIsNotNone(embedded)
+        self.assertEqual((embedded.shape, embedded.dtype), (host.shape, np.uint8))
+        self.assertTrue((embedded[:, :, 3] == 128).all())
+        extracted = self.engine.extract_array(embedded[:, :, :3], self.wm_size)
+        self.assertGreater(((extracted > 128) == (self.wm > 128)).mean(), 0.95)
+
+    def test_capacity_overflow(self):
+        engine = BlockEngine(1, 1)
+        with self.assertRaises(IndexError):
+            engine.embed(make_host(32, 32), np.ones(64 * 64, dtype=bool))
+
+
+if __name__ == '__main__':
+    unittest.main()
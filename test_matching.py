@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from aegis.core.database import TrackingDB
+from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.matching import TemplateStack, fold_index, is_confident
+from aegis.core.render import render_tiled_wm, render_wm_line
+from test_engine import make_host
+
+
+class TestTemplateMatching(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = TrackingDB(os.path.join(self.tmp, "tracking.db"))
+
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp)
+
+    def test_fold_reproduces_tiling(self):
+        for text in ("ID: 3F9A01BC", "xyj ID: A"):
+            line, bbox = render_wm_line(text)
+            for size in ((248, 248), (97, 61)):
+                tiled = render_tiled_wm(text, size) > 0
+                valid, lin = fold_index(tiled.shape, bbox, line.shape, line.shape[1])
+                folded = np.zeros_like(tiled)
+                folded[lin >= 0] = line.ravel()[lin[lin >= 0]]
+                self.assertFalse(((folded != tiled) & valid).any(), (text, size))
+
+    def test_stack_ranks_recipient(self):
+        rng = np.random.default_rng(0)
+        for i in range(300):
+            self.db.log_distribution("doc.png", f"r{i}@example.com", "%08X" % rng.integers(0, 2 ** 32), "k", template="ID: {}")
+        victim = self.db.log_distribution("doc.png", "victim@example.com", "3F9A01BC", "k", template="ID: {}")
+        self.db.log_distribution("doc.png", "bits@example.com", "00C0FFEE", "k")
+
+        stack = TemplateStack(os.path.join(self.tmp, "templates"))
+        self.assertEqual(stack.sync(self.db), 301)
+        # 再次打开即为增量同步，不重复渲染
+        self.assertEqual(TemplateStack(stack.root).sync(self.db), 301)
+
+        engine = FrequencyWatermarker(key="k")
+        embedded = engine.embed_array(make_host(700, 500, seed=2), "ID: 3F9A01BC")
+        wm = engine.extract_array(embedded, engine.get_safe_wm_size(embedded.shape))
+        matches = stack.match(wm)
+        self.assertEqual(matches[0][0], victim)
+        self.assertTrue(is_confident(matches))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import cv2
+from aegis.core.sniffer import sniff_file_type
+from aegis.handlers.ooxml import DOCXHandler
+from test_engine import make_host
+
+CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8"?>'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="xlsx" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"/>'
+                 '<Override PartName="{part}" ContentType="{main}"/></Types>')
+
+
+class TestOOXML(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _package(self, name, part, main, media=()):
+        path = os.path.join(self.tmp, name)
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("[Content_Types].xml", CONTENT_TYPES.format(part=part, main=main))
+            for entry, data in media:
+                z.writestr(entry, data)
+        return path
+
+    def test_sniff_by_main_part(self):
+        office = "application/vnd.openxmlformats-officedocument."
+        cases = [("a.zip", "/ppt/presentation.xml", office + "presentationml.presentation.main+xml", "ppt"),
+                 ("b.zip", "/word/document.xml", office + "wordprocessingml.document.main+xml", "docx"),
+                 ("c.zip", "/xl/workbook.xml", "application/vnd.ms-excel.sheet.macroEnabled.main+xml", "xlsx"),
+                 ("d.zip", "/custom.xml", "application/xml", "ooxml")]
+        for name, part, main, expected in cases:
+            self.assertEqual(sniff_file_type(self._package(name, part, main)), expected)
+        plain = os.path.join(self.tmp, "plain.zip")
+        with zipfile.ZipFile(plain, "w") as z:
+            z.writestr("readme.txt", "hello")
+        self.assertEqual(sniff_file_type(plain), "unknown")
+
+    def test_docx_media_roundtrip(self):
+        ok, png = cv2.imencode(".png", make_host(600, 800, seed=7))
+        src = self._package("doc.docx", "/word/document.xml",
+                            "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+                            [("word/document.xml", "<w:document/>"), ("word/media/image1.png", png.tobytes())])
+        out = os.path.join(self.tmp, "out.docx")
+        handler = DOCXHandler()
+        self.assertTrue(handler.process(src, out, "CD34EF56", key="k", mode="payload"))
+        with zipfile.ZipFile(out) as z:
+            self.assertNotEqual(z.read("word/media/image1.png"), png.tobytes())
+            self.assertEqual(z.read("word/document.xml"), b"<w:document/>")
+        self.assertEqual(sniff_file_type(out), "docx")
+        self.assertEqual(handler.decode_payload(out, key="k")[0], "CD34EF56")
+
+    def test_docx_without_media_is_copied(self):
+        # 没有可嵌入的媒体图时与原有行为一致：成功，输出为原样复制
+        src = self._package("text.docx", "/word/document.xml",
+                            "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+                            [("word/document.xml", "<w:document/>"), ("word/media/small.png", b"x" * 100)])
+        out = os.path.join(self.tmp, "out.docx")
+        self.assertTrue(DOCXHandler().process(src, out, "ID: 1", key="k"))
+        with zipfile.ZipFile(src) as a, zipfile.ZipFile(out) as b:
+            self.assertEqual(a.namelist(), b.namelist())
+            for name in a.namelist():
+                self.assertEqual(a.read(name), b.read(name))
+        self.assertEqual(sniff_file_type(out), "docx")
+
+
+if __name__ == '__main__':
+    unittest.main()
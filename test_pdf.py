@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cv2
+import fitz
+from aegis.handlers.pdf import PDFHandler
+from test_engine import make_host
+
+
+class TestPDFHandler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src.pdf")
+        doc = fitz.open()
+        for seed in (3, 4):
+            ok, png = cv2.imencode(".png", make_host(600, 800, seed=seed))
+            page = doc.new_page(width=600, height=450)
+            page.insert_image(page.rect, stream=png.tobytes())
+        doc.save(self.src)
+        doc.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_jpeg_pages_keep_payload(self):
+        out = os.path.join(self.tmp, "out.pdf")
+        handler = PDFHandler()
+        self.assertTrue(handler.process(self.src, out, "AB12CD34", key="k", mode="payload", codec="jpeg"))
+        doc = fitz.open(out)
+        xref = doc[0].get_images()[0][0]
+        self.assertEqual(doc.xref_get_key(xref, "Filter"), ("name", "/DCTDecode"))
+        doc.close()
+        self.assertEqual(handler.decode_payload(out, key="k")[0], "AB12CD34")
+
+    def test_payload_survives_replaced_first_page(self):
+        out = os.path.join(self.tmp, "out.pdf")
+        handler = PDFHandler()
+        self.assertTrue(handler.process(self.src, out, "AB12CD34", key="k", mode="payload"))
+        # 泄露件的首页被换成未加水印的原页，其余页面仍能给出 ID
+        leak = fitz.open(self.src)
+        leak.delete_page(1)
+        leak.insert_pdf(fitz.open(out), from_page=1)
+        leak_path = os.path.join(self.tmp, "leak.pdf")
+        leak.save(leak_path)
+        self.assertEqual(handler.decode_payload(leak_path, key="k")[0], "AB12CD34")
+        self.assertIsNone(handler.decode_payload(self.src, key="k")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import cv2
+from aegis.core.frequency import FrequencyWatermarker
+from aegis.core.mediacache import MediaCache
+from aegis.handlers.ppt import PPTHandler
+from test_engine import make_host
+
+
+class TestPPTHandler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "deck.pptx")
+        ok, png = cv2.imencode(".png", make_host(600, 800, seed=5))
+        with zipfile.ZipFile(self.src, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("[Content_Types].xml", "<Types/>")
+            z.writestr("ppt/media/image1.png", png.tobytes())
+            z.writestr("ppt/media/image2.png", png.tobytes())
+            z.writestr("ppt/media/media1.mp4", os.urandom(256 * 1024), compress_type=zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _raw(self, path, name):
+        with zipfile.ZipFile(path) as z, open(path, "rb") as f:
+            info = z.getinfo(name)
+            f.seek(info.header_offset + 26)
+            skip = int.from_bytes(f.read(2), "little") + int.from_bytes(f.read(2), "little")
+            f.seek(skip, 1)
+            return info.compress_type, f.read(info.compress_size)
+
+    def test_rewrite_copies_untouched_entries(self):
+        out = os.path.join(self.tmp, "out.pptx")
+        handler = PPTHandler()
+        self.assertTrue(handler.process(self.src, out, "AB12CD34", key="k", mode="payload"))
+        with zipfile.ZipFile(out) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.namelist(), zipfile.ZipFile(self.src).namelist())
+        for name in ("[Content_Types].xml", "ppt/media/media1.mp4"):
+            self.assertEqual(self._raw(out, name), self._raw(self.src, name))
+        self.assertEqual(handler.decode_payload(out, key="k")[0], "AB12CD34")
+
+    def test_duplicate_media_share_one_embedding(self):
+        cache = MediaCache(os.path.join(self.tmp, "cache"))
+        outs = [os.path.join(self.tmp, f"out{i}.pptx") for i in range(2)]
+        for out in outs:
+            self.assertTrue(PPTHandler(media_cache=cache).process(self.src, out, "ID: AB12", key="k"))
+        # 同一内容只存一份缓存，重复条目与再次运行得到相同的结果
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(cache.root)), 1)
+        first, second = (zipfile.ZipFile(out) for out in outs)
+        self.assertEqual(first.read("ppt/media/image1.png"), first.read("ppt/media/image2.png"))
+        self.assertEqual(first.read("ppt/media/image1.png"), second.read("ppt/media/image1.png"))
+
+    def test_extract_prefers_embedded_media(self):
+        out = os.path.join(self.tmp, "out.pptx")
+        self.assertTrue(PPTHandler().process(self.src, out, "ID: AB12", key="k"))
+        # 追加一张更大的未加水印图像：加水印的条目仍应胜出
+        ok, jpg = cv2.imencode(".jpg", make_host(900, 1200, seed=9))
+        with zipfile.ZipFile(out, "a") as z:
+            z.writestr("ppt/media/image3.jpg", jpg.tobytes())
+        wm_path = PPTHandler().extract(out, os.path.join(self.tmp, "wm.png"), key="k")
+        wm = cv2.imread(wm_path, cv2.IMREAD_GRAYSCALE)
+        expected = FrequencyWatermarker(key="k").generate_wm_array("ID: AB12", wm.shape)
+        self.assertGreater(((wm > 128) == (expected > 128)).mean(), 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
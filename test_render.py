@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from aegis.core import render
+from aegis.core.render import render_tiled_wm, render_wm_line
+
+
+def reference_tiled_wm(text, size):
+    """逐格调用 draw.text 的原始平铺渲染，作为缓存 / 图集路径的对照"""
+    img = Image.new('1', size, 0)
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default()
+    except:
+        font = None
+    bbox = draw.textbbox((0, 0), text, font=font)
+    tw, th = bbox[2] - bbox[0], bbox[3] - bbox[1]
+    step_x = tw + 25
+    step_y = th + 25
+    for y in range(0, size[1], step_y):
+        for x in range(0, size[0], step_x):
+            shift = (y // step_y % 2) * (step_x // 2)
+            draw.text(((x + shift) % size[0], y), text, font=font, fill=1)
+    return np.array(img, dtype=np.uint8) * 255
+
+
+class TestRender(unittest.TestCase):
+    TEXTS = ("ID: 1234ABCD", "ID: 5678EFGH", "Confidential - xyz", "")
+    SIZES = ((64, 64), (128, 96), (300, 200))
+
+    def setUp(self):
+        render.wm_cache.clear()
+
+    def test_tiled_matches_pil(self):
+        for text in self.TEXTS:
+            for size in self.SIZES:
+                expected = reference_tiled_wm(text, size)
+                # 首次渲染与缓存命中都必须与 PIL 逐格绘制逐像素一致
+                for _ in range(2):
+                    np.testing.assert_array_equal(render_tiled_wm(text, size), expected, err_msg=f"{text!r} {size}")
+
+    def test_atlas_line_matches_pil(self):
+        if render._atlas is None:
+            self.skipTest("default font is not a FreeType font")
+        composed = 0
+        for text in self.TEXTS[:3]:
+            bbox = render._font.getbbox(text, mode='1')
+            line = render._atlas.compose(text, bbox)
+            if line is None:
+                continue
+            composed += 1
+            np.testing.assert_array_equal(line, render._render_line(text, bbox), err_msg=repr(text))
+            np.testing.assert_array_equal(render_wm_line(text)[0], line)
+        # 至少有一行真正走了图集拼接路径
+        self.assertGreater(composed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
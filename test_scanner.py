@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cv2
+from aegis.handlers.image import ImageHandler
+from aegis.scanner import iter_files, scan_directory
+from test_engine import make_host
+
+
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        host = os.path.join(self.tmp, "host.png")
+        cv2.imwrite(host, make_host(600, 800, seed=7))
+        os.makedirs(os.path.join(self.tmp, "leaks", "nested"))
+        handler = ImageHandler()
+        handler.process(host, os.path.join(self.tmp, "leaks", "a.png"), "AB12CD34", key="k", mode="payload")
+        handler.process(host, os.path.join(self.tmp, "leaks", "nested", "b.png"), "ID: AB12CD34", key="k")
+        with open(os.path.join(self.tmp, "leaks", "notes.txt"), "w") as f:
+            f.write("not a document")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_scan_directory(self):
+        root = os.path.join(self.tmp, "leaks")
+        self.assertEqual(len(list(iter_files(root))), 3)
+        results = {os.path.basename(r["path"]): r for r in scan_directory(root, ["other", "k"], workers=2)}
+        self.assertEqual(results["a.png"]["status"], "decoded")
+        self.assertEqual((results["a.png"]["id"], results["a.png"]["key_index"]), ("AB12CD34", 1))
+        self.assertEqual(results["b.png"]["status"], "no_payload")
+        self.assertEqual(results["notes.txt"]["status"], "skipped")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from aegis.core.hashing import file_digest
+from aegis.core.keyring import key_id
+from aegis.core.signature import SIG_ALGORITHMS, SignatureManager
+from aegis.handlers.base import BaseHandler
+
+
+class TestSignatureTrailer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.keys_dir = tempfile.mkdtemp()
+        cls.sig_mgr = SignatureManager(keys_dir=cls.keys_dir)
+        cls.sig_mgr.create_identity("Test", "test@test.com")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.keys_dir)
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            # 内容中夹带边界符，定位不能依赖查找边界符
+            f.write(os.urandom(4096) + SignatureManager.SIG_BOUNDARY + os.urandom(4096))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_trailer_roundtrip_and_tamper(self):
+        handler = BaseHandler()
+        self.assertTrue(handler.attach_signature(self.path, self.sig_mgr))
+        status, info = handler.get_signature(self.path, self.sig_mgr)
+        self.assertEqual(status, "valid")
+        self.assertEqual(info["email"], "test@test.com")
+
+        with open(self.path, "r+b") as f:
+            f.seek(100)
+            byte = f.read(1)
+            f.seek(100)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        self.assertEqual(handler.get_signature(self.path, self.sig_mgr)[0], "invalid")
+
+    def test_stale_recorded_digest_is_not_signed(self):
+        handler = BaseHandler()
+        handler._remember_digest(self.path, file_digest(self.path))
+        # 写出后被同尺寸内容改写：记录的摘要已失效，必须重新计算
+        st = os.stat(self.path)
+        with open(self.path, "r+b") as f:
+            f.write(os.urandom(16))
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(handler.output_digest(self.path))
+        self.assertTrue(handler.attach_signature(self.path, self.sig_mgr))
+        self.assertEqual(handler.get_signature(self.path, self.sig_mgr)[0], "valid")
+
+    def test_legacy_signature_still_verifies(self):
+        # 旧格式: [原始数据] + [边界符] + [签名JSON]，没有定长尾部
+        with open(self.path, "rb") as f:
+            original = f.read()
+        sig_b64, cert_pem = self.sig_mgr.sign_digest(file_digest(self.path))
+        with open(self.path, "ab") as f:
+            f.write(self.sig_mgr.SIG_BOUNDARY + json.dumps({"sig": sig_b64, "cert": cert_pem}).encode())
+        self.assertEqual(BaseHandler().get_signature(self.path, self.sig_mgr)[0], "valid")
+        self.assertTrue(self.sig_mgr.verify_signature(original, sig_b64, cert_pem)[0])
+
+    def test_key_id_lookup_without_embedded_cert(self):
+        digest = file_digest(self.path)
+        bundle = self.sig_mgr.sign_bundle(digest)
+        # 同一身份的私钥只解析一次
+        self.assertIs(self.sig_mgr.keyring.signer()[0], self.sig_mgr.keyring.signer("default")[0])
+        self.assertEqual(bundle["kid"], key_id(self.sig_mgr.keyring.load_cert(bundle["cert"])))
+        self.assertTrue(self.sig_mgr.verify_digest(digest, bundle["sig"], kid=bundle["kid"])[0])
+        self.assertFalse(self.sig_mgr.verify_digest(digest, bundle["sig"], kid="0" * 64)[0])
+
+    def test_fast_identity_algorithms(self):
+        for algorithm in ("ed25519", "ecdsa-p256"):
+            keys_dir = tempfile.mkdtemp()
+            try:
+                sig_mgr = SignatureManager(keys_dir=keys_dir)
+                sig_mgr.create_identity("Fast", "fast@test.com", algorithm=algorithm)
+                handler = BaseHandler()
+                self.assertTrue(handler.attach_signature(self.path, sig_mgr))
+                with open(self.path, "rb") as f:
+                    self.assertEqual(sig_mgr.read_signature(f)[1]["alg"], SIG_ALGORITHMS[algorithm])
+                self.assertEqual(handler.get_signature(self.path, sig_mgr)[0], "valid")
+                # 签名包声明的算法与证书密钥类型不符时拒绝
+                digest = file_digest(self.path)
+                bundle = sig_mgr.sign_bundle(digest)
+                self.assertFalse(sig_mgr.verify_digest(digest, bundle["sig"], bundle["cert"], alg="rsa-pss-sha256")[0])
+            finally:
+                shutil.rmtree(keys_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()